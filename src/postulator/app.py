@@ -1,16 +1,37 @@
-from src.postulator.crew import Postulator
 from src.postulator.data_structures.custom_data_structures import *
 import json
 import os
 import streamlit as st
 from src.postulator.utils import *
+from src.postulator.quota import quota_service
+from src.postulator.storage import usage_key
 from streamlit_gsheets import GSheetsConnection
 
 from src.postulator.data_structures.custom_data_structures import CV, PersonalInfo, Education, Experience, Project, Skills
 
 from src.postulator.translations import TRANSLATIONS
 
-from streamlit_pdf_viewer import pdf_viewer
+
+def run_context_from_session():
+    """Builds the context of a generation from the information entered by the user."""
+    from src.postulator.run_context import RunContext
+
+    return RunContext(
+        sender=SenderInfo(
+            name=st.session_state.sender_name,
+            address=st.session_state.sender_address,
+            email=st.session_state.sender_email,
+            phone=str(st.session_state.sender_phone),
+        ),
+        recipient=RecipientInfo(
+            name=st.session_state.recipient_name,
+            institution=st.session_state.recipient_institution,
+            department=st.session_state.recipient_department,
+            address=st.session_state.recipient_address,
+        ),
+        language=st.session_state.language,
+        output_dir=st.session_state.workspace or "output",
+    )
 
 def app():
     # Set page config
@@ -70,6 +91,8 @@ def app():
         st.session_state.latex_letter = None
     if 'cv_path' not in st.session_state:
         st.session_state.cv_path = None
+    if 'workspace' not in st.session_state:
+        st.session_state.workspace = None
     if 'i' not in st.session_state:
         st.session_state.i = 0
     if 'api_key_validated' not in st.session_state:
@@ -132,15 +155,20 @@ def app():
         col1, col2 = st.columns(2)
         with col1:
             if st.button(t["submit"], key="submit_api_key"):
-                is_valid, message = validate_api_key(api_key.replace(" ",""))
+                # The key is checked while the profile is read, the profile only reaches the session (and the disk) once the key is valid
+                validation = validate_api_key_async(api_key.replace(" ",""))
+
+                from src.postulator.utils import load_from_gsheet, read_profile
+
+                rows = read_profile(conn, api_key)
+
+                is_valid, message = validation.result()
                 if is_valid:
                     st.session_state.api_key_validated = True
                     os.environ["GEMINI_API_KEY"] = api_key
                     st.session_state.api_key_provided = True
 
-                    from src.postulator.utils import load_from_gsheet
-
-                    load_from_gsheet(conn, api_key)
+                    load_from_gsheet(conn, api_key, rows)
 
                     st.rerun()
                 else:
@@ -185,36 +213,50 @@ def app():
             if uploaded_cv:
                 st.success(f"Successfully uploaded: {uploaded_cv.name}")
 
-                file_path = os.path.join("input", (os.environ["GEMINI_API_KEY"])[:5] + "tmp_cv.pdf")
-                st.session_state.cv_path_pdf = file_path
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_cv.getvalue())
+                # Parsed CVs are cached by the hash of the file, a re-upload is served instantly
+                from src.postulator.cache import sha256_bytes
+                from src.postulator.cv_cache import cv_cache
+                cv_bytes = uploaded_cv.getvalue()
+                digest = sha256_bytes(cv_bytes)
+                st.session_state.cv_path_pdf = uploaded_cv.name
 
-                import pymupdf4llm
+                cv_pdf = cv_cache().get_markdown(digest)
+                if cv_pdf is None:
+                    # A unique name, two users sharing the same key must not overwrite each other's CV
+                    import tempfile
+                    fd, file_path = tempfile.mkstemp(prefix="tmp_cv_", suffix=".pdf", dir="input")
+                    os.close(fd)
+                    with open(file_path, "wb") as f:
+                        f.write(cv_bytes)
 
-                cv_pdf = pymupdf4llm.to_markdown(file_path)
+                    import pymupdf4llm
 
-                print("CV from pdf: \n", cv_pdf)
+                    cv_pdf = pymupdf4llm.to_markdown(file_path)
+                    cv_cache().set_markdown(digest, cv_pdf)
 
-                #st.session_state.tmp_cv_pdf = cv_pdf
-
-                from src.postulator.crew import CVParser
+                    # Delete the temporary PDF file
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                        print(f"Temporary file {file_path} deleted successfully")
 
-                inputs = {
-                    "schema": CV.model_json_schema(),
-                    "cv_pdf": cv_pdf,
-                }
+                print("CV from pdf: \n", cv_pdf)
 
-                result = CVParser(os.environ["GEMINI_API_KEY"]).crew().kickoff(inputs=inputs).raw#.replace("```json", "").replace("```", "")
+                #st.session_state.tmp_cv_pdf = cv_pdf
 
-                print(result)
+                st.session_state.cv_pydantic = cv_cache().get_cv(digest)
+                if st.session_state.cv_pydantic is not None:
+                    print("CV loaded from cache")
+                else:
+                    # Rules extract the usual sections, the LLM only parses the ones they are not sure about
+                    from streamlit.runtime.scriptrunner import get_script_run_ctx
+                    from src.postulator.cv_extraction import parse_cv
+                    st.session_state.cv_pydantic, extraction = parse_cv(cv_pdf, os.environ["GEMINI_API_KEY"], session_id=get_script_run_ctx().session_id)
 
-                # Delete the temporary PDF file
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    print(f"Temporary file {file_path} deleted successfully")
+                    if st.session_state.cv_pydantic is not None:
+                        cv_cache().set_cv(digest, st.session_state.cv_pydantic)
 
-                print(st.session_state.cv_pydantic.model_dump_json(indent=4))
+                if st.session_state.cv_pydantic:
+                    print(st.session_state.cv_pydantic.model_dump_json(indent=4))
 
                 st.warning("It is an experimental feature. Please check below if your CV is correctly parsed.")
 
@@ -490,7 +532,7 @@ def app():
                         st.session_state.sender_phone and 
                         st.session_state.recipient_institution):
                     st.error("Please fill in all required fields")
-                elif (not st.session_state.api_key_provided) and st.session_state.user_usage >= 2:
+                elif (not st.session_state.api_key_provided) and not quota_service(conn).allowed(usage_key(st.session_state.sender_name)):
                     st.error("You reached the limit of 2 letters without providing your API key. Please provide your API key to run the app for free.")
                 else:
                     print("Write-up: ", st.session_state.personal_writeup)
@@ -514,10 +556,34 @@ def app():
                                 "resume" : st.session_state.cv_text if st.session_state.cv_text else st.session_state.cv_pydantic.model_dump_json() #st.session_state.cv_pydantic.model_dump_json() if st.session_state.cv_form else st.session_state.cv_text,
                                 } 
 
-                            # Generate letter
-                            result = Postulator(os.environ["GEMINI_API_KEY"],st.session_state.cv_path).crew().kickoff(inputs=inputs)
+                            # Each generation gets its own directory, so concurrent sessions never share files
+                            from src.postulator.workspace import create_workspace, remove_workspace, cleanup_workspaces
+                            remove_workspace(st.session_state.workspace)
+                            cleanup_workspaces()
+                            st.session_state.workspace = create_workspace()
+
+                            # Everything the tools need is given explicitly, they never touch the session state
+                            run_context = run_context_from_session()
+
+                            # Generate letter (independent tasks run concurrently)
+                            from streamlit.runtime.scriptrunner import get_script_run_ctx
+                            # The crew of the previous generation of the session is reused, only the run context changes
+                            from src.postulator.pool import pooled_postulator
+                            with pooled_postulator(os.environ["GEMINI_API_KEY"], st.session_state.cv_path, run_context, dag=True, session_id=get_script_run_ctx().session_id) as postulator:
+                                result = postulator.run(inputs)
 
                             print(result.tasks_output)
+
+                            # Read the letter accepted by the feedback tool
+                            sink = run_context.sink
+                            if sink.pydantic_letter:
+                                st.session_state.pydantic_letter = sink.pydantic_letter
+                                st.session_state.preview_letter = sink.preview_letter
+                                st.session_state.latex_letter = sink.latex_letter
+                                st.session_state.cleaned = sink.cleaned
+                                st.session_state.feedback_asked = True
+
+                                st.session_state.user_usage = update_user_usage(conn, st.session_state.sender_name, sink.letters_saved)
                             
                             st.rerun()
                             
@@ -536,7 +602,9 @@ def app():
             st.markdown("---")
             st.markdown(f"### {t["letter_preview"]}")
 
-            if os.path.exists("output/motivation_letter_tmp.pdf"):
+            letter_pdf = os.path.join(st.session_state.workspace or "output", "motivation_letter_tmp.pdf")
+
+            if os.path.exists(letter_pdf):
                 st.markdown("""
                     <style>
                         .pdf-viewer {
@@ -546,9 +614,10 @@ def app():
                         }
                     </style>
                 """, unsafe_allow_html=True)
+                from streamlit_pdf_viewer import pdf_viewer
                 with st.container():
                     st.markdown('<div class="pdf-viewer">', unsafe_allow_html=True)
-                    pdf_viewer("output/motivation_letter_tmp.pdf",
+                    pdf_viewer(letter_pdf,
                             height=1200,
                             rendering= "unwrap",
                             )
@@ -560,8 +629,9 @@ def app():
             col1, col2 = st.columns([1, 1])
 
             with col1:
-                with open("output/motivation_letter_tmp.pdf", "rb") as pdf_file:
-                    pdf_bytes = pdf_file.read()
+                if os.path.exists(letter_pdf):
+                    with open(letter_pdf, "rb") as pdf_file:
+                        pdf_bytes = pdf_file.read()
                     if st.download_button(
                                 label=t["download_pdf"],
                                 data=pdf_bytes,
@@ -656,36 +726,15 @@ def app():
                     st.session_state.pydantic_letter.subject = subject
 
                     from src.postulator.tools.custom_tool import letter_writer
-                    latex_letter = letter_writer._letter_from_pydantic(pydantic_letter)
+                    run_context = run_context_from_session()
+                    latex_letter = letter_writer._letter_from_pydantic(pydantic_letter, run_context)
                     st.session_state.latex_letter = latex_letter
 
-                    # Compile the updated letter
-                    try:
-                        with open("output/motivation_letter_tmp.tex", 'w', encoding='utf-8') as file:
-                            file.write(latex_letter)
-
-                        import subprocess
-
-                        # Run pdflatex to compile the document (twice for references)
-                        try:
-                            subprocess.run(
-                                ["pdflatex", "-interaction=nonstopmode", "-output-directory", "output", "output/motivation_letter_tmp.tex"],
-                                check=True,
-                                capture_output=True,
-                                text=True
-                            )
-                            # Run again to resolve references (e.g., table of contents)
-                            subprocess.run(
-                                ["pdflatex", "-interaction=nonstopmode", "-output-directory", "output", "output/motivation_letter_tmp.tex"],
-                                check=True,
-                                capture_output=True,
-                                text=True
-                            )
-                        except subprocess.CalledProcessError as e:
-                            print(f"Compilation failed: {e.stderr}")
-
-                    except Exception as e:
-                        print(f"Error writing to file: {str(e)}")
+                    # Render the updated letter in the workspace of the run
+                    from src.postulator.renderers import letter_renderer
+                    compiled = letter_renderer().render(pydantic_letter, run_context, "motivation_letter_tmp")
+                    if not compiled.success:
+                        print(f"Compilation failed: {compiled.error}")
 
                     st.session_state.edit_mode = False
 
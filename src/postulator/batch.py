@@ -0,0 +1,239 @@
+"""
+Headless batch generation of motivation letters.
+
+Usage:
+    python -m src.postulator.batch --cv resume.md --postings postings.jsonl --out output/batch
+
+The postings file is a JSONL or CSV file with one job posting per line and the
+columns `job_posting` (URL or text), `language`, `recipient_name`,
+`recipient_institution`, `recipient_department`, `recipient_address` and
+optionally `id` and `personal_writeup`; the ids must be unique. Each letter
+is written to its own directory `<out>/<id>/`:
+    - resume.md: the resume given to the crew;
+    - letter.json: the letter accepted by the feedback tool;
+    - motivation_letter.tex and motivation_letter.pdf: the compiled letter;
+    - tailored_resume.md and motivation_letter.json: the raw outputs of the
+      resume strategy and letter tasks.
+Postings already generated are skipped when the command is run again.
+"""
+import sys
+
+try:
+    __import__('pysqlite3')
+    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+except ImportError:
+    pass
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+from src.postulator.data_structures.custom_data_structures import CV
+
+RECIPIENT_FIELDS = ["recipient_name", "recipient_institution", "recipient_department", "recipient_address"]
+
+
+def read_postings(path: str) -> List[Dict[str, str]]:
+    """Reads the job postings of a JSONL or CSV file and gives each of them a unique id.
+
+    Postings sharing an id would be written to the same directory, so they are rejected.
+    """
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            postings = [dict(row) for row in csv.DictReader(f)]
+        else:
+            postings = [json.loads(line) for line in f if line.strip()]
+
+    for i, posting in enumerate(postings):
+        posting["job_posting"] = posting.get("job_posting") or posting.get("url") or posting.get("text") or ""
+        posting["id"] = str(posting.get("id") or f"{i:04d}")
+        posting.setdefault("language", "English")
+
+    counts = Counter(posting["id"] for posting in postings)
+    duplicates = sorted(posting_id for posting_id, count in counts.items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Duplicate posting ids in {path}: {', '.join(duplicates)}")
+    return postings
+
+
+def read_progress(out_dir: str) -> Dict[str, Dict]:
+    """Returns the last recorded status of every posting of a previous run."""
+    progress = {}
+    path = os.path.join(out_dir, "progress.jsonl")
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    progress[record["id"]] = record
+    return progress
+
+
+def record_progress(out_dir: str, record: Dict) -> None:
+    """Appends the status of a posting to the progress file."""
+    with open(os.path.join(out_dir, "progress.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def generate_letter(posting: Dict[str, str], cv_text: str, sender: Dict[str, str], api_key: str, job_dir: str) -> Dict:
+    """Generates the letter of one posting into its own directory."""
+    from src.postulator.crew import Postulator
+    from src.postulator.data_structures.custom_data_structures import MotivationLetter, RecipientInfo, SenderInfo
+    from src.postulator.run_context import RunContext
+
+    start = time.time()
+    cv_path = os.path.join(job_dir, "resume.md")
+    with open(cv_path, "w", encoding="utf-8") as f:
+        f.write(cv_text)
+
+    run_context = RunContext(
+        sender=SenderInfo(
+            name=sender["sender_name"],
+            address=sender["sender_address"],
+            email=sender["sender_email"],
+            phone=sender["sender_phone"],
+        ),
+        recipient=RecipientInfo(
+            name=posting.get("recipient_name") or None,
+            institution=posting.get("recipient_institution") or "",
+            department=posting.get("recipient_department") or None,
+            address=posting.get("recipient_address") or None,
+        ),
+        language=posting["language"],
+        output_dir=job_dir,
+    )
+    inputs = {
+        "job_posting": posting["job_posting"],
+        "language": posting["language"],
+        "personal_writeup": posting.get("personal_writeup") or "",
+        "schema": json.dumps(MotivationLetter.model_json_schema()),
+        "resume": cv_text,
+    }
+    Postulator(api_key, cv_path, run_context, dag=True, session_id=posting["id"]).run(inputs)
+
+    letter = run_context.sink.pydantic_letter
+    if letter is None:
+        raise RuntimeError("No letter was accepted by the feedback tool")
+
+    with open(os.path.join(job_dir, "letter.json"), "w", encoding="utf-8") as f:
+        f.write(letter.model_dump_json(indent=2))
+    for source, target in [("motivation_letter_tmp.tex", "motivation_letter.tex"),
+                           ("motivation_letter_tmp.pdf", "motivation_letter.pdf")]:
+        if os.path.exists(run_context.output_path(source)):
+            shutil.move(run_context.output_path(source), os.path.join(job_dir, target))
+    return {"pdf": os.path.exists(os.path.join(job_dir, "motivation_letter.pdf")), "seconds": time.time() - start}
+
+
+def load_cv(path: str) -> Tuple[str, Dict[str, str]]:
+    """Returns the resume text and the sender information found in it.
+
+    A JSON file is parsed as a `CV`, any other file is used as plain text.
+    """
+    with open(path, encoding="utf-8") as f:
+        cv_text = f.read()
+    sender = {"sender_name": "", "sender_email": "", "sender_address": "", "sender_phone": ""}
+    if path.lower().endswith(".json"):
+        cv = CV.model_validate_json(cv_text)
+        sender = {
+            "sender_name": cv.personal_info.name,
+            "sender_email": cv.personal_info.email,
+            "sender_address": cv.personal_info.location,
+            "sender_phone": cv.personal_info.phone,
+        }
+    return cv_text, sender
+
+
+def run_batch(cv_path: str, postings_path: str, out_dir: str, workers: int, api_key: str,
+              sender_overrides: Dict[str, str]) -> Dict:
+    """Generates the letters of all the postings not generated yet and returns the summary."""
+    os.makedirs(out_dir, exist_ok=True)
+
+    cv_text, sender = load_cv(cv_path)
+    sender.update({key: value for key, value in sender_overrides.items() if value})
+    postings = read_postings(postings_path)
+    progress = read_progress(out_dir)
+
+    results = {}
+    todo = []
+    for posting in postings:
+        previous = progress.get(posting["id"])
+        if previous and previous["status"] == "done" and os.path.exists(os.path.join(out_dir, posting["id"], "letter.json")):
+            results[posting["id"]] = dict(previous, status="skipped")
+        else:
+            todo.append(posting)
+
+    print(f"{len(postings)} postings, {len(postings) - len(todo)} already done, {len(todo)} to generate")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for posting in todo:
+            job_dir = os.path.join(out_dir, posting["id"])
+            os.makedirs(job_dir, exist_ok=True)
+            future = executor.submit(generate_letter, posting, cv_text, sender, api_key, job_dir)
+            futures[future] = (posting, time.time())
+
+        for future in as_completed(futures):
+            posting, start = futures[future]
+            record = {"id": posting["id"], "job_posting": posting["job_posting"][:200], "seconds": time.time() - start}
+            try:
+                record.update(future.result(), status="done")
+            except Exception as e:
+                record.update(status="failed", error=str(e))
+            record_progress(out_dir, record)
+            results[posting["id"]] = record
+            print(f"[{len(results)}/{len(postings)}] {posting['id']}: {record['status']} ({record['seconds']:.0f}s)")
+
+    summary = {
+        "postings": len(postings),
+        "done": sum(1 for record in results.values() if record["status"] == "done"),
+        "skipped": sum(1 for record in results.values() if record["status"] == "skipped"),
+        "failed": sum(1 for record in results.values() if record["status"] == "failed"),
+        "results": [results[posting["id"]] for posting in postings],
+    }
+    with open(os.path.join(out_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main() -> None:
+    load_dotenv(".env")
+    parser = argparse.ArgumentParser(description="Generate motivation letters for many job postings.")
+    parser.add_argument("--cv", required=True, help="Resume as a markdown/text file or as a CV JSON file")
+    parser.add_argument("--postings", required=True, help="JSONL or CSV file of job postings")
+    parser.add_argument("--out", default=os.path.join("output", "batch"), help="Output directory")
+    parser.add_argument("--workers", type=int, default=2, help="Number of letters generated concurrently")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"), help="Gemini API key")
+    parser.add_argument("--sender-name", default="")
+    parser.add_argument("--sender-email", default="")
+    parser.add_argument("--sender-address", default="")
+    parser.add_argument("--sender-phone", default="")
+    args = parser.parse_args()
+
+    if not args.api_key:
+        parser.error("A Gemini API key is required (--api-key or GEMINI_API_KEY)")
+
+    summary = run_batch(
+        args.cv, args.postings, args.out, args.workers, args.api_key,
+        {
+            "sender_name": args.sender_name,
+            "sender_email": args.sender_email,
+            "sender_address": args.sender_address,
+            "sender_phone": args.sender_phone,
+        },
+    )
+    print(f"Done: {summary['done']}, skipped: {summary['skipped']}, failed: {summary['failed']}")
+    for record in summary["results"]:
+        if record["status"] == "failed":
+            print(f"  {record['id']}: {record.get('error')}")
+
+
+if __name__ == "__main__":
+    main()
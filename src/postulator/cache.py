@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+CACHE_DIR = os.environ.get("POSTULATOR_CACHE_DIR", ".cache")
+
+
+def cache_path(name: str) -> str:
+    """Returns the path of a cache file or directory inside the cache directory."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, name)
+
+
+def sha256_bytes(data: bytes) -> str:
+    """Returns the hexadecimal SHA-256 digest of some bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def directory_size(path: str) -> int:
+    """Returns the total size in bytes of the files inside a directory."""
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def prune_directory(path: str, max_bytes: int, keep: Optional[str] = None) -> None:
+    """Removes the least recently used entries until `path` fits in `max_bytes`.
+
+    Args:
+        path: Directory holding one subdirectory or file per cached item
+        max_bytes: Maximum total size of the directory
+        keep: Name of an entry that must never be removed
+    """
+    if not os.path.isdir(path):
+        return
+    entries = []
+    for name in os.listdir(path):
+        entry = os.path.join(path, name)
+        size = directory_size(entry) if os.path.isdir(entry) else os.path.getsize(entry)
+        entries.append((os.path.getmtime(entry), name, size))
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        entry = os.path.join(path, name)
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+        total -= size
+
+
+class DiskCache:
+    """Persistent key/value cache stored in a SQLite file.
+
+    Entries expire after `ttl` seconds and the least recently used entries are
+    evicted once the cache holds more than `max_entries` entries or more than
+    `max_bytes` bytes. The cache can be shared between threads and processes.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None) -> None:
+        """
+        Args:
+            path: Path of the SQLite file
+            ttl: Time to live of an entry in seconds (None: never expires)
+            max_entries: Maximum number of entries (None: unbounded)
+            max_bytes: Maximum total size of the values (None: unbounded)
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value stored under `key`, or None if it is missing or expired."""
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if row is None else bytes(row[0])
+
+    def set(self, key: str, value: bytes) -> None:
+        """Stores `value` under `key` and evicts entries if the cache is full."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            self._evict(db, now)
+
+    def delete(self, key: str) -> None:
+        """Removes `key` from the cache."""
+        with self._connect() as db:
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def keys(self, prefix: str = "") -> List[str]:
+        """Returns the keys of the cache starting with `prefix`."""
+        with self._connect() as db:
+            rows = db.execute("SELECT key FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_json(self, key: str) -> Any:
+        """Returns the JSON value stored under `key`, or None."""
+        value = self.get(key)
+        return None if value is None else json.loads(value.decode("utf-8"))
+
+    def set_json(self, key: str, value: Any) -> None:
+        """Stores a JSON serializable value under `key`."""
+        self.set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        if self.ttl is not None:
+            db.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            db.execute(
+                "DELETE FROM entries WHERE key IN ("
+                " SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        if self.max_bytes is not None:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            rows = db.execute("SELECT key, size FROM entries ORDER BY accessed_at ASC").fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit/miss counters and the current size of the cache."""
+        with self._connect() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
@@ -1,30 +1,90 @@
-from crewai import Agent, Crew, Process, Task, LLM
+from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 
 ## Load environment variables ##
 import os
+import threading
 from dotenv import load_dotenv
 load_dotenv(".env")
 
-import streamlit as st
-os.environ["SERPER_API_KEY"] = st.secrets["serper_api_key"]
+from src.postulator.tools.custom_tool import human_feedback, final_response_cleaner, PdfReaderTool, cv_final_response_cleaner
+from src.postulator.scheduler import run_dag, format_timings, task_name
+from src.postulator.research_cache import ResearchCache
+from src.postulator.cache import cache_path, prune_directory, sha256_bytes
+from src.postulator.pool import pooled_llm
+from src.postulator.instrumentation import Tracer
+from src.postulator.prompt_budget import PromptBudget
+from src.postulator.data_structures.custom_data_structures import CV
 
 ## Load tools ##
-from crewai_tools import (
-  FileReadTool,
-  ScrapeWebsiteTool,
-  MDXSearchTool,
-  SerperDevTool,
-)
-from src.postulator.tools.custom_tool import human_feedback, final_response_cleaner, PdfReaderTool, cv_final_response_cleaner
+def _search_tool():
+	from crewai_tools import SerperDevTool
+	if "SERPER_API_KEY" not in os.environ:
+		import streamlit as st
+		os.environ["SERPER_API_KEY"] = st.secrets["serper_api_key"]
+	return SerperDevTool()
+
+def _scrape_tool():
+	from crewai_tools import ScrapeWebsiteTool
+	return ScrapeWebsiteTool()
+
+def _file_read_tool(file_path=None):
+	from crewai_tools import FileReadTool
+	return FileReadTool(file_path=file_path) if file_path else FileReadTool()
+
+# Tools without state, shared by all the crews and only built when a crew first needs them
+_tool_factories = {
+	"search": _search_tool,
+	"scrape": _scrape_tool,
+	"read_file": _file_read_tool,
+	"read_pdf": PdfReaderTool,
+	"read_resume_template": lambda: _file_read_tool('input/resume_template.tex'),
+	"response_cleaner_md": lambda: final_response_cleaner(strings_to_remove=["```md", "```markdown", "```", "'''md", "'''markdown", "'''"], result_as_answer=True),
+	"read_motivation_letter_example": lambda: _file_read_tool('input/example_motivation_letter.txt'),
+}
+_tools = {}
+
+def shared_tool(name):
+	"""Returns the shared tool called `name`, built on first use."""
+	if name not in _tools:
+		_tools[name] = _tool_factories[name]()
+	return _tools[name]
+
+# Maximum disk space used by the resume vector indexes
+EMBEDDINGS_MAX_BYTES = 200 * 1024 * 1024
+
+_research_cache = None
+_research_cache_lock = threading.Lock()
+
+def research_cache() -> ResearchCache:
+	"""Returns the research cache shared by all the crews of the process."""
+	global _research_cache
+	if _research_cache is None:
+		with _research_cache_lock:
+			if _research_cache is None:
+				_research_cache = ResearchCache()
+	return _research_cache
 
-search_tool = SerperDevTool()
-scrape_tool = ScrapeWebsiteTool()
-read_file = FileReadTool()
-read_pdf = PdfReaderTool()
-read_resume_template = FileReadTool(file_path='input/resume_template.tex')
-response_cleaner_md = final_response_cleaner(strings_to_remove=["```md", "```markdown", "```", "'''md", "'''markdown", "'''"], result_as_answer=True)
-read_motivation_letter_example = FileReadTool(file_path='input/example_motivation_letter.txt')
+def reset_run_state(agents, tasks) -> None:
+	"""Clears what crewai accumulates on agents and tasks during a kickoff, so that a pooled crew starts each run fresh.
+
+	The executions counted against `max_retry_limit`, the token usage, the tool
+	results cache and the task counters would otherwise add up across runs.
+	"""
+	from crewai.agents.agent_builder.utilities.base_token_process import TokenProcess
+	from crewai.agents.cache.cache_handler import CacheHandler
+
+	for agent in agents:
+		agent._times_executed = 0
+		agent._token_process = TokenProcess()
+		agent.set_cache_handler(CacheHandler())
+	for task in tasks:
+		task.output = None
+		task.used_tools = 0
+		task.tools_errors = 0
+		task.delegations = 0
+		if hasattr(task, "retry_count"):
+			task.retry_count = 0
 
 @CrewBase
 class Postulator():
@@ -33,46 +93,94 @@ class Postulator():
 	agents_config = 'config/agents.yaml'
 	tasks_config = 'config/tasks.yaml'
 
-	def __init__(self, llm_key, cv_path) -> None:
+	def __init__(self, llm_key, cv_path, run_context, dag=False, session_id=None) -> None:
 		super().__init__()
 		self.cv_path = cv_path
-		self.llm = LLM(
-					model=os.environ["MODEL"], 
-					api_key=llm_key,
-					temperature=0.0,
-					)
-		self.llm_creative = LLM(
-					model=os.environ["MODEL"],
-					api_key=llm_key,
-					temperature=0.1,
-					)
-		self.read_resume = FileReadTool(file_path=self.cv_path)
-		self.semantic_search_resume = MDXSearchTool(
-			mdx=self.cv_path,
-			config=dict(
-				llm=dict(
-					provider="google",
-					config=dict(
-						model="gemini/gemini-1.5-flash",
-						api_key=llm_key,
+		self.run_context = run_context
+		# In DAG mode the letter does not wait for the tailored resume,
+		# both are written concurrently once the analysis is done.
+		self.dag = dag
+		self.llm = pooled_llm(llm_key, temperature=0.0, session_id=session_id)
+		self.llm_creative = pooled_llm(llm_key, temperature=0.1, session_id=session_id)
+		self.llm_key = llm_key
+		self.tracer = Tracer()
+		self.read_resume = _file_read_tool(self.cv_path)
+		self._semantic_search_resume = None
+		self._feedback_tool = None
+
+	def prepare(self, run_context) -> "Postulator":
+		"""Binds the crew to a new run, so that a pooled crew can be reused.
+
+		Only the run context and the trace change between two runs, the agents,
+		tasks and tools are kept, with the state crewai left on them cleared.
+		"""
+		self.run_context = run_context
+		self.tracer = Tracer()
+		reset_run_state(
+			[self.researcher(), self.profile_matcher(), self.resume_strategist(), self.motivation_specialist()],
+			[self.research_task(), self.strength_weakness_analysis_task(), self.resume_strategy_task(), self.motivation_letter_task()],
+		)
+		if self._feedback_tool is not None:
+			self._feedback_tool._run_context = run_context
+		return self
+
+	def trace_step(self, step) -> None:
+		# The agents keep this method, the tracer is the one of the current run
+		self.tracer.step_callback(step)
+
+	def semantic_search_resume(self) -> "MDXSearchTool":
+		"""Returns a semantic search tool over the resume, built on first use.
+
+		The vector index is stored under the SHA-256 of the resume content so the
+		resume is only embedded once, whatever the generation or session.
+		"""
+		if self._semantic_search_resume is None:
+			with open(self.cv_path, "rb") as f:
+				digest = sha256_bytes(f.read())
+			index_root = cache_path("embeddings")
+			index_dir = os.path.join(index_root, digest)
+			os.makedirs(index_dir, exist_ok=True)
+			# Mark the index as recently used before evicting the others
+			os.utime(index_dir)
+			prune_directory(index_root, EMBEDDINGS_MAX_BYTES, keep=digest)
+
+			from crewai_tools import MDXSearchTool
+			self._semantic_search_resume = MDXSearchTool(
+				mdx=self.cv_path,
+				config=dict(
+					llm=dict(
+						provider="google",
+						config=dict(
+							model="gemini/gemini-1.5-flash",
+							api_key=self.llm_key,
+						),
+					),
+					embedder=dict(
+						provider="google",
+						config=dict(
+							model="models/embedding-001",
+							task_type="retrieval_document",
+						),
 					),
-				),
-				embedder=dict(
-					provider="google",
-					config=dict(
-						model="models/embedding-001",
-						task_type="retrieval_document",
+					vectordb=dict(
+						provider="chroma",
+						config=dict(
+							collection_name="resume-" + digest[:32],
+							dir=index_dir,
+							allow_reset=True,
+						),
 					),
-				),
+				)
 			)
-		)
+		return self._semantic_search_resume
 
 	@agent
 	def researcher(self) -> Agent:
 		return Agent(
 			config=self.agents_config['researcher'],
-			tools = [scrape_tool, search_tool, read_file, read_pdf],
+			tools = [shared_tool('scrape'), shared_tool('search'), shared_tool('read_file'), shared_tool('read_pdf')],
 			verbose=True,
+			step_callback=self.trace_step,
 			llm = self.llm,
 			max_retry_limit=10
 		)
@@ -83,6 +191,7 @@ class Postulator():
 			config=self.agents_config['profile_matcher'],
 			tools = [],
 			verbose=True,
+			step_callback=self.trace_step,
 			llm = self.llm,
 			max_retry_limit=10
 		)
@@ -91,23 +200,26 @@ class Postulator():
 	def resume_strategist(self) -> Agent:
 		return Agent(
 			config=self.agents_config['resume_strategist'],
-			tools = [scrape_tool,
-					 read_resume_template,
-					 response_cleaner_md,
+			tools = [shared_tool('scrape'),
+					 shared_tool('read_resume_template'),
+					 shared_tool('response_cleaner_md'),
 					 ],
 			verbose=True,
+			step_callback=self.trace_step,
 			llm = self.llm,
 			max_retry_limit=10
 		)
 	
 	@agent
 	def motivation_specialist(self) -> Agent:
+		self._feedback_tool = human_feedback(run_context=self.run_context)
 		return Agent(
 			config=self.agents_config['motivation_specialist'],
-			tools = [read_motivation_letter_example,
-					 human_feedback(),
+			tools = [shared_tool('read_motivation_letter_example'),
+					 self._feedback_tool,
 					],
 			verbose=True,
+			step_callback=self.trace_step,
 			llm = self.llm_creative,
 			max_retry_limit=10,
 		)
@@ -132,7 +244,6 @@ class Postulator():
 	def resume_strategy_task(self) -> Task:
 		return Task(
 			config=self.tasks_config['resume_strategy_task'],
-			output_file="output/tailored_resume.md",
     		context=[self.research_task(), self.strength_weakness_analysis_task()],
 			max_retries=10,
 		)
@@ -141,8 +252,8 @@ class Postulator():
 	def motivation_letter_task(self) -> Task:
 		return Task(
 			config=self.tasks_config['motivation_letter_task'],
-			output_file="output/motivation_letter.json",
-    		context=[self.research_task(), self.resume_strategy_task(), self.strength_weakness_analysis_task()],
+    		context=[self.research_task(), self.strength_weakness_analysis_task()] if self.dag
+					else [self.research_task(), self.resume_strategy_task(), self.strength_weakness_analysis_task()],
 			max_retries=10,
 		)
 	
@@ -163,10 +274,63 @@ class Postulator():
 					],
 			process=Process.sequential,
 			verbose=True,
-			max_rpm=15,
 			chat_llm="gemini/gemini-2.0-flash",
 		)
 
+	def run(self, inputs, max_workers=4, initializer=None, use_cache=True):
+		"""Runs the crew, as a DAG of tasks if the crew was created with `dag=True`.
+
+		The inputs are first kept within the prompt budget. In DAG mode the
+		prompts of the tasks are also deduplicated and their context truncated,
+		the output of the research task is cached per job posting, and a cache
+		hit skips the researcher entirely.
+
+		Args:
+			inputs: Inputs of the crew
+			max_workers: Number of tasks that can run concurrently in DAG mode
+			initializer: Called by each worker thread before running tasks (DAG mode)
+			use_cache: Whether to read and fill the research cache (DAG mode)
+		"""
+		crew = self.crew()
+		job_posting = inputs.get("job_posting", "")
+		prompt_budget = PromptBudget(tracer=self.tracer)
+		inputs = prompt_budget.prepare_inputs(inputs)
+		if not self.dag:
+			with self.tracer.sequence(crew):
+				result = crew.kickoff(inputs=inputs)
+			print(f"Trace saved to {self.tracer.save(crew)}")
+			self.save_outputs(crew, result)
+			return result
+
+		research_task = self.research_task()
+		research_index = next(i for i, task in enumerate(crew.tasks) if task is research_task)
+
+		precomputed = {}
+		research = research_cache().get(job_posting) if use_cache else None
+		if research is not None:
+			print("Research output loaded from cache")
+			precomputed[task_name(research_task, research_index)] = research
+
+		result, timings = run_dag(crew, inputs, max_workers=max_workers, precomputed=precomputed,
+								  initializer=initializer, tracer=self.tracer, prompt_budget=prompt_budget)
+		print(format_timings(timings))
+		print(prompt_budget.report())
+		print(f"Trace saved to {self.tracer.save(crew)}")
+
+		if use_cache and research is None:
+			research_cache().set(job_posting, result.tasks_output[research_index].raw)
+		self.save_outputs(crew, result)
+		return result
+
+	def save_outputs(self, crew, result) -> None:
+		"""Writes the tailored resume and the letter to the output directory of the run."""
+		outputs = {id(task): output for task, output in zip(crew.tasks, result.tasks_output)}
+		for task, file_name in [(self.resume_strategy_task(), "tailored_resume.md"),
+								(self.motivation_letter_task(), "motivation_letter.json")]:
+			if id(task) in outputs:
+				with open(self.run_context.output_path(file_name), "w", encoding="utf-8") as f:
+					f.write(outputs[id(task)].raw)
+
 
 
 @CrewBase
@@ -176,22 +340,51 @@ class CVParser():
 	agents_config = 'config/parser_agent.yaml'
 	tasks_config = 'config/parser_task.yaml'
 
-	def __init__(self, llm_key) -> None:
+	def __init__(self, llm_key, sink, session_id=None, model=CV, max_retries=10) -> None:
 		super().__init__()
-		self.llm = LLM(
-					model=os.environ["MODEL"], 
-					api_key=llm_key,
-					temperature=0.0,
-					)
+		self.sink = sink
+		# The CV, or a model holding only the sections to parse
+		self.model = model
+		self.max_retries = max_retries
+		self.llm = pooled_llm(llm_key, temperature=0.0, session_id=session_id)
+		self.tracer = Tracer()
+		self._cleaner_tool = None
+
+	def prepare(self, sink) -> "CVParser":
+		"""Binds the crew to a new parse, so that a pooled crew can be reused."""
+		self.sink = sink
+		self.tracer = Tracer()
+		reset_run_state([self.cv_parser()], [self.cv_parser_task()])
+		if self._cleaner_tool is not None:
+			self._cleaner_tool._sink = sink
+		return self
+
+	def trace_step(self, step) -> None:
+		# The agent keeps this method, the tracer is the one of the current parse
+		self.tracer.step_callback(step)
+
+	def run(self, inputs):
+		"""Parses a CV, recording the task, LLM calls and tool calls in a trace."""
+		crew = self.crew()
+		with self.tracer.sequence(crew):
+			result = crew.kickoff(inputs=inputs)
+		print(f"Trace saved to {self.tracer.save(crew)}")
+		return result
+
+	def cleaner_tool(self):
+		if self._cleaner_tool is None:
+			self._cleaner_tool = cv_final_response_cleaner(sink=self.sink, model=self.model)
+		return self._cleaner_tool
 
 	@agent
 	def cv_parser(self) -> Agent:
 		return Agent(
 			config= self.agents_config['cv_parser'],
-			tools = [cv_final_response_cleaner()],
+			tools = [self.cleaner_tool()],
 			verbose=True,
 			llm = self.llm,
-			max_retry_limit=10
+			max_retry_limit=self.max_retries,
+			step_callback=self.trace_step,
 		)
 
 	@task
@@ -199,7 +392,7 @@ class CVParser():
 		return Task(
 			config=self.tasks_config['cv_parser_task'],
 			context=[],
-			max_retries=10,
+			max_retries=self.max_retries,
 		)
 	
 	@crew
@@ -211,5 +404,4 @@ class CVParser():
 			tasks= self.tasks, # Automatically created by the @task decorator
 			process=Process.sequential,
 			verbose=True,
-			max_rpm=15,
 		)
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import threading
+from typing import Optional
+
+from pydantic import ValidationError
+
+from src.postulator.cache import DiskCache, cache_path
+from src.postulator.data_structures.custom_data_structures import CV
+
+# Bump when the CV parsing (prompt, extraction) changes in a way the schema does not show
+CV_PARSER_VERSION = 2
+
+
+def schema_version() -> str:
+    """Returns a tag identifying the CV schema and the parser version.
+
+    Parsed CVs stored under another tag are ignored, so changing the `CV` model
+    never serves a CV in an outdated shape.
+    """
+    schema = json.dumps(CV.model_json_schema(), sort_keys=True)
+    return f"v{CV_PARSER_VERSION}-{hashlib.sha256(schema.encode('utf-8')).hexdigest()[:12]}"
+
+
+class CVCache:
+    """Persistent cache of the uploaded CVs, keyed by the SHA-256 of the PDF.
+
+    The markdown extracted from the PDF and the parsed `CV` are stored
+    separately: the markdown stays valid when the schema changes.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 30 * 24 * 3600, max_entries: int = 1000) -> None:
+        """
+        Args:
+            path: Path of the SQLite file (defaults to the cache directory)
+            ttl: Time to live of an entry in seconds
+            max_entries: Maximum number of entries kept, least recently used first evicted
+        """
+        self.cache = DiskCache(path or cache_path("cv.sqlite"), ttl=ttl, max_entries=max_entries)
+        self.version = schema_version()
+
+    def get_markdown(self, digest: str) -> Optional[str]:
+        """Returns the markdown extracted from the PDF with this digest, if any."""
+        value = self.cache.get("md:" + digest)
+        return None if value is None else value.decode("utf-8")
+
+    def set_markdown(self, digest: str, markdown: str) -> None:
+        self.cache.set("md:" + digest, markdown.encode("utf-8"))
+
+    def get_cv(self, digest: str) -> Optional[CV]:
+        """Returns the CV parsed from the PDF with this digest, if it was parsed with the current schema."""
+        value = self.cache.get(f"cv:{self.version}:{digest}")
+        if value is None:
+            return None
+        try:
+            return CV.model_validate_json(value)
+        except ValidationError:
+            return None
+
+    def set_cv(self, digest: str, cv: CV) -> None:
+        self.cache.set(f"cv:{self.version}:{digest}", cv.model_dump_json().encode("utf-8"))
+
+
+_cv_cache = None
+_cv_cache_lock = threading.Lock()
+
+
+def cv_cache() -> CVCache:
+    """Returns the CV cache shared by all the sessions of the process."""
+    global _cv_cache
+    if _cv_cache is None:
+        with _cv_cache_lock:
+            if _cv_cache is None:
+                _cv_cache = CVCache()
+    return _cv_cache
@@ -0,0 +1,642 @@
+"""
+Rule-based extraction of a `CV` from the markdown of a PDF resume.
+
+Sections are found by their headings, and entries by their bullets and date
+ranges. Each section of the `CV` gets a confidence between 0 and 1: the
+sections the rules are confident about are used as is, and only the others are
+parsed by the LLM, from their own text and with the schema of these sections
+only.
+
+In the `sections` parsing mode (default), every such section is parsed by its
+own LLM call, in parallel and into its own model, and the long list sections
+(a CV with 10+ experiences) are split into chunks of entries. A section whose
+output fails validation is retried alone, instead of the whole CV. The
+`document` mode parses the missing sections with a single call.
+
+Benchmark the extraction on a set of markdown CVs with:
+    python -m src.postulator.cv_extraction [cv.md ...]
+
+A `<name>.json` file next to a CV, holding its expected `CV`, is used to
+check the extracted fields.
+"""
+import glob
+import json
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+from src.postulator.data_structures.custom_data_structures import (CV, Education, Experience, PersonalInfo, Project,
+                                                                   Skills)
+from src.postulator.prompt_budget import compact_schema_json
+
+# Sections with a lower confidence are parsed by the LLM
+CONFIDENCE_THRESHOLD = 0.75
+
+# Confidence that an optional section is absent when the CV has no heading for it
+ABSENT_SECTION_CONFIDENCE = 0.8
+
+# `sections`: one LLM call per section (or chunk of entries) in parallel, `document`: one call for all of them
+CV_PARSING_MODE = os.environ.get("CV_PARSING_MODE", "sections")
+CV_PARSER_WORKERS = int(os.environ.get("CV_PARSER_WORKERS", "4"))
+
+# Attempts of a section before giving up on it, and validation retries of the agent within an attempt
+SECTION_ATTEMPTS = 3
+SECTION_RETRIES = 2
+
+# List sections with more entries are parsed by chunks of this many entries
+ENTRIES_PER_CHUNK = 4
+LIST_SECTIONS = ["education", "experience", "projects"]
+
+# Sections of the CV the rules extract, in the order of the `CV` model
+SECTIONS = ["personal_info", "education", "experience", "projects", "skills"]
+
+# Keywords of the headings, without accents and in lower case
+HEADINGS = {
+    "education": ["education", "formation", "formations", "etudes", "academic background", "diplomes", "cursus"],
+    "experience": ["experience", "experiences", "professional experience", "work experience", "employment",
+                   "career", "experience professionnelle", "experiences professionnelles", "parcours professionnel",
+                   "research experience", "internships", "stages"],
+    "projects": ["projects", "projets", "personal projects", "academic projects", "selected projects", "some projects"],
+    "skills": ["skills", "competences", "technical skills", "competences techniques", "programming languages",
+               "langages de programmation", "technologies", "tools", "outils", "skills and interests"],
+    "languages": ["languages", "langues", "spoken languages"],
+    "hobbies": ["hobbies", "interests", "centres d'interet", "loisirs", "activities", "activites"],
+    "other": ["summary", "profile", "profil", "about me", "a propos", "certifications", "publications", "awards",
+              "honors", "references", "volunteering", "benevolat", "other information", "additional information",
+              "informations complementaires", "divers"],
+}
+
+# Labels of the skill lines ("Programming languages: Python, R"), checked in this order
+SKILL_LABELS = [
+    ("programming_languages", ["programm", "langages de programmation", "coding", "technical", "technolog", "framework"]),
+    ("languages", ["language", "langue", "spoken"]),
+    ("softwares", ["software", "logiciel", "tool", "outil"]),
+    ("hobbies", ["hobb", "interest", "interet", "loisir", "activit", "sport"]),
+]
+
+ROLE_KEYWORDS = ["engineer", "developer", "intern", "internship", "analyst", "manager", "researcher", "assistant",
+                 "consultant", "scientist", "lead", "head", "director", "officer", "architect", "teacher", "student",
+                 "postdoc", "ingenieur", "ingenieure", "developpeur", "developpeuse", "stagiaire", "stage",
+                 "chercheur", "chercheuse", "doctorant", "doctorante", "chef", "cheffe", "responsable", "charge", "chargee",
+                 "technicien", "professeur", "designer", "specialist", "coordinator"]
+ORGANIZATION_KEYWORDS = ["inc", "ltd", "llc", "sa", "sas", "sarl", "gmbh", "ag", "corp", "group", "groupe", "company",
+                         "university", "universite", "universitat", "lab", "laboratory", "laboratoire", "institute",
+                         "institut", "school", "ecole", "college", "cnrs", "inria", "cea", "bank", "banque", "agency",
+                         "team", "department", "club", "foundation", "hospital", "insa", "polytechnique", "epfl", "eth",
+                         "lycee", "high school", "academy", "academie", "centre", "center"]
+DEGREE_KEYWORDS = ["master", "bachelor", "phd", "ph.d", "msc", "m.sc", "bsc", "b.sc", "meng", "beng", "ms", "bs", "licence", "diplome", "doctorat",
+                   "mba", "engineering degree", "ingenieur", "baccalaureat", "bac", "dut", "bts", "degree", "classe preparatoire"]
+ACHIEVEMENT_KEYWORDS = ["honors", "honours", "rank", "mention", "cum laude", "gpa", "distinction", "valedictorian",
+                        "summa", "magna", "major", "top "]
+
+MONTH = r"(?:jan|feb|fev|fév|mar|apr|avr|may|mai|jun|juin|jul|juil|aug|aou|aoû|sep|oct|nov|dec|déc)[a-zéû]*\.?"
+YEAR = r"(?:19|20)\d{2}"
+DATE = rf"(?:{MONTH}\s+{YEAR}|\d{{1,2}}/{YEAR}|{YEAR}|{MONTH})"
+DATE_END = rf"(?:{DATE}|present|présent|current|now|today|ongoing|aujourd'hui|actuel(?:lement)?|en cours)"
+DATE_RANGE = re.compile(rf"(?<![\w/]){DATE}\s*(?:-|–|—|to|à|au|until)\s*{DATE_END}(?!\w)", re.IGNORECASE)
+SINGLE_DATE = re.compile(rf"(?<![\w/])(?:{MONTH}\s+{YEAR}|{YEAR})(?!\w)", re.IGNORECASE)
+
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+PHONE = re.compile(r"(?<!\w)\+?\(?\d[\d .\-/()]{7,}\d(?!\w)")
+URL = re.compile(r"(?:https?://|www\.)\S+|\b(?:linkedin|github)\.com/\S*", re.IGNORECASE)
+BULLET = re.compile(r"^(\s*)(?:[-*•▪◦●‣]|\d+[.)])\s+")
+BOLD = re.compile(r"\*\*(.+?)\*\*|__(.+?)__")
+ITALIC = re.compile(r"(?<!\*)\*(?!\*)([^*]+)\*(?!\*)|(?<!_)_(?!_)([^_]+)_(?!_)")
+
+
+class SectionExtraction(BaseModel):
+    """A section of the CV found by the rules."""
+    value: Any = Field(None, description="Extracted value, as plain data of the `CV` model")
+    confidence: float = Field(0.0, description="Confidence in the value, from 0 to 1")
+    text: str = Field("", description="Markdown of the section in the CV")
+
+
+class CVExtraction(BaseModel):
+    """Result of the rule-based extraction of a CV."""
+    sections: Dict[str, SectionExtraction] = Field(default_factory=dict, description="Extracted sections by field of `CV`")
+    additional_info: List[str] = Field(default_factory=list, description="Lines of the sections that do not fit elsewhere")
+    seconds: float = Field(0.0, description="Time spent extracting")
+
+    @property
+    def confidence(self) -> Dict[str, float]:
+        return {name: self.sections[name].confidence for name in SECTIONS}
+
+    def missing(self, threshold: float = CONFIDENCE_THRESHOLD) -> List[str]:
+        """Returns the sections that must be parsed by the LLM."""
+        return [name for name in SECTIONS if self.sections[name].confidence < threshold]
+
+    def merge(self, parsed: Optional[Dict[str, Any]] = None) -> CV:
+        """Returns the CV made of the extracted sections, completed with the sections parsed by the LLM."""
+        data = {name: section.value for name, section in self.sections.items()}
+        data.update(parsed or {})
+        data["additional_info"] = self.additional_info
+        return CV.model_validate(data)
+
+
+def normalize(text: str) -> str:
+    """Lower case text without accents nor markdown, for keyword matching."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r"\s+", " ", re.sub(r"[#*_:`|]", " ", text)).strip().lower()
+
+
+def clean(text: str) -> str:
+    """Removes the markdown emphasis, bullet and links of a line."""
+    text = BULLET.sub("", text)
+    text = re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", text)
+    text = text.replace("**", "").replace("__", "")
+    text = ITALIC.sub(lambda match: match.group(1) or match.group(2), text)
+    return re.sub(r"\s+", " ", text.strip("#").strip()).strip(" |")
+
+
+def has_keyword(text: str, keywords: List[str]) -> bool:
+    words = normalize(text)
+    return any(re.search(rf"(?<![a-z]){re.escape(keyword)}(?![a-z])", words) for keyword in keywords)
+
+
+def heading_section(line: str) -> Optional[str]:
+    """Returns the section a heading line opens, or None if the line is not a known heading."""
+    stripped = line.strip()
+    if not stripped or BULLET.match(line) or len(stripped) > 60:
+        return None
+    is_heading = (stripped.startswith("#") or BOLD.fullmatch(stripped.rstrip(":")) is not None
+                  or (stripped.isupper() and len(stripped) > 3) or stripped.endswith(":"))
+    if not is_heading:
+        return None
+    title = normalize(stripped)
+    matches = [(len(keyword), section) for section, keywords in HEADINGS.items() for keyword in keywords
+               if title == keyword or title.startswith(keyword + " ") or title.endswith(" " + keyword)]
+    return max(matches)[1] if matches else None
+
+
+def split_sections(markdown: str) -> Dict[str, str]:
+    """Splits the markdown of a CV into its sections; the lines before the first heading are the 'header'."""
+    sections: Dict[str, List[str]] = {"header": []}
+    current = "header"
+    for line in markdown.splitlines():
+        section = heading_section(line)
+        if section is not None:
+            current = section
+            sections.setdefault(current, [])
+            continue
+        sections[current].append(line.rstrip())
+    return {name: "\n".join(lines).strip("\n") for name, lines in sections.items()}
+
+
+def find_period(text: str) -> Optional[str]:
+    """Returns the date range (or the single date) of a line, if any."""
+    match = DATE_RANGE.search(text)
+    if match and re.search(YEAR, match.group(0)):
+        return match.group(0)
+    # A range like "April - September 2024" only has its year at the end
+    if match:
+        year = re.match(rf"\s*{YEAR}", text[match.end():])
+        if year:
+            return match.group(0) + year.group(0)
+    match = SINGLE_DATE.search(text)
+    return match.group(0) if match else None
+
+
+def split_entries(text: str) -> List[List[str]]:
+    """Splits a section into entries (a job, a degree, a project...).
+
+    With nested bullets each top-level line is an entry; otherwise a new
+    entry starts on a header line following bullets, or on a new date.
+    """
+    lines = [line for line in text.splitlines() if line.strip() and not set(line.strip()) <= set("-_*=")]
+    nested = any(BULLET.match(line) and len(BULLET.match(line).group(1)) >= 2 for line in lines)
+    entries: List[List[str]] = []
+    for line in lines:
+        bullet = BULLET.match(line)
+        top_level = bullet is None or len(bullet.group(1)) < 2
+        if bullet is None and BOLD.fullmatch(line.strip()) and not find_period(line) and entries and nested:
+            # A bold line between entries only groups them ("Personal projects")
+            continue
+        current = entries[-1] if entries else None
+        if current is None:
+            entries.append([line])
+        elif nested:
+            if top_level:
+                entries.append([line])
+            else:
+                current.append(line)
+        elif bullet is None and any(BULLET.match(previous) for previous in current):
+            entries.append([line])
+        elif find_period(line) and any(find_period(previous) for previous in current):
+            # The header lines written after the last date belong to the new entry
+            dated = max(i for i, previous in enumerate(current) if find_period(previous))
+            moved = [previous for previous in current[dated + 1:] if not BULLET.match(previous)]
+            if len(moved) == len(current) - dated - 1:
+                del current[dated + 1:]
+                entries.append(moved + [line])
+            else:
+                entries.append([line])
+        else:
+            current.append(line)
+    return entries
+
+
+def split_list(text: str) -> List[str]:
+    """Splits a comma separated list, ignoring the commas inside parentheses."""
+    items, depth, item = [], 0, ""
+    for char in text:
+        depth += char in "([" and 1 or 0
+        depth -= char in ")]" and 1 or 0
+        if char in ",;" and depth == 0:
+            items.append(item)
+            item = ""
+        else:
+            item += char
+    items.append(item)
+    return [clean(item).strip(" .") for item in items if clean(item).strip(" .")]
+
+
+def parse_header(lines: List[str]) -> Tuple[List[str], List[str], Optional[str]]:
+    """Returns the bold parts, the other parts and the period of the header lines of an entry."""
+    bold, pieces, period = [], [], None
+    for line in lines:
+        line = BULLET.sub("", line)
+        period = period or find_period(line)
+        if period:
+            line = line.replace(period, " ")
+        for match in BOLD.finditer(line):
+            bold.append(clean(match.group(1) or match.group(2)))
+        line = BOLD.sub("|", line)
+        pieces += [clean(piece) for piece in re.split(r"\s[|–—]\s|\||,|\s-\s", line) if clean(piece).strip(" -–—()")]
+    return [part for part in bold if part], [piece.strip(" -–—()") for piece in pieces], period
+
+
+def entry_parts(entry: List[str]) -> Tuple[List[str], List[str]]:
+    """Splits an entry into its header lines and its detail lines."""
+    nested = any(BULLET.match(line) and len(BULLET.match(line).group(1)) >= 2 for line in entry)
+    if nested or BULLET.match(entry[0]):
+        header = [entry[0]]
+        details = entry[1:]
+    else:
+        header = [line for line in entry if not BULLET.match(line)][:3]
+        details = [line for line in entry if line not in header]
+    return header, details
+
+
+def is_location(piece: str) -> bool:
+    """Whether a piece of a header looks like a place ("Paris", "Lausanne, Switzerland")."""
+    words = piece.split()
+    return (0 < len(words) <= 3 and all(word[:1].isupper() for word in words)
+            and not has_keyword(piece, ORGANIZATION_KEYWORDS + ROLE_KEYWORDS + DEGREE_KEYWORDS))
+
+
+def extract_personal_info(header: str, markdown: str) -> SectionExtraction:
+    lines = [clean(line) for line in header.splitlines() if clean(line)]
+    email = EMAIL.search(markdown)
+    phone = PHONE.search(header) or PHONE.search(markdown)
+    name = next((line for line in lines if not EMAIL.search(line) and not PHONE.search(line) and not URL.search(line)
+                 and 1 < len(line.split()) <= 5 and re.fullmatch(r"[^\d@]+", line)), "")
+    location = next((line for line in lines if line != name and not EMAIL.search(line) and not URL.search(line)
+                     and not PHONE.fullmatch(line) and ("," in line or re.search(r"\d{4,5}", line))
+                     and len(line) <= 80), "")
+    value = {
+        "name": name,
+        "location": location,
+        "email": email.group(0) if email else "",
+        "phone": phone.group(0).strip() if phone else "",
+    }
+    confidence = 0.35 * bool(name) + 0.3 * bool(email) + 0.2 * bool(phone) + 0.15 * bool(location)
+    return SectionExtraction(value=PersonalInfo(**value).model_dump(), confidence=round(confidence, 2), text=header)
+
+
+def extract_education(text: str) -> SectionExtraction:
+    educations, scores = [], []
+    for entry in split_entries(text):
+        header, details = entry_parts(entry)
+        bold, pieces, period = parse_header(header)
+        period = period or next((find_period(line) for line in details if find_period(line)), None)
+        candidates = bold + pieces + [clean(line) for line in details]
+        institution = next((part for part in bold + pieces if has_keyword(part, ORGANIZATION_KEYWORDS)), None) or (bold or pieces or [""])[0]
+        degree_line = next((part for part in candidates if part != institution and has_keyword(part, DEGREE_KEYWORDS)), "")
+        degree, _, achievements = degree_line.partition(",")
+        if not has_keyword(achievements, ACHIEVEMENT_KEYWORDS):
+            degree, achievements = degree_line, ""
+        location = next((piece for piece in pieces if piece != institution and is_location(piece)), "")
+        thesis = next((clean(line).split(":", 1)[-1].strip() for line in details
+                       if has_keyword(line, ["thesis", "these", "memoire", "dissertation"])), None)
+        classes = []
+        for line in details:
+            if has_keyword(line, ["classes", "courses", "cours", "coursework", "modules"]) and ":" in line:
+                classes += split_list(clean(line).split(":", 1)[1])
+        achievements = achievements.strip() or next((part for part in pieces + [clean(line) for line in details]
+                                                     if part != degree_line and has_keyword(part, ACHIEVEMENT_KEYWORDS)), None)
+        educations.append(Education(institution=institution, location=location, period=period or "", degree=degree.strip(),
+                                    achievements=achievements or None, thesis=thesis, classes=classes).model_dump())
+        scores.append(0.3 * bool(degree.strip()) + 0.3 * bool(institution) + 0.3 * bool(period) + 0.1 * bool(location))
+    return SectionExtraction(value=educations, confidence=round(min(scores), 2) if scores else 0.0, text=text)
+
+
+def extract_experience(text: str) -> SectionExtraction:
+    experiences, scores = [], []
+    for entry in split_entries(text):
+        header, details = entry_parts(entry)
+        bold, pieces, period = parse_header(header)
+        period = period or next((find_period(line) for line in details if find_period(line)), None)
+        parts = bold + [piece for piece in pieces if piece not in bold]
+        role = next((part for part in parts if has_keyword(part, ROLE_KEYWORDS)), None)
+        organization = next((part for part in parts if part != role and has_keyword(part, ORGANIZATION_KEYWORDS)), None)
+        keyword_score = 0.2 * bool(role) + 0.2 * bool(organization)
+        # The location comes last ("Deliveroo, London"), the role usually before the organization
+        others = [part for part in parts if part not in (role, organization)]
+        location = ""
+        if others and is_location(others[-1]) and (organization or len(others) > 1):
+            location = others.pop()
+        organization = organization or (others.pop(0) if others else "")
+        role = role or (others.pop(0) if others else "")
+
+        description, supervision, subject, technologies = [], None, None, []
+        for line in details:
+            line_text = clean(line)
+            label = normalize(line_text.split(":", 1)[0]) if ":" in line_text else ""
+            if re.match(r"(under the |sous la )?(joint )?(supervision|co-?supervision|direction|encadrement)", normalize(line_text)):
+                supervision = line_text
+            elif label in ("subject", "sujet", "topic"):
+                subject = line_text.split(":", 1)[1].strip()
+            elif label in ("technologies", "tools", "outils", "tech stack", "stack", "environment", "environnement"):
+                technologies += split_list(line_text.split(":", 1)[1])
+            elif line_text:
+                description.append(line_text)
+        experiences.append(Experience(organization=organization, location=location, period=period or "",
+                                      supervision=supervision, subject=subject, role=role, description=description,
+                                      technologies=technologies, skills_highlighted=None).model_dump())
+        scores.append(0.3 * bool(period) + keyword_score + 0.1 * bool(organization and role)
+                      + 0.1 * bool(location) + 0.1 * bool(description))
+    return SectionExtraction(value=experiences, confidence=round(min(scores), 2) if scores else 0.0, text=text)
+
+
+def extract_projects(text: str) -> SectionExtraction:
+    projects, scores = [], []
+    for entry in split_entries(text):
+        header, details = entry_parts(entry)
+        bold, pieces, _ = parse_header(header)
+        italics = [match.group(1) or match.group(2) for match in ITALIC.finditer(BULLET.sub("", header[0]))]
+        name = (bold or pieces or [""])[0]
+        technologies = [clean(item) for item in italics]
+        description, role = [], ""
+        for line in details:
+            line_text = clean(line)
+            label = normalize(line_text.split(":", 1)[0]) if ":" in line_text else ""
+            if label in ("technologies", "tools", "outils", "tech stack", "stack"):
+                technologies += split_list(line_text.split(":", 1)[1])
+            elif label in ("role", "rôle"):
+                role = line_text.split(":", 1)[1].strip()
+            elif line_text:
+                description.append(line_text)
+        projects.append(Project(name=name, technologies=technologies, role=role, skills_highlighted=None,
+                                description=" ".join(description)).model_dump())
+        scores.append(0.4 * bool(name) + 0.3 * bool(description or technologies) + 0.2 * bool(technologies) + 0.1 * bool(role))
+    return SectionExtraction(value=projects, confidence=round(min(scores), 2) if scores else 0.0, text=text)
+
+
+def extract_skills(sections: Dict[str, str]) -> SectionExtraction:
+    skills: Dict[str, List[str]] = {field: [] for field, _ in SKILL_LABELS}
+    assigned = unassigned = 0
+    for section, default in [("skills", None), ("languages", "languages"), ("hobbies", "hobbies")]:
+        for line in sections.get(section, "").splitlines():
+            line_text = clean(line)
+            if not line_text:
+                continue
+            label, _, items = line_text.partition(":") if ":" in line_text[:40] else ("", "", line_text)
+            field = next((field for field, keywords in SKILL_LABELS
+                          if label and any(keyword in normalize(label) for keyword in keywords)), default)
+            if field is None:
+                unassigned += 1
+                continue
+            skills[field] += split_list(items)
+            assigned += 1
+    text = "\n\n".join(sections.get(section, "") for section in ["skills", "languages", "hobbies"]).strip()
+    confidence = assigned / (assigned + unassigned) if assigned + unassigned else 0.0
+    return SectionExtraction(value=Skills(**skills).model_dump(), confidence=round(confidence, 2), text=text)
+
+
+def extract_cv(markdown: str) -> CVExtraction:
+    """Extracts the sections of a CV with rules and rates the confidence in each of them."""
+    start = time.time()
+    sections = split_sections(markdown)
+    extraction = CVExtraction(
+        sections={
+            "personal_info": extract_personal_info(sections.get("header", ""), markdown),
+            "education": extract_education(sections.get("education", "")),
+            "experience": extract_experience(sections.get("experience", "")),
+            "projects": extract_projects(sections.get("projects", "")),
+            "skills": extract_skills(sections),
+        },
+        additional_info=[clean(line) for line in sections.get("other", "").splitlines() if clean(line)],
+    )
+    # A well structured CV without a projects heading has no projects, there is nothing for the LLM to find
+    found = [name for name in ["education", "experience", "skills"] if name in sections]
+    if "projects" not in sections and len(found) >= 2:
+        extraction.sections["projects"] = SectionExtraction(value=[], confidence=ABSENT_SECTION_CONFIDENCE)
+    extraction.seconds = time.time() - start
+    return extraction
+
+
+def partial_model(sections: List[str], name: str = "PartialCV") -> type:
+    """Returns a model holding only some sections of the `CV`, used to ask the LLM for them only."""
+    return create_model(name, **{section: (CV.model_fields[section].annotation, CV.model_fields[section]) for section in sections})
+
+
+def section_chunks(name: str, text: str, markdown: str) -> List[str]:
+    """Returns the texts the LLM parses for a section, by chunks of entries for the long list sections.
+
+    Args:
+        name: Field of the `CV`
+        text: Markdown of the section, empty when the CV has no heading for it
+        markdown: Markdown of the whole CV, parsed instead of a section without heading
+    """
+    if not text:
+        return [markdown]
+    if name not in LIST_SECTIONS:
+        return [text]
+    entries = split_entries(text)
+    if len(entries) <= ENTRIES_PER_CHUNK:
+        return [text]
+    return ["\n".join(line for entry in entries[i:i + ENTRIES_PER_CHUNK] for line in entry)
+            for i in range(0, len(entries), ENTRIES_PER_CHUNK)]
+
+
+def parse_section(name: str, text: str, llm_key: str, session_id: Optional[str] = None) -> Optional[Any]:
+    """Parses one section (or chunk of a section) with the LLM, into a model holding this section only.
+
+    Returns the value of the section as plain data, or None if no output passed
+    the validation in `SECTION_ATTEMPTS` attempts.
+    """
+    from src.postulator.pool import pooled_cv_parser
+    from src.postulator.run_context import ResultSink
+
+    model = partial_model([name], "".join(part.title() for part in name.split("_")) + "Section")
+    for attempt in range(1, SECTION_ATTEMPTS + 1):
+        sink = ResultSink()
+        try:
+            with pooled_cv_parser(llm_key, sink, session_id=session_id, model=model, max_retries=SECTION_RETRIES) as parser:
+                parser.run({
+                    "schema": compact_schema_json(model.model_json_schema()),
+                    "cv_pdf": text,
+                })
+        except Exception as e:
+            print(f"Parsing of {name} failed (attempt {attempt}/{SECTION_ATTEMPTS}): {e}")
+        if sink.cv_sections is not None:
+            return sink.cv_sections[name]
+        print(f"No valid {name} parsed (attempt {attempt}/{SECTION_ATTEMPTS})")
+    return None
+
+
+def parse_sections(texts: Dict[str, List[str]], llm_key: str, session_id: Optional[str] = None,
+                   workers: int = CV_PARSER_WORKERS) -> Dict[str, Any]:
+    """Parses sections of a CV in parallel and merges the chunks of each section.
+
+    Args:
+        texts: Texts to parse by section, as given by `section_chunks`
+        llm_key: API key of the LLM
+        session_id: Session of the user, for the rate limiter
+        workers: Maximum number of concurrent LLM calls
+
+    Returns:
+        The parsed sections; a section with a chunk that failed is left out.
+    """
+    jobs = [(name, text) for name, chunks in texts.items() for text in chunks]
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as executor:
+        results = list(executor.map(lambda job: parse_section(job[0], job[1], llm_key, session_id), jobs))
+
+    parsed: Dict[str, Any] = {}
+    for name, chunks in texts.items():
+        values = [value for (job_name, _), value in zip(jobs, results) if job_name == name]
+        if any(value is None for value in values):
+            continue
+        if len(values) == 1:
+            parsed[name] = values[0]
+        else:
+            parsed[name] = [item for value in values for item in value or []]
+    return parsed
+
+
+def merge_or_none(extraction: CVExtraction, parsed: Optional[Dict[str, Any]] = None) -> Optional[CV]:
+    """Merges the sections parsed by the LLM into the extraction, None if a required field is still missing."""
+    try:
+        return extraction.merge(parsed)
+    except ValidationError as e:
+        print(f"The CV is incomplete: {e}")
+        return None
+
+
+def parse_cv(markdown: str, llm_key: str, session_id: Optional[str] = None,
+             threshold: float = CONFIDENCE_THRESHOLD, mode: str = CV_PARSING_MODE) -> Tuple[Optional[CV], CVExtraction]:
+    """Parses the markdown of a CV, with the LLM only for the sections the rules are not confident about.
+
+    Args:
+        markdown: Markdown of the CV, as given by pymupdf4llm
+        llm_key: API key of the LLM
+        session_id: Session of the user, for the rate limiter
+        threshold: Minimum confidence for a section extracted by the rules to be used
+        mode: `sections` to parse each section with its own LLM call, in parallel, or `document` for a single call
+    """
+    from src.postulator.pool import pooled_cv_parser
+    from src.postulator.run_context import ResultSink
+
+    extraction = extract_cv(markdown)
+    missing = extraction.missing(threshold)
+    print(f"CV extracted by rules in {extraction.seconds * 1000:.0f}ms, confidence: {extraction.confidence}")
+    if not missing:
+        return merge_or_none(extraction), extraction
+
+    if mode == "sections":
+        texts = {name: section_chunks(name, extraction.sections[name].text, markdown) for name in missing}
+        print("Parsing " + ", ".join(f"{name} ({len(chunks)} chunks)" for name, chunks in texts.items()) + " with the LLM")
+        start = time.time()
+        parsed = parse_sections(texts, llm_key, session_id)
+        failed = [name for name in missing if name not in parsed]
+        print(f"Sections parsed in {time.time() - start:.1f}s" + (f", failed: {', '.join(failed)}" if failed else ""))
+        # The failed sections keep the value of the rules, if it is a valid one
+        return merge_or_none(extraction, parsed), extraction
+    if mode != "document":
+        raise ValueError(f"Unknown CV parsing mode '{mode}', expected 'sections' or 'document'")
+
+    # The LLM only reads the sections it has to parse, or the whole CV when a section has no heading
+    texts = [extraction.sections[name].text for name in missing]
+    cv_text = markdown if not all(texts) else "\n\n".join(texts)
+    model = partial_model(missing)
+    print(f"Parsing {', '.join(missing)} with the LLM")
+    sink = ResultSink()
+    with pooled_cv_parser(llm_key, sink, session_id=session_id, model=model) as parser:
+        parser.run({
+            "schema": compact_schema_json(model.model_json_schema()),
+            "cv_pdf": cv_text,
+        })
+    if sink.cv_sections is None:
+        return None, extraction
+    return merge_or_none(extraction, sink.cv_sections), extraction
+
+
+def load_fixtures(paths: List[str]) -> List[Tuple[str, str, Optional[Dict]]]:
+    fixtures = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            markdown = f.read()
+        expected = None
+        if os.path.exists(os.path.splitext(path)[0] + ".json"):
+            with open(os.path.splitext(path)[0] + ".json", encoding="utf-8") as f:
+                expected = json.load(f)
+        fixtures.append((path, markdown, expected))
+    return fixtures
+
+
+def field_accuracy(value: Any, expected: Any) -> Tuple[int, int]:
+    """Returns the number of matching and compared leaf fields of two values."""
+    if isinstance(expected, dict):
+        counts = [field_accuracy((value or {}).get(key), item) for key, item in expected.items()]
+        return sum(count[0] for count in counts), sum(count[1] for count in counts)
+    if isinstance(expected, list) and expected and isinstance(expected[0], dict):
+        value = value or []
+        counts = [field_accuracy(value[i] if i < len(value) else None, item) for i, item in enumerate(expected)]
+        return sum(count[0] for count in counts), sum(count[1] for count in counts)
+    if isinstance(expected, list):
+        return int(sorted(normalize(str(item)) for item in value or []) == sorted(normalize(str(item)) for item in expected)), 1
+    return int(normalize(str(value or "")) == normalize(str(expected or ""))), 1
+
+
+def benchmark(paths: List[str], threshold: float = CONFIDENCE_THRESHOLD) -> Dict[str, float]:
+    """Extracts every CV and reports the confidence, the sections left to the LLM and the field accuracy."""
+    fixtures = load_fixtures(paths)
+    ruled = total = matched = compared = 0
+    seconds = []
+    for path, markdown, expected in fixtures:
+        extraction = extract_cv(markdown)
+        seconds.append(extraction.seconds)
+        missing = extraction.missing(threshold)
+        ruled += len(SECTIONS) - len(missing)
+        total += len(SECTIONS)
+        line = f"{os.path.basename(path):<30} " + " ".join(f"{name}={value:.2f}" for name, value in extraction.confidence.items())
+        if expected:
+            for name in SECTIONS:
+                if name not in missing:
+                    counts = field_accuracy(extraction.sections[name].value, expected.get(name))
+                    matched += counts[0]
+                    compared += counts[1]
+        print(f"{line}  LLM: {', '.join(missing) or '-'}")
+    return {
+        "cvs": len(fixtures),
+        "sections_by_rules": ruled / total if total else 0.0,
+        "cvs_without_llm": sum(1 for _, markdown, _ in fixtures if not extract_cv(markdown).missing(threshold)) / len(fixtures) if fixtures else 0.0,
+        "mean_ms": 1000 * sum(seconds) / len(seconds) if seconds else 0.0,
+        "field_accuracy": matched / compared if compared else float("nan"),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join("input", "cv_fixtures", "*.md"))) + [os.path.join("input", "resume_template.md")]
+    summary = benchmark(paths)
+    print(f"{summary['cvs']} CVs, {summary['sections_by_rules']:.0%} of the sections extracted by rules, "
+          f"{summary['cvs_without_llm']:.0%} of the CVs without LLM call, {summary['mean_ms']:.1f}ms per CV, "
+          f"field accuracy of the extracted sections: {summary['field_accuracy']:.0%}")
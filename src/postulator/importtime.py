@@ -0,0 +1,122 @@
+"""
+Import time of the Streamlit entry point, measured with `python -X importtime`.
+
+Reports the cumulative import time of a module, the slowest packages it
+imports and the heavy packages imported eagerly although they should only be
+imported on first use. Exits with status 1 when the import time is over the
+budget or a heavy package is imported, so it can guard against regressions:
+    python -m src.postulator.importtime [--module src.postulator.app] [--budget-ms 1500]
+"""
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+# Cumulative import time of the entry point above which the check fails
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 1500))
+
+# Packages only needed to generate a letter or parse a CV, never to draw the login page
+HEAVY_MODULES = ["crewai", "crewai_tools", "litellm", "chromadb", "pymupdf4llm", "pymupdf", "fitz", "PyPDF2", "babel",
+                 "google.generativeai", "streamlit_pdf_viewer"]
+
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+class ImportTiming(BaseModel):
+    """Import time of one module, as reported by `-X importtime`."""
+    module: str = Field(..., description="Dotted name of the module")
+    self_us: int = Field(0, description="Time spent importing the module itself, in microseconds")
+    cumulative_us: int = Field(0, description="Time including the modules it imports, in microseconds")
+    depth: int = Field(0, description="Nesting level of the import, 0 for the imports of the measured code")
+
+
+def parse_importtime(stderr: str) -> List[ImportTiming]:
+    """Parses the output of `python -X importtime`, without the imports of the interpreter startup."""
+    timings = []
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            timings.append(ImportTiming(module=match.group(4), self_us=int(match.group(1)),
+                                        cumulative_us=int(match.group(2)), depth=(len(match.group(3)) - 1) // 2))
+    # The startup imports end with `site`, a module is only reported once its imports are done
+    startup = [i for i, timing in enumerate(timings) if timing.module == "site" and timing.depth == 0]
+    return timings[startup[0] + 1:] if startup else timings
+
+
+def measure(module: str, runs: int = 3, cwd: Optional[str] = None) -> Tuple[List[ImportTiming], Optional[str]]:
+    """Imports a module in fresh interpreters and returns the timings of the fastest run.
+
+    Args:
+        module: Module to import
+        runs: Number of interpreters started, the fastest one is kept to reduce the noise
+        cwd: Working directory of the interpreters, the current one by default
+
+    Returns:
+        The timings, and the end of the error output if the import failed
+    """
+    best: List[ImportTiming] = []
+    best_total = None
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                 capture_output=True, text=True, cwd=cwd)
+        if process.returncode != 0:
+            errors = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+            return [], "\n".join(errors[-5:])
+        timings = parse_importtime(process.stderr)
+        total = entry_time(timings, module)
+        if best_total is None or total < best_total:
+            best, best_total = timings, total
+    return best, None
+
+
+def entry_time(timings: List[ImportTiming], module: str) -> int:
+    """Returns the cumulative import time of a module in microseconds."""
+    return next((timing.cumulative_us for timing in timings if timing.module == module), 0)
+
+
+def heavy_imports(timings: List[ImportTiming]) -> Dict[str, int]:
+    """Returns the heavy packages that were imported, with their cumulative import time."""
+    found = {}
+    for timing in timings:
+        for heavy in HEAVY_MODULES:
+            if timing.module == heavy:
+                found[heavy] = max(found.get(heavy, 0), timing.cumulative_us)
+    return found
+
+
+def report(module: str, budget_ms: float = IMPORT_BUDGET_MS, top: int = 15, runs: int = 3) -> Tuple[bool, str]:
+    """Measures the import of a module and returns whether it is within budget, with a readable report."""
+    timings, error = measure(module, runs=runs)
+    if error is not None:
+        return False, f"Importing {module} failed:\n{error}"
+
+    total_ms = entry_time(timings, module) / 1000
+    heavy = heavy_imports(timings)
+    # Packages imported directly or by the first level of imports, the ones a change of the code can avoid
+    slowest = sorted((timing for timing in timings if timing.depth <= 1 and timing.module != module),
+                     key=lambda timing: timing.cumulative_us, reverse=True)[:top]
+    lines = [f"{module}: {total_ms:.0f}ms (budget {budget_ms:.0f}ms)", "", f"{'module':<45} {'cumulative':>11} {'self':>9}"]
+    lines += [f"{timing.module:<45} {timing.cumulative_us / 1000:>9.1f}ms {timing.self_us / 1000:>7.1f}ms" for timing in slowest]
+    if heavy:
+        lines += ["", "Heavy packages imported eagerly: " + ", ".join(f"{name} ({us / 1000:.0f}ms)" for name, us in heavy.items())]
+    ok = total_ms <= budget_ms and not heavy
+    lines += ["", "OK" if ok else "FAILED"]
+    return ok, "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Import time report of the entry point")
+    parser.add_argument("--module", default="src.postulator.app", help="Module to import")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS, help="Maximum cumulative import time")
+    parser.add_argument("--top", type=int, default=15, help="Number of packages listed")
+    parser.add_argument("--runs", type=int, default=3, help="Number of measures, the fastest is kept")
+    args = parser.parse_args()
+
+    ok, text = report(args.module, budget_ms=args.budget_ms, top=args.top, runs=args.runs)
+    print(text)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,291 @@
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACES_DIR = os.path.join("output", "traces")
+# Maximum disk space used by the traces, the oldest are removed first
+TRACES_MAX_BYTES = int(os.environ.get("TRACES_MAX_BYTES", 50 * 1024 * 1024))
+
+_local = threading.local()
+
+
+def current_tracer() -> Optional["Tracer"]:
+    """Returns the tracer of the task running in the current thread, if any."""
+    return getattr(_local, "tracer", None)
+
+
+def count_tokens(model: str, messages: Any = None, text: Optional[str] = None) -> int:
+    """Counts the tokens of some messages or of a text with the tokenizer of the model."""
+    try:
+        import litellm
+        if text is not None:
+            return litellm.token_counter(model=model, text=text)
+        if isinstance(messages, str):
+            return litellm.token_counter(model=model, text=messages)
+        return litellm.token_counter(model=model, messages=messages)
+    except Exception:
+        # Rough estimate when the tokenizer is unavailable
+        content = text if text is not None else json.dumps(messages, default=str)
+        return len(content) // 4
+
+
+class Tracer:
+    """Records the LLM calls, tool calls and tasks of one crew kickoff.
+
+    Tasks are recorded with `span`, which also makes the tracer current for
+    the thread running the task, so that LLM calls and agent steps are
+    attributed to the right task and agent.
+    """
+
+    def __init__(self, run_id: Optional[str] = None) -> None:
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self.tasks: List[Dict[str, Any]] = []
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.prompts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, task_name: str, agent_role: str, task=None) -> Iterator[None]:
+        """Makes the tracer current while a task runs and records its wall time.
+
+        The retries are counted during the span only, as pooled crews keep their
+        agents and tasks between runs: the re-executions of the task by its agent
+        (crewai's `_times_executed`) and by its guardrail (`retry_count`). The
+        LLM calls that failed during the span are counted apart.
+
+        Args:
+            task_name: Name of the task
+            agent_role: Role of the agent performing the task
+            task: crewai Task, used to read its retries and the ones of its agent
+        """
+        def executions() -> int:
+            agent = getattr(task, "agent", None)
+            return getattr(agent, "_times_executed", 0) + getattr(task, "retry_count", 0)
+
+        previous = (getattr(_local, "tracer", None), getattr(_local, "task", None), getattr(_local, "agent", None))
+        _local.tracer, _local.task, _local.agent = self, task_name, agent_role
+        _local.last_llm_end = time.perf_counter()
+        start = time.perf_counter()
+        executions_before = executions()
+        with self._lock:
+            first_call = len(self.llm_calls)
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            _local.tracer, _local.task, _local.agent = previous
+            with self._lock:
+                llm_errors = sum(1 for call in self.llm_calls[first_call:] if call["task"] == task_name and call.get("error"))
+                self.tasks.append({
+                    "task": task_name,
+                    "agent": agent_role,
+                    "wall_time": time.perf_counter() - start,
+                    "retries": max(0, executions() - executions_before),
+                    "llm_errors": llm_errors,
+                    "error": error,
+                })
+
+    @contextmanager
+    def sequence(self, crew) -> Iterator[None]:
+        """Records the tasks of a sequential kickoff of `crew`, each in its own span.
+
+        crewai runs the tasks in order in the calling thread, so a task starts
+        when the previous one calls its callback. The callbacks are set on the
+        tasks for the kickoff only, as pooled crews keep their tasks.
+        """
+        from src.postulator.scheduler import task_name
+
+        tasks = list(crew.tasks)
+        callbacks = [task.callback for task in tasks]
+        current = []
+
+        def start(index: int) -> None:
+            if index < len(tasks):
+                task = tasks[index]
+                span = self.span(task_name(task, index), task.agent.role if task.agent else "", task)
+                span.__enter__()
+                current.append((index, span))
+
+        def end(index: int, output) -> None:
+            if callbacks[index]:
+                callbacks[index](output)
+            if current and current[-1][0] == index:
+                current.pop()[1].__exit__(None, None, None)
+                start(index + 1)
+
+        for index, task in enumerate(tasks):
+            task.callback = lambda output, index=index: end(index, output)
+        start(0)
+        try:
+            yield
+        except BaseException:
+            if current:
+                current.pop()[1].__exit__(*sys.exc_info())
+            raise
+        finally:
+            if current:
+                current.pop()[1].__exit__(None, None, None)
+            for task, callback in zip(tasks, callbacks):
+                task.callback = callback
+
+    def record_llm_call(self, prompt_tokens: int, completion_tokens: int, wall_time: float, cached: bool = False,
+                        rate_limit_wait: float = 0.0, error: Optional[str] = None) -> None:
+        """Records an LLM call made by the task running in the current thread, `error` if it failed."""
+        _local.last_llm_end = time.perf_counter()
+        with self._lock:
+            self.llm_calls.append({
+                "task": getattr(_local, "task", None),
+                "agent": getattr(_local, "agent", None),
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "wall_time": wall_time,
+                "cached": cached,
+                "rate_limit_wait": rate_limit_wait,
+                "error": error,
+            })
+
+    def record_prompt(self, task_name: str, sections: Dict[str, int]) -> None:
+        """Records the tokens of each section of the prompt of a task, as assembled before it runs."""
+        with self._lock:
+            self.prompts[task_name] = sections
+
+    def step_callback(self, step) -> None:
+        """crewai step callback recording the tool calls of the agents.
+
+        The step callback runs right after the tool returned, so the tool wall
+        time is the time elapsed since the end of the last LLM call.
+        """
+        tool = getattr(step, "tool", None)
+        if tool is None:
+            return
+        now = time.perf_counter()
+        result = str(getattr(step, "result", "") or "")
+        with self._lock:
+            self.tool_calls.append({
+                "task": getattr(_local, "task", None),
+                "agent": getattr(_local, "agent", None),
+                "tool": tool,
+                "wall_time": now - getattr(_local, "last_llm_end", now),
+                "result_chars": len(result),
+            })
+
+    def trace(self, crew=None) -> Dict[str, Any]:
+        """Returns the trace of the run as a JSON serializable dictionary.
+
+        Args:
+            crew: crewai Crew of the run, used to read its agents and usage
+        """
+        agents = {}
+        for agent in (crew.agents if crew is not None else []):
+            spans = [task for task in self.tasks if task["agent"] == agent.role]
+            agents[agent.role] = {
+                # Executions of this run: one per task, plus its retries
+                "executions": sum(1 + task["retries"] for task in spans),
+                "llm_calls": sum(1 for call in self.llm_calls if call["agent"] == agent.role),
+                "prompt_tokens": sum(call["prompt_tokens"] for call in self.llm_calls if call["agent"] == agent.role),
+                "completion_tokens": sum(call["completion_tokens"] for call in self.llm_calls if call["agent"] == agent.role),
+                "tool_calls": sum(1 for call in self.tool_calls if call["agent"] == agent.role),
+            }
+        usage = getattr(crew, "usage_metrics", None) if crew is not None else None
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "wall_time": time.time() - self.started_at,
+            "tasks": self.tasks,
+            "agents": agents,
+            "llm_calls": self.llm_calls,
+            "tool_calls": self.tool_calls,
+            "prompts": self.prompts,
+            "usage": usage.model_dump() if hasattr(usage, "model_dump") else None,
+        }
+
+    def save(self, crew=None, directory: str = TRACES_DIR, max_bytes: int = TRACES_MAX_BYTES) -> str:
+        """Writes the trace of the run to `<directory>/<run_id>.json` and returns its path.
+
+        The oldest traces are removed once the directory holds more than `max_bytes`.
+        """
+        from src.postulator.cache import prune_directory
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.run_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.trace(crew), f, indent=2)
+        prune_directory(directory, max_bytes, keep=os.path.basename(path))
+        return path
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Returns the q-th percentile (0-100) of some values, linearly interpolated."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def aggregate_traces(paths: List[str], quantiles=(50, 90, 99)) -> Dict[str, Dict[str, float]]:
+    """Aggregates several traces into percentiles.
+
+    Args:
+        paths: Paths of the JSON traces
+        quantiles: Percentiles to compute
+
+    Returns:
+        For every metric (run wall time, task wall time, tokens, retries and
+        tool wall time by tool), its percentiles over the runs.
+    """
+    metrics: Dict[str, List[float]] = {}
+
+    def add(name, value):
+        metrics.setdefault(name, []).append(value)
+
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            trace = json.load(f)
+        add("run.wall_time", trace["wall_time"])
+        add("run.llm_calls", len(trace["llm_calls"]))
+        add("run.prompt_tokens", sum(call["prompt_tokens"] for call in trace["llm_calls"]))
+        add("run.completion_tokens", sum(call["completion_tokens"] for call in trace["llm_calls"]))
+        add("run.rate_limit_wait", sum(call.get("rate_limit_wait", 0.0) for call in trace["llm_calls"]))
+        for task in trace["tasks"]:
+            calls = [call for call in trace["llm_calls"] if call["task"] == task["task"]]
+            add(f"task.{task['task']}.wall_time", task["wall_time"])
+            add(f"task.{task['task']}.retries", task["retries"])
+            add(f"task.{task['task']}.llm_errors", task.get("llm_errors", 0))
+            add(f"task.{task['task']}.llm_calls", len(calls))
+            add(f"task.{task['task']}.prompt_tokens", sum(call["prompt_tokens"] for call in calls))
+        for call in trace["tool_calls"]:
+            add(f"tool.{call['tool']}.wall_time", call["wall_time"])
+
+    return {
+        name: {f"p{q}": percentile(values, q) for q in quantiles} | {"count": len(values)}
+        for name, values in sorted(metrics.items())
+    }
+
+
+def format_report(report: Dict[str, Dict[str, float]]) -> str:
+    """Formats the output of `aggregate_traces` as a table."""
+    columns = [key for key in next(iter(report.values()), {}) if key != "count"]
+    lines = [f"{'Metric':<60} {'count':>6} " + " ".join(f"{column:>10}" for column in columns)]
+    for name, values in report.items():
+        lines.append(f"{name:<60} {values['count']:>6} " + " ".join(f"{values[column]:>10.1f}" for column in columns))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.postulator.instrumentation [traces directory]
+    directory = sys.argv[1] if len(sys.argv) > 1 else TRACES_DIR
+    print(format_report(aggregate_traces(sorted(glob.glob(os.path.join(directory, "*.json"))))))
@@ -0,0 +1,278 @@
+import hashlib
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from src.postulator.cache import DiskCache, cache_path, sha256_bytes
+
+# Maximum number of pdflatex processes running at the same time
+LATEX_WORKERS = int(os.environ.get("LATEX_WORKERS", os.cpu_count() or 2))
+# A compilation running longer than this is killed (seconds)
+LATEX_TIMEOUT = float(os.environ.get("LATEX_TIMEOUT", 30))
+# Passes run at most when the log keeps asking for a rerun
+LATEX_MAX_PASSES = 3
+# Maximum size of the compiled PDFs kept in the cache
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+
+BEGIN_DOCUMENT = "\\begin{document}"
+RERUN_PATTERN = re.compile(r"Rerun to get|Label\(s\) may have changed|Please rerun")
+
+_latex_compiler = None
+_latex_compiler_lock = threading.Lock()
+
+
+class CompileResult(BaseModel):
+    """Outcome of the compilation of a LaTeX document."""
+    pdf_path: Optional[str] = Field(None, description="Path of the PDF, if one was produced")
+    success: bool = Field(False, description="Whether pdflatex ended without error and produced the PDF")
+    passes: int = Field(0, description="Number of pdflatex runs")
+    precompiled: bool = Field(False, description="Whether the precompiled preamble format was used")
+    pages: Optional[int] = Field(None, description="Number of pages of the PDF")
+    page_texts: List[str] = Field(default_factory=list, description="Text extracted from each page of the PDF")
+    source_hash: Optional[str] = Field(None, description="SHA-256 of the LaTeX source")
+    cached: bool = Field(False, description="Whether the PDF was served from the cache")
+    seconds: float = Field(0.0, description="Time spent compiling")
+    queue_seconds: float = Field(0.0, description="Time spent waiting for a free worker")
+    error: Optional[str] = Field(None, description="End of the log when the compilation failed")
+
+
+def split_preamble(source: str) -> Tuple[str, str]:
+    """Splits a document into its preamble and its body (starting at \\begin{document})."""
+    index = source.find(BEGIN_DOCUMENT)
+    if index < 0:
+        return "", source
+    return source[:index], source[index:]
+
+
+def read_pdf(path: str) -> Tuple[int, List[str]]:
+    """Returns the number of pages of a PDF and the text of each page."""
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return len(reader.pages), [page.extract_text() or "" for page in reader.pages]
+
+
+def log_tail(log: str, lines: int = 20) -> str:
+    """Returns the end of a pdflatex log, where the error usually is."""
+    return "\n".join(log.strip().splitlines()[-lines:])
+
+
+class LatexCompiler:
+    """Compiles LaTeX documents with pdflatex through a bounded pool of workers.
+
+    The preamble of the letters never changes, so it is loaded once and dumped
+    into a format file; each compilation then only typesets the body. A single
+    pass is run unless the log asks for another one. The PDFs are cached by the
+    hash of their source, so an unchanged letter is never compiled twice.
+    """
+
+    def __init__(self, workers: int = LATEX_WORKERS, timeout: float = LATEX_TIMEOUT,
+                 format_dir: Optional[str] = None, pdf_cache: Optional[DiskCache] = None) -> None:
+        """
+        Args:
+            workers: Maximum number of concurrent compilations
+            timeout: Time after which a pdflatex run is killed, in seconds
+            format_dir: Directory of the precompiled formats
+            pdf_cache: Cache of the compiled PDFs
+        """
+        self.timeout = timeout
+        self.format_dir = os.path.abspath(format_dir or cache_path("latex"))
+        self.pdf_cache = pdf_cache or DiskCache(cache_path("pdf.sqlite"), max_bytes=PDF_CACHE_MAX_BYTES)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdflatex")
+        self._format_lock = threading.Lock()
+        self._broken_formats = set()
+        self._lock = threading.Lock()
+        self._stats = {"jobs": 0, "failed": 0, "cached": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+
+    def _run(self, args: List[str], cwd: str, env: Optional[Dict[str, str]] = None) -> Tuple[int, str]:
+        """Runs pdflatex and returns its exit code and its output."""
+        try:
+            process = subprocess.run(args, cwd=cwd, env=env, capture_output=True, text=True,
+                                     errors="replace", timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            return -1, f"pdflatex was killed after {self.timeout:.0f}s"
+        except FileNotFoundError:
+            return -1, "pdflatex is not installed"
+        return process.returncode, process.stdout
+
+    def format_name(self, preamble: str) -> str:
+        """Returns the name of the format of a preamble, which depends on its content only."""
+        normalized = "\n".join(line.strip() for line in preamble.strip().splitlines())
+        return "preamble-" + hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+    def ensure_format(self, preamble: str) -> Optional[str]:
+        """Dumps the format of a preamble if needed and returns its name, or None if it cannot be built."""
+        name = self.format_name(preamble)
+        if name in self._broken_formats:
+            return None
+        if os.path.exists(os.path.join(self.format_dir, name + ".fmt")):
+            return name
+
+        with self._format_lock:
+            if os.path.exists(os.path.join(self.format_dir, name + ".fmt")):
+                return name
+            os.makedirs(self.format_dir, exist_ok=True)
+            # Built under a temporary name so other processes never load a partial format
+            tmp_name = f"{name}-{os.getpid()}-{threading.get_ident()}"
+            with open(os.path.join(self.format_dir, tmp_name + ".tex"), "w", encoding="utf-8") as f:
+                f.write(preamble + "\n\\dump\n")
+            returncode, log = self._run(
+                ["pdflatex", "-ini", "-interaction=nonstopmode", f"-jobname={tmp_name}", "&pdflatex", tmp_name + ".tex"],
+                cwd=self.format_dir,
+            )
+            for extension in [".tex", ".log"]:
+                if os.path.exists(os.path.join(self.format_dir, tmp_name + extension)):
+                    os.remove(os.path.join(self.format_dir, tmp_name + extension))
+            if returncode != 0 or not os.path.exists(os.path.join(self.format_dir, tmp_name + ".fmt")):
+                print(f"Could not precompile the preamble, compiling without format:\n{log_tail(log)}")
+                self._broken_formats.add(name)
+                return None
+            os.replace(os.path.join(self.format_dir, tmp_name + ".fmt"), os.path.join(self.format_dir, name + ".fmt"))
+            return name
+
+    def _passes(self, args: List[str], cwd: str, env: Optional[Dict[str, str]] = None) -> Tuple[int, str, int]:
+        """Runs pdflatex until the log stops asking for a rerun and returns the exit code, log and number of passes."""
+        passes = 0
+        while True:
+            returncode, log = self._run(args, cwd=cwd, env=env)
+            passes += 1
+            if returncode != 0 or passes >= LATEX_MAX_PASSES or not RERUN_PATTERN.search(log):
+                return returncode, log, passes
+
+    def _write_source(self, source: str, output_dir: str, job_name: str) -> str:
+        """Writes the complete source next to the PDF and returns the absolute output directory."""
+        output_dir = os.path.abspath(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, job_name + ".tex"), "w", encoding="utf-8") as f:
+            f.write(source)
+        return output_dir
+
+    def cached(self, source: str, output_dir: str, job_name: str) -> Optional[CompileResult]:
+        """Writes the PDF of a source compiled before to the output directory and returns its result, if any."""
+        start = time.time()
+        source_hash = sha256_bytes(source.encode("utf-8"))
+        meta = self.pdf_cache.get_json("meta:" + source_hash)
+        pdf = self.pdf_cache.get("pdf:" + source_hash) if meta is not None else None
+        if pdf is None:
+            return None
+
+        output_dir = self._write_source(source, output_dir, job_name)
+        pdf_path = os.path.join(output_dir, job_name + ".pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(pdf)
+        result = CompileResult(pdf_path=pdf_path, success=True, pages=meta["pages"], page_texts=meta["page_texts"],
+                               source_hash=source_hash, cached=True, seconds=time.time() - start)
+        with self._lock:
+            self._stats["cached"] += 1
+        print(f"Served {job_name} from the PDF cache in {result.seconds:.3f}s")
+        return result
+
+    def _compile(self, source: str, output_dir: str, job_name: str, submitted_at: float) -> CompileResult:
+        start = time.time()
+        # The complete source is always kept next to the PDF
+        output_dir = self._write_source(source, output_dir, job_name)
+
+        # A PDF left by a previous draft must not be mistaken for the result of this one
+        pdf_path = os.path.join(output_dir, job_name + ".pdf")
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+
+        preamble, body = split_preamble(source)
+        format_name = self.ensure_format(preamble) if preamble.strip() else None
+        if format_name:
+            input_file = f".{job_name}.body.tex"
+            with open(os.path.join(output_dir, input_file), "w", encoding="utf-8") as f:
+                f.write(body)
+            env = dict(os.environ, TEXFORMATS=self.format_dir + os.pathsep + os.environ.get("TEXFORMATS", ""))
+            returncode, log, passes = self._passes(
+                ["pdflatex", f"-fmt={format_name}", "-interaction=nonstopmode", f"-jobname={job_name}", input_file],
+                output_dir, env,
+            )
+            os.remove(os.path.join(output_dir, input_file))
+            if returncode != 0 and "format file" in log.lower():
+                # The format was dumped by another version of pdflatex: it is rebuilt on the
+                # next compilation, and this one is done with the full preamble
+                if os.path.exists(os.path.join(self.format_dir, format_name + ".fmt")):
+                    os.remove(os.path.join(self.format_dir, format_name + ".fmt"))
+                format_name = None
+        if not format_name:
+            returncode, log, passes = self._passes(
+                ["pdflatex", "-interaction=nonstopmode", f"-jobname={job_name}", job_name + ".tex"],
+                output_dir,
+            )
+
+        pages, page_texts = read_pdf(pdf_path) if os.path.exists(pdf_path) else (None, [])
+        source_hash = sha256_bytes(source.encode("utf-8"))
+        result = CompileResult(
+            pdf_path=pdf_path if os.path.exists(pdf_path) else None,
+            success=returncode == 0 and os.path.exists(pdf_path),
+            pages=pages,
+            page_texts=page_texts,
+            source_hash=source_hash,
+            passes=passes,
+            precompiled=format_name is not None,
+            seconds=time.time() - start,
+            queue_seconds=start - submitted_at,
+            error=None if returncode == 0 else log_tail(log),
+        )
+        if result.success:
+            with open(pdf_path, "rb") as f:
+                self.pdf_cache.set("pdf:" + source_hash, f.read())
+            self.pdf_cache.set_json("meta:" + source_hash, {"pages": pages, "page_texts": page_texts})
+
+        with self._lock:
+            self._stats["jobs"] += 1
+            self._stats["failed"] += 0 if result.success else 1
+            self._stats["total_seconds"] += result.seconds
+            self._stats["max_seconds"] = max(self._stats["max_seconds"], result.seconds)
+        print(f"Compiled {job_name} in {result.seconds:.2f}s ({passes} pass{'es' if passes > 1 else ''}, "
+              f"{'precompiled preamble' if result.precompiled else 'full preamble'}, "
+              f"waited {result.queue_seconds:.2f}s){'' if result.success else ' with errors'}")
+        return result
+
+    def submit(self, source: str, output_dir: str, job_name: str, use_cache: bool = True) -> "Future[CompileResult]":
+        """Queues the compilation of a document and returns a future of its result.
+
+        A source compiled before is served from the cache without being queued.
+        """
+        result = self.cached(source, output_dir, job_name) if use_cache else None
+        if result is not None:
+            future: "Future[CompileResult]" = Future()
+            future.set_result(result)
+            return future
+        return self._executor.submit(self._compile, source, output_dir, job_name, time.time())
+
+    def compile(self, source: str, output_dir: str, job_name: str, use_cache: bool = True) -> CompileResult:
+        """Compiles a document to `<output_dir>/<job_name>.pdf` and waits for the result.
+
+        Args:
+            source: Complete LaTeX source of the document
+            output_dir: Directory where the .tex, .pdf and auxiliary files are written
+            job_name: Name of the files, without extension
+            use_cache: Whether a PDF compiled before from the same source can be reused
+        """
+        return self.submit(source, output_dir, job_name, use_cache).result()
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of compilations, their durations and the number of PDFs served from the cache."""
+        with self._lock:
+            jobs = self._stats["jobs"]
+            return dict(self._stats, mean_seconds=self._stats["total_seconds"] / jobs if jobs else 0.0,
+                        cache=self.pdf_cache.stats())
+
+
+def latex_compiler() -> LatexCompiler:
+    """Returns the compiler shared by all the sessions of the process."""
+    global _latex_compiler
+    if _latex_compiler is None:
+        with _latex_compiler_lock:
+            if _latex_compiler is None:
+                _latex_compiler = LatexCompiler()
+    return _latex_compiler
@@ -0,0 +1,380 @@
+"""
+Layout model of the motivation letter.
+
+Predicts how many lines and pages `letter_writer._letter_from_pydantic` renders
+to, from the text alone, so that overlong drafts are rejected without running
+pdflatex. The letter is typeset with the `letter` class at 11pt (Computer
+Modern at 10.95pt, 13.6pt baselines, 0.7em between paragraphs) on A4 with
+25 mm margins.
+
+Validate the model against real compilations with:
+    python -m src.postulator.layout
+The layouts pdflatex gives to the sample letters are recorded once in
+`tests/data/layout_golden.json`, against which the tests check the model
+without pdflatex. Regenerate that file after changing the LaTeX template with:
+    python -m src.postulator.layout --golden tests/data/layout_golden.json
+"""
+import json
+import math
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from src.postulator.data_structures.custom_data_structures import MotivationLetter
+from src.postulator.run_context import RunContext
+
+PT_PER_MM = 72.27 / 25.4
+
+# Page geometry: A4 with 25 mm margins
+TEXT_WIDTH = (210 - 2 * 25) * PT_PER_MM
+TEXT_HEIGHT = (297 - 2 * 25) * PT_PER_MM
+
+# Font sizes and vertical spacing of the 11pt letter class
+FONT_SIZE = 10.95
+LARGE_FONT_SIZE = 12.0
+BASELINE_SKIP = 13.6
+LARGE_BASELINE_SKIP = 14.0
+TOP_SKIP = 11.0
+PAR_SKIP = 0.7 * FONT_SIZE
+LINE_HEIGHT = 0.694 * FONT_SIZE
+LINE_DEPTH = 0.194 * FONT_SIZE
+
+# Interword glue of cmr10, in units of the font size (width, stretch, shrink)
+SPACE = (0.333334, 0.166667, 0.111112)
+EXTRA_SPACE = 0.111112
+# Bold extended (cmbx) is about 15% wider than the roman font
+BOLD_FACTOR = 1.15
+
+# Width of the characters of cmr10, in thousandths of the font size
+CMR10_WIDTHS: Dict[str, float] = {
+    **dict.fromkeys("0123456789", 500.0),
+    "a": 500.0, "b": 555.6, "c": 444.4, "d": 555.6, "e": 444.4, "f": 305.6, "g": 500.0,
+    "h": 555.6, "i": 277.8, "j": 305.6, "k": 527.8, "l": 277.8, "m": 833.3, "n": 555.6,
+    "o": 500.0, "p": 555.6, "q": 527.8, "r": 391.7, "s": 394.4, "t": 388.9, "u": 555.6,
+    "v": 527.8, "w": 722.2, "x": 527.8, "y": 527.8, "z": 444.4,
+    "A": 750.0, "B": 708.3, "C": 722.2, "D": 763.9, "E": 680.6, "F": 652.8, "G": 784.7,
+    "H": 750.0, "I": 361.1, "J": 513.9, "K": 777.8, "L": 625.0, "M": 916.7, "N": 750.0,
+    "O": 777.8, "P": 680.6, "Q": 777.8, "R": 736.1, "S": 555.6, "T": 722.2, "U": 750.0,
+    "V": 750.0, "W": 1027.8, "X": 750.0, "Y": 750.0, "Z": 611.1,
+    ".": 277.8, ",": 277.8, ":": 277.8, ";": 277.8, "!": 277.8, "?": 472.2,
+    "'": 277.8, "`": 277.8, "\"": 500.0, "(": 388.9, ")": 388.9, "[": 277.8, "]": 277.8,
+    "-": 333.3, "–": 500.0, "—": 1000.0, "/": 500.0, "&": 777.8, "%": 833.3,
+    "+": 777.8, "=": 777.8, "*": 500.0, "#": 833.3, "$": 500.0, "@": 777.8,
+    "’": 277.8, "‘": 277.8, "“": 500.0, "”": 500.0,
+}
+DEFAULT_WIDTH = 500.0
+
+# Words TeX may hyphenate, and the minimum number of letters it keeps on each side
+HYPHEN_MIN = (2, 3)
+SENTENCE_END = re.compile(r"[.?!][)'\"’”]*$")
+
+# Drafts predicted to overflow by more lines than this are rejected without compiling,
+# smaller overflows are left to the real compilation
+REJECT_MARGIN_LINES = 1
+
+
+class LayoutPrediction(BaseModel):
+    """Predicted layout of a letter."""
+    lines: int = Field(..., description="Number of text lines of the letter")
+    height: float = Field(..., description="Height of the letter in pt, if set on a single page")
+    pages: int = Field(..., description="Number of pages")
+    overflow_lines: int = Field(..., description="Lines that do not fit on the first page")
+    free_lines: int = Field(..., description="Lines still available on the first page")
+    words: int = Field(..., description="Words of the opening, core and closing paragraphs")
+    word_budget: int = Field(..., description="Maximum number of words of these paragraphs for the letter to fit on one page")
+
+    @property
+    def fits(self) -> bool:
+        return self.overflow_lines == 0
+
+
+def char_width(char: str, size: float = FONT_SIZE) -> float:
+    """Returns the width of a character in pt."""
+    if char not in CMR10_WIDTHS:
+        # Accented letters are the base letter with an accent on top
+        char = unicodedata.normalize("NFKD", char)[:1] or char
+    return CMR10_WIDTHS.get(char, DEFAULT_WIDTH) * size / 1000
+
+
+def text_width(text: str, size: float = FONT_SIZE) -> float:
+    """Returns the natural width of a text without its spaces, in pt."""
+    return sum(char_width(char, size) for char in text)
+
+
+def break_lines(text: str, size: float = FONT_SIZE, width: float = TEXT_WIDTH, factor: float = 1.0) -> List[str]:
+    """Breaks a justified paragraph into lines the way TeX roughly does.
+
+    The interword spaces may shrink as in TeX, and a word that does not fit
+    may be hyphenated, which makes the model slightly optimistic.
+
+    Args:
+        text: Text of the paragraph
+        size: Font size in pt
+        width: Width of the lines in pt
+        factor: Width factor of the font relative to cmr10 (e.g. for bold)
+    """
+    lines: List[str] = []
+    line: List[str] = []
+    natural = 0.0
+    shrink = 0.0
+    space, _, space_shrink = (value * size * factor for value in SPACE)
+    extra_space = EXTRA_SPACE * size * factor
+
+    def glue_after(word: str) -> Tuple[float, float]:
+        if SENTENCE_END.search(word):
+            return space + extra_space, space_shrink / 3
+        return space, space_shrink
+
+    for word in text.split():
+        word_width = text_width(word, size) * factor
+        if line:
+            glue, glue_shrink = glue_after(line[-1])
+            if natural + glue + word_width - shrink - glue_shrink <= width:
+                line.append(word)
+                natural += glue + word_width
+                shrink += glue_shrink
+                continue
+
+            # Hyphenate the word if its beginning fits on the line
+            letters = len(word)
+            hyphenated = None
+            if letters >= sum(HYPHEN_MIN) and word.isalpha():
+                hyphen = char_width("-", size) * factor
+                for cut in range(letters - HYPHEN_MIN[1], HYPHEN_MIN[0] - 1, -1):
+                    head_width = text_width(word[:cut], size) * factor + hyphen
+                    if natural + glue + head_width - shrink - glue_shrink <= width:
+                        hyphenated = cut
+                        break
+            lines.append(" ".join(line + ([word[:hyphenated] + "-"] if hyphenated else [])))
+            if hyphenated:
+                word = word[hyphenated:]
+                word_width = text_width(word, size) * factor
+        line = [word]
+        natural = word_width
+        shrink = 0.0
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def truncate_words(text: str, words: int) -> str:
+    return " ".join(text.split()[:max(words, 0)])
+
+
+def letter_blocks(letter: MotivationLetter, run_context: RunContext,
+                  paragraphs: Optional[List[str]] = None) -> List[Tuple[List[str], float, float]]:
+    """Returns the blocks of the letter as (lines, baseline skip, extra space before the block).
+
+    Args:
+        letter: Letter to lay out
+        run_context: Context of the run, giving the sender and recipient printed on the letter
+        paragraphs: Texts replacing the opening, core and closing paragraphs, in this order
+    """
+    content = letter.content
+    if paragraphs is None:
+        paragraphs = [paragraph.content for paragraph in editable_paragraphs(letter)]
+    sender = run_context.sender
+    recipient = run_context.recipient
+
+    cm = 10 * PT_PER_MM
+    recipient_lines = [part for part in [recipient.name, recipient.institution, recipient.department, recipient.address] if part]
+    blocks = [
+        ([sender.name, sender.address, sender.email, sender.phone], BASELINE_SKIP, 0.0),
+        # The recipient block ends with \\ which adds an empty line
+        (sum([break_lines(part) for part in recipient_lines], []) + [""], BASELINE_SKIP, 0.15 * cm + PAR_SKIP),
+        (["date"], BASELINE_SKIP, 0.15 * cm + PAR_SKIP),
+        (break_lines(letter.subject, LARGE_FONT_SIZE, factor=BOLD_FACTOR), LARGE_BASELINE_SKIP, 0.5 * cm + PAR_SKIP),
+        # The rule cancels the interline glue: depth of the subject, spaces and rule, height of the first line
+        (break_lines(content.formal_opening), BASELINE_SKIP,
+         LINE_DEPTH + 0.15 * cm + 0.4 + 0.5 * cm + PAR_SKIP + LINE_HEIGHT - BASELINE_SKIP),
+    ]
+    for i, paragraph in enumerate(paragraphs):
+        # The formal opening is followed by \vspace{0.15cm}
+        blocks.append((break_lines(paragraph), BASELINE_SKIP, PAR_SKIP + (0.15 * cm if i == 0 else 0.0)))
+    blocks.append((break_lines(content.gratitude), BASELINE_SKIP, PAR_SKIP))
+    blocks.append((break_lines(content.final_greeting), BASELINE_SKIP, 0.15 * cm + PAR_SKIP))
+    blocks.append(([letter.sender.name], BASELINE_SKIP, 1 * cm))
+    return blocks
+
+
+def editable_paragraphs(letter: MotivationLetter) -> list:
+    """Returns the paragraphs the agent is asked to shorten when the letter is too long."""
+    content = letter.content
+    return [content.opening_paragraph, *content.core_paragraphs, content.closing_paragraph]
+
+
+def measure(letter: MotivationLetter, run_context: RunContext, paragraphs: Optional[List[str]] = None) -> Tuple[int, float]:
+    """Returns the number of lines of the letter and its height on a single page, in pt."""
+    lines = 0
+    height = TOP_SKIP - BASELINE_SKIP
+    for block_lines, skip, before in letter_blocks(letter, run_context, paragraphs):
+        lines += len(block_lines)
+        height += before + skip * len(block_lines)
+    return lines, height
+
+
+def overflow(height: float) -> int:
+    """Returns the number of lines beyond the first page for a given height."""
+    return max(0, math.ceil((height - TEXT_HEIGHT) / BASELINE_SKIP))
+
+
+def word_budget(letter: MotivationLetter, run_context: RunContext) -> int:
+    """Returns the largest number of words of the editable paragraphs for which the letter fits on a page.
+
+    The paragraphs are shortened proportionally to their length, as the agent is asked to do.
+    """
+    texts = [paragraph.content for paragraph in editable_paragraphs(letter)]
+    counts = [count_words(text) for text in texts]
+    total = sum(counts)
+
+    def fits(words: int) -> bool:
+        kept = [truncate_words(text, round(count * words / total)) for text, count in zip(texts, counts)]
+        return overflow(measure(letter, run_context, kept)[1]) == 0
+
+    if total == 0 or fits(total):
+        return total
+    low, high = 0, total
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def predict_layout(letter: MotivationLetter, run_context: RunContext) -> LayoutPrediction:
+    """Predicts the number of lines and pages of a letter."""
+    lines, height = measure(letter, run_context)
+    overflow_lines = overflow(height)
+    lines_per_page = int((TEXT_HEIGHT - TOP_SKIP) / BASELINE_SKIP) + 1
+    words = sum(count_words(paragraph.content) for paragraph in editable_paragraphs(letter))
+    return LayoutPrediction(
+        lines=lines,
+        height=height,
+        pages=1 + math.ceil(overflow_lines / lines_per_page),
+        overflow_lines=overflow_lines,
+        free_lines=max(0, int((TEXT_HEIGHT - height) / BASELINE_SKIP)),
+        words=words,
+        word_budget=words if overflow_lines == 0 else word_budget(letter, run_context),
+    )
+
+
+def too_long_message(prediction: LayoutPrediction) -> str:
+    """Returns the instruction given to the agent to shorten a letter."""
+    return (f"Your letter is too long: it takes about {prediction.overflow_lines} lines more than a single page. "
+            f"The opening, core and closing paragraphs have {prediction.words} words in total, "
+            f"shorten them to at most {prediction.word_budget} words (remove {prediction.words - prediction.word_budget} words, "
+            f"only from these paragraphs, not from other parts) while keeping it pleasant to read. "
+            f"Remember that the core paragraphs are expected to be larger than the opening and closing paragraphs.")
+
+
+SAMPLE_SENTENCES = [
+    "My experience in data engineering taught me how to design reliable pipelines for demanding users.",
+    "During my master's thesis, I developed a simulation framework that reduced computation times by forty percent.",
+    "I am particularly motivated by your commitment to sustainable infrastructure and open research.",
+    "Working in an international team, I learned to communicate clearly with engineers and scientists alike.",
+    "Your recent projects on renewable energy forecasting match both my technical background and my ambitions.",
+    "I would bring rigorous analytical skills, curiosity and a strong sense of responsibility to your department.",
+]
+
+
+def sample_run_context(output_dir: str) -> RunContext:
+    """Returns the context of a fictitious run writing to `output_dir`."""
+    from src.postulator.data_structures.custom_data_structures import RecipientInfo, SenderInfo
+
+    return RunContext(
+        sender=SenderInfo(name="Jane Doe", address="12 Rue de la Paix, 75002 Paris", email="jane.doe@example.com", phone="+33 6 12 34 56 78"),
+        recipient=RecipientInfo(name="Hiring Manager", institution="Example Energy", department="Data Platform", address="1 Main Street, Lyon"),
+        output_dir=output_dir,
+    )
+
+
+def sample_letter(core_sentences: int, run_context: RunContext) -> MotivationLetter:
+    """Builds a letter whose core paragraphs have `core_sentences` sentences each."""
+    from src.postulator.data_structures.custom_data_structures import LetterContent, Paragraph
+
+    def paragraph(sentences: int, offset: int) -> Paragraph:
+        text = " ".join(SAMPLE_SENTENCES[(offset + i) % len(SAMPLE_SENTENCES)] for i in range(sentences))
+        return Paragraph(strategic_purpose="Validation", content=text)
+
+    return MotivationLetter(
+        sender=run_context.sender,
+        recipient=run_context.recipient,
+        subject="Application for the position of Data Engineer",
+        content=LetterContent(
+            formal_opening="Dear Sir or Madam,",
+            opening_paragraph=paragraph(2, 0),
+            core_paragraphs=[paragraph(core_sentences, i) for i in range(3)],
+            closing_paragraph=paragraph(2, 3),
+            gratitude="Thank you for considering my application, I remain at your disposal for an interview.",
+            final_greeting="Sincerely,",
+        ),
+    )
+
+
+def validate(max_sentences: int = 9, output_dir: str = os.path.join("output", "layout_validation")) -> List[Dict]:
+    """Compiles letters of increasing length and compares their real layout with the prediction."""
+    from src.postulator.latex import latex_compiler
+    from src.postulator.tools.custom_tool import letter_writer
+
+    run_context = sample_run_context(output_dir)
+    results = []
+    for sentences in range(1, max_sentences + 1):
+        letter = sample_letter(sentences, run_context)
+        prediction = predict_layout(letter, run_context)
+        compiled = latex_compiler().compile(letter_writer._letter_from_pydantic(letter, run_context), output_dir, f"sample_{sentences}")
+        pages = compiled.pages
+        extra_lines = sum(len(text.strip().splitlines()) for text in compiled.page_texts[1:])
+        results.append({
+            "sentences": sentences,
+            "words": prediction.words,
+            "predicted_pages": prediction.pages,
+            "pages": pages,
+            "predicted_overflow": prediction.overflow_lines,
+            "overflow": extra_lines,
+            "rejected": prediction.overflow_lines > REJECT_MARGIN_LINES,
+        })
+    return results
+
+
+def write_golden(path: str, max_sentences: int = 9) -> List[Dict]:
+    """Compiles the sample letters with pdflatex and writes their real layouts to `path`.
+
+    Only the measured values are kept (words, pages, lines beyond the first
+    page), so that the file stays valid when the model changes.
+    """
+    golden = [{"sentences": result["sentences"], "words": result["words"], "pages": result["pages"], "overflow": result["overflow"]}
+              for result in validate(max_sentences)]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=2)
+        f.write("\n")
+    return golden
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compares the layout model with pdflatex")
+    parser.add_argument("--golden", help="Write the layouts given by pdflatex to this file instead")
+    args = parser.parse_args()
+    if args.golden:
+        for entry in write_golden(args.golden):
+            print(entry)
+    else:
+        results = validate()
+        print(f"{'words':>6} {'pages':>6} {'predicted':>9} {'overflow':>8} {'predicted':>9} {'rejected':>8}")
+        for result in results:
+            print(f"{result['words']:>6} {result['pages']:>6} {result['predicted_pages']:>9} "
+                  f"{result['overflow']:>8} {result['predicted_overflow']:>9} {str(result['rejected']):>8}")
+        wrong = [result for result in results if result["rejected"] and result["pages"] == 1]
+        agree = sum(1 for result in results if (result["predicted_pages"] == 1) == (result["pages"] == 1))
+        print(f"Page count agreement: {agree}/{len(results)}, letters wrongly rejected: {len(wrong)}")
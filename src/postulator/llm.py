@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from crewai import LLM
+
+from src.postulator.cache import DiskCache, cache_path
+from src.postulator.instrumentation import count_tokens, current_tracer
+from src.postulator.rate_limit import rate_limiter
+
+# "off": no cache, "cache": reuse the answers of temperature 0 calls,
+# "record": call the API and store every answer, "replay": only serve stored answers
+LLM_CACHE_MODE = os.environ.get("LLM_CACHE_MODE", "off")
+LLM_CACHE_MODES = ("off", "cache", "record", "replay")
+
+# Maximum size of the stored answers, least recently used first evicted
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+
+_llm_store = None
+_llm_store_lock = threading.Lock()
+
+
+class LLMReplayMiss(RuntimeError):
+    """Raised in replay mode when no answer was recorded for a call."""
+
+
+def llm_store() -> DiskCache:
+    """Returns the store of LLM answers shared by all the LLMs of the process."""
+    global _llm_store
+    if _llm_store is None:
+        with _llm_store_lock:
+            if _llm_store is None:
+                _llm_store = DiskCache(
+                    os.environ.get("LLM_CACHE_PATH") or cache_path("llm.sqlite"),
+                    max_bytes=LLM_CACHE_MAX_BYTES,
+                )
+    return _llm_store
+
+
+class PostulatorLLM(LLM):
+    """crewai LLM whose answers can be cached, recorded and replayed.
+
+    Calls are keyed on the model, the temperature, the rendered messages and
+    the tool schemas. Calls executing tools directly (`available_functions`)
+    are never served from the store since the tools have side effects. The
+    arguments of `call` are forwarded untouched, as their signature differs
+    between crewai versions (`call(messages, callbacks)` in 0.86).
+    Requests sent to the API go through the process-wide rate limiter and
+    every call is reported to the current tracer, if any.
+    """
+
+    def __init__(self, *args, cache_mode: str = "off", session_id: Optional[str] = None, **kwargs) -> None:
+        """
+        Args:
+            cache_mode: One of "off", "cache", "record" or "replay"
+            session_id: Identifier of the user session, used to share the rate limit fairly
+        """
+        if cache_mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode {cache_mode!r}, expected one of {LLM_CACHE_MODES}")
+        super().__init__(*args, **kwargs)
+        self.cache_mode = cache_mode
+        self.session_id = session_id
+
+    def cache_key(self, messages: Any, tools: Optional[list] = None) -> str:
+        """Returns the key under which the answer to a call is stored."""
+        request = {
+            "model": self.model,
+            "temperature": self.temperature,
+            "messages": messages,
+            "tools": tools,
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def call(self, messages, *args, **kwargs):
+        start = time.perf_counter()
+        # The LLM is shared by concurrent tasks, the wait of this call is only kept locally
+        try:
+            answer, cached, rate_limit_wait = self._call(messages, *args, **kwargs)
+        except Exception as e:
+            tracer = current_tracer()
+            if tracer is not None:
+                tracer.record_llm_call(
+                    prompt_tokens=count_tokens(self.model, messages=messages),
+                    completion_tokens=0,
+                    wall_time=time.perf_counter() - start,
+                    error=str(e),
+                )
+            raise
+        wall_time = time.perf_counter() - start
+        completion_tokens = count_tokens(self.model, text=answer) if isinstance(answer, str) else 0
+        if not cached:
+            rate_limiter().charge(self.api_key or "", completion_tokens)
+        tracer = current_tracer()
+        if tracer is not None:
+            tracer.record_llm_call(
+                prompt_tokens=count_tokens(self.model, messages=messages),
+                completion_tokens=completion_tokens,
+                wall_time=wall_time,
+                cached=cached,
+                rate_limit_wait=rate_limit_wait,
+            )
+        return answer
+
+    def _send(self, messages, *args, **kwargs):
+        """Sends a call to the API once the rate limiter allows it, and returns the answer and the time waited."""
+        wait = rate_limiter().acquire(
+            self.api_key or "",
+            tokens=count_tokens(self.model, messages=messages),
+            session=self.session_id,
+        )
+        return super().call(messages, *args, **kwargs), wait
+
+    def _call(self, messages, *args, **kwargs):
+        """Returns the answer to a call, whether it was served from the store and the time waited for the rate limiter."""
+        cacheable = not kwargs.get("available_functions") and (
+            self.cache_mode in ("record", "replay") or (self.cache_mode == "cache" and not self.temperature)
+        )
+        if not cacheable:
+            if self.cache_mode == "replay":
+                raise LLMReplayMiss("Calls executing tools cannot be replayed")
+            answer, wait = self._send(messages, *args, **kwargs)
+            return answer, False, wait
+
+        key = self.cache_key(messages, kwargs.get("tools"))
+        if self.cache_mode != "record":
+            answer = llm_store().get(key)
+            if answer is not None:
+                return answer.decode("utf-8"), True, 0.0
+            if self.cache_mode == "replay":
+                raise LLMReplayMiss(f"No recorded answer for the call {key}")
+
+        answer, wait = self._send(messages, *args, **kwargs)
+        if isinstance(answer, str):
+            llm_store().set(key, answer.encode("utf-8"))
+        return answer, False, wait
+
+
+def make_llm(api_key: str, temperature: float, model: Optional[str] = None, session_id: Optional[str] = None) -> LLM:
+    """Creates the LLM used by the agents.
+
+    Args:
+        api_key: Gemini API key
+        temperature: Sampling temperature
+        model: Model name (defaults to the MODEL environment variable)
+        session_id: Identifier of the user session, for fair rate limiting
+    """
+    return PostulatorLLM(
+        model=model or os.environ["MODEL"],
+        api_key=api_key,
+        temperature=temperature,
+        cache_mode=LLM_CACHE_MODE,
+        session_id=session_id,
+    )
@@ -0,0 +1,156 @@
+"""
+Text extraction of the PDFs read by the agents (job descriptions, lab pages...).
+
+PDFs are opened in memory with PyMuPDF and only read up to a page budget and a
+character budget, so a 200-page document neither blocks a worker nor floods
+the prompt. The extracted text is cached by the hash of the file.
+
+Compare with the former PyPDF2 extraction with:
+    python -m src.postulator.pdf_text file.pdf [...]
+"""
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from src.postulator.cache import DiskCache, cache_path, sha256_bytes
+
+# Pages and characters of a PDF returned to the agents at most
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 30))
+PDF_MAX_CHARS = int(os.environ.get("PDF_MAX_CHARS", 40000))
+
+_pdf_extractor = None
+_pdf_extractor_lock = threading.Lock()
+
+
+class PdfText(BaseModel):
+    """Text extracted from a PDF."""
+    text: str = Field("", description="Text of the pages read, within the character budget")
+    pages: int = Field(0, description="Number of pages of the PDF")
+    pages_read: int = Field(0, description="Number of pages whose text is (at least partly) returned")
+    truncated: bool = Field(False, description="Whether pages or characters were left out")
+    digest: str = Field("", description="SHA-256 of the PDF")
+    cached: bool = Field(False, description="Whether the text was served from the cache")
+    seconds: float = Field(0.0, description="Time spent extracting")
+
+
+class PdfExtractor:
+    """Extracts the text of PDFs within a page and a character budget."""
+
+    def __init__(self, max_pages: int = PDF_MAX_PAGES, max_chars: int = PDF_MAX_CHARS,
+                 cache: Optional[DiskCache] = None) -> None:
+        """
+        Args:
+            max_pages: Maximum number of pages read
+            max_chars: Maximum number of characters returned
+            cache: Cache of the extracted texts, None for the default one
+        """
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self.cache = cache or DiskCache(cache_path("pdf_text.sqlite"), ttl=7 * 24 * 3600, max_entries=500)
+
+    def _key(self, digest: str) -> str:
+        return f"text:{self.max_pages}:{self.max_chars}:{digest}"
+
+    def _page_texts(self, data: bytes) -> Tuple[int, List[str]]:
+        """Returns the number of pages and the text of the pages within the budgets."""
+        import pymupdf
+
+        with pymupdf.open(stream=data, filetype="pdf") as document:
+            pages = document.page_count
+            texts, chars = [], 0
+            for i in range(min(pages, self.max_pages)):
+                texts.append(document[i].get_text())
+                chars += len(texts[-1])
+                if chars >= self.max_chars:
+                    break
+            return pages, texts
+
+    def extract(self, path: str, use_cache: bool = True) -> PdfText:
+        """Extracts the text of a PDF.
+
+        Args:
+            path: Path of the PDF
+            use_cache: Whether a text extracted before from the same file can be reused
+        """
+        start = time.time()
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = sha256_bytes(data)
+        if use_cache:
+            cached = self.cache.get_json(self._key(digest))
+            if cached is not None:
+                return PdfText(**cached, cached=True, seconds=time.time() - start)
+
+        pages, texts = self._page_texts(data)
+        texts = [text.strip() for text in texts]
+        text = "\n".join(text for text in texts if text)
+        truncated = len(texts) < pages or len(text) > self.max_chars
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars]
+            # The last page read can be cut by the character budget
+            lengths, pages_read = 0, 0
+            for page_text in texts:
+                if lengths >= self.max_chars:
+                    break
+                lengths += len(page_text) + 1
+                pages_read += 1
+        else:
+            pages_read = len(texts)
+        result = PdfText(text=text, pages=pages, pages_read=pages_read, truncated=truncated, digest=digest)
+        self.cache.set_json(self._key(digest), result.model_dump(exclude={"cached", "seconds"}))
+        result.seconds = time.time() - start
+        return result
+
+
+def pdf_extractor() -> PdfExtractor:
+    """Returns the PDF extractor shared by all the sessions of the process."""
+    global _pdf_extractor
+    if _pdf_extractor is None:
+        with _pdf_extractor_lock:
+            if _pdf_extractor is None:
+                _pdf_extractor = PdfExtractor()
+    return _pdf_extractor
+
+
+def extract_pypdf2(path: str) -> str:
+    """Former extraction of the PDF reader tool: every page, serially, with PyPDF2."""
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return "\n".join(text for text in (page.extract_text() for page in reader.pages) if text)
+
+
+def benchmark(paths: List[str], runs: int = 3) -> List[Dict[str, float]]:
+    """Times PyPDF2 and PyMuPDF (uncached and cached) on each PDF, taking the best of `runs`."""
+    results = []
+    for path in paths:
+        modes = {
+            "pypdf2": lambda: len(extract_pypdf2(path)),
+            "pymupdf": lambda: len(PdfExtractor().extract(path, use_cache=False).text),
+            "pymupdf_cached": lambda: len(pdf_extractor().extract(path).text),
+        }
+        result = {"path": path}
+        for name, run in modes.items():
+            timings = []
+            for _ in range(runs):
+                start = time.time()
+                result[f"{name}_chars"] = run()
+                timings.append(time.time() - start)
+            result[name] = min(timings)
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    modes = ["pypdf2", "pymupdf", "pymupdf_cached"]
+    print(f"{'file':<30}" + "".join(f"{mode:>18}" for mode in modes))
+    for result in benchmark(sys.argv[1:]):
+        print(f"{os.path.basename(result['path']):<30}"
+              + "".join(f"{result[mode]:>9.3f}s {result[mode + '_chars']:>7}" for mode in modes))
+    print(f"Budgets: {PDF_MAX_PAGES} pages, {PDF_MAX_CHARS} characters")
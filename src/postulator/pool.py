@@ -0,0 +1,209 @@
+"""
+Pool of the objects that are expensive to build and can be reused between runs:
+LLM clients, and crews with their agents, tasks, configurations and tools.
+
+Objects are pooled per API key, model settings and session. A pooled crew is
+leased to one run at a time and only its per-run inputs (run context, result
+sink, trace) are rebound before it runs. Entries of the sessions that ended,
+or unused for `POOL_IDLE_TTL` seconds, are evicted.
+"""
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+# Maximum number of pooled objects, least recently used first evicted
+POOL_MAX_ENTRIES = int(os.environ.get("POOL_MAX_ENTRIES", 64))
+# Pooled objects unused for this many seconds are evicted
+POOL_IDLE_TTL = float(os.environ.get("POOL_IDLE_TTL", 1800))
+# Seconds between two checks of the sessions that ended
+SESSION_CHECK_INTERVAL = 60
+
+_resource_pool = None
+_resource_pool_lock = threading.Lock()
+
+
+def key_digest(api_key: str) -> str:
+    """Identifies an API key in the pool keys without keeping it."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def session_active(session_id: str) -> Optional[bool]:
+    """Returns whether a Streamlit session is still connected, or None outside of a Streamlit server."""
+    try:
+        from streamlit.runtime import Runtime
+        if not Runtime.exists():
+            return None
+        return Runtime.instance().is_active_session(session_id)
+    except Exception:
+        return None
+
+
+class PoolEntry:
+    def __init__(self, value: Any, session_id: Optional[str]) -> None:
+        self.value = value
+        self.session_id = session_id
+        self.used_at = time.time()
+        self.leased = False
+
+
+class ResourcePool:
+    """Objects built by keyed factories and reused until their session ends."""
+
+    def __init__(self, max_entries: int = POOL_MAX_ENTRIES, idle_ttl: float = POOL_IDLE_TTL) -> None:
+        """
+        Args:
+            max_entries: Maximum number of pooled objects
+            idle_ttl: Seconds after which an unused object is evicted
+        """
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self._entries: Dict[Hashable, PoolEntry] = {}
+        self._lock = threading.Lock()
+        self._checked_at = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self, now: float) -> None:
+        """Removes the idle entries, the entries of ended sessions and the least recently used ones."""
+        check_sessions = now - self._checked_at > SESSION_CHECK_INTERVAL
+        if check_sessions:
+            self._checked_at = now
+        for key, entry in list(self._entries.items()):
+            if entry.leased:
+                continue
+            expired = now - entry.used_at > self.idle_ttl
+            ended = check_sessions and entry.session_id is not None and session_active(entry.session_id) is False
+            if expired or ended:
+                del self._entries[key]
+                self.evictions += 1
+        idle = sorted((entry.used_at, key) for key, entry in self._entries.items() if not entry.leased)
+        for _, key in idle[:max(0, len(self._entries) - self.max_entries)]:
+            del self._entries[key]
+            self.evictions += 1
+
+    def get(self, key: Hashable, factory: Callable[[], Any], session_id: Optional[str] = None) -> Any:
+        """Returns the object of `key`, built with `factory` if it is not pooled. It can be shared by several callers.
+
+        Args:
+            key: Key of the object, including everything its construction depends on
+            factory: Builds the object
+            session_id: Session the object belongs to, it is evicted when the session ends
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.used_at = time.time()
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+        value = factory()
+        with self._lock:
+            entry = self._entries.setdefault(key, PoolEntry(value, session_id))
+            self._evict(time.time())
+            return entry.value
+
+    @contextmanager
+    def lease(self, key: Hashable, factory: Callable[[], Any], session_id: Optional[str] = None) -> Iterator[Any]:
+        """Lends the object of `key` to a single caller at a time.
+
+        When the pooled object is already leased, a new one is built for the
+        caller and pooled if the key is free again once it is done.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not entry.leased:
+                entry.leased = True
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        if entry is None:
+            entry = PoolEntry(factory(), session_id)
+            entry.leased = True
+        try:
+            yield entry.value
+        finally:
+            with self._lock:
+                entry.leased = False
+                entry.used_at = time.time()
+                self._entries.setdefault(key, entry)
+                self._evict(entry.used_at)
+
+    def release_session(self, session_id: str) -> int:
+        """Evicts the objects of a session and returns their number."""
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry.session_id == session_id and not entry.leased]
+            for key in keys:
+                del self._entries[key]
+            self.evictions += len(keys)
+            return len(keys)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+def resource_pool() -> ResourcePool:
+    """Returns the pool shared by all the sessions of the process."""
+    global _resource_pool
+    if _resource_pool is None:
+        with _resource_pool_lock:
+            if _resource_pool is None:
+                _resource_pool = ResourcePool()
+    return _resource_pool
+
+
+def pooled_llm(llm_key: str, temperature: float = 0.0, session_id: Optional[str] = None):
+    """Returns the LLM client of an API key, temperature and session, built once."""
+    from src.postulator.llm import make_llm
+
+    return resource_pool().get(
+        ("llm", key_digest(llm_key), temperature, session_id),
+        lambda: make_llm(llm_key, temperature=temperature, session_id=session_id),
+        session_id=session_id,
+    )
+
+
+@contextmanager
+def pooled_postulator(llm_key: str, cv_path: str, run_context, dag: bool = False,
+                      session_id: Optional[str] = None) -> Iterator[Any]:
+    """Lends a `Postulator` crew bound to `run_context`, reusing the one of the previous generation of the session.
+
+    Args:
+        llm_key: API key of the LLM
+        cv_path: Path of the resume read by the crew
+        run_context: Context of the run, the only input rebound between runs
+        dag: Whether the crew runs as a DAG of tasks
+        session_id: Session of the user
+    """
+    from src.postulator.crew import Postulator
+
+    key: Tuple = ("postulator", key_digest(llm_key), cv_path, dag, session_id)
+    with resource_pool().lease(key, lambda: Postulator(llm_key, cv_path, run_context, dag=dag, session_id=session_id),
+                               session_id=session_id) as postulator:
+        yield postulator.prepare(run_context)
+
+
+@contextmanager
+def pooled_cv_parser(llm_key: str, sink, session_id: Optional[str] = None, model=None, max_retries: int = 10) -> Iterator[Any]:
+    """Lends a `CVParser` crew writing to `sink`, reused between the parses of the session.
+
+    Args:
+        llm_key: API key of the LLM
+        sink: Where the parsed CV is written, the only input rebound between runs
+        session_id: Session of the user
+        model: Model of the output, the whole `CV` by default
+        max_retries: Validation retries of the agent
+    """
+    from src.postulator.crew import CVParser
+    from src.postulator.data_structures.custom_data_structures import CV
+
+    model = model or CV
+    key: Tuple = ("cv_parser", key_digest(llm_key), model.__name__, tuple(model.model_fields), max_retries, session_id)
+    with resource_pool().lease(key, lambda: CVParser(llm_key, sink, session_id=session_id, model=model, max_retries=max_retries),
+                               session_id=session_id) as parser:
+        yield parser.prepare(sink)
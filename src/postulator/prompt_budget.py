@@ -0,0 +1,268 @@
+"""
+Assembly of the task prompts within a token budget.
+
+Input tokens drive the latency of the crew and the tokens-per-minute limits of
+the API, so the prompts are assembled in a few steps before a task runs:
+    - the JSON schemas given to the agents are compacted: titles derived from
+      the field names, null defaults and the null unions of optional fields are dropped;
+    - the long texts of the inputs (job posting, resume, write-up) are kept
+      within `PROMPT_INPUT_TOKENS` each;
+    - an input interpolated several times in a task is only kept the first
+      time, later occurrences refer to it;
+    - the blocks of the context already in the prompt or in another context
+      output are dropped, and the context is truncated so that the task
+      stays within `PROMPT_TASK_TOKENS`.
+The tokens of each section are recorded in the trace of the run.
+
+Show the sections of the prompts of some inputs with:
+    python -m src.postulator.prompt_budget [--resume cv.md] [--job-posting posting.txt]
+"""
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+from src.postulator.instrumentation import count_tokens
+
+# Tokens of a long text input (job posting, resume, write-up) kept at most
+PROMPT_INPUT_TOKENS = int(os.environ.get("PROMPT_INPUT_TOKENS", 6000))
+# Tokens of a task prompt (description, expected output and context) kept at most
+PROMPT_TASK_TOKENS = int(os.environ.get("PROMPT_TASK_TOKENS", 16000))
+
+# Inputs holding long free texts, truncated to the input budget
+TEXT_INPUTS = ["job_posting", "resume", "personal_writeup"]
+# Inputs holding a JSON schema, compacted
+SCHEMA_INPUTS = ["schema"]
+# Inputs and context blocks shorter than this are never deduplicated
+DEDUPE_MIN_CHARS = 200
+
+CONTEXT_DIVIDER = "\n\n----------\n\n"
+
+
+def tokens(text: str, model: Optional[str] = None) -> int:
+    """Counts the tokens of a text with the tokenizer of the model of the crew."""
+    return count_tokens(model or os.environ.get("MODEL", "gemini/gemini-2.0-flash"), text=text) if text else 0
+
+
+def truncate_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """Keeps the beginning of a text within `max_tokens`, cut at a line or word boundary."""
+    total = tokens(text, model)
+    if total <= max_tokens:
+        return text
+    # Characters per token of this text, with a margin for the note
+    keep = int(len(text) * max(0, max_tokens - 20) / total)
+    head = text[:keep]
+    cut = max(head.rfind("\n"), head.rfind(" "))
+    if cut > keep * 0.8:
+        head = head[:cut]
+    return head.rstrip() + f"\n[... truncated, about {max_tokens} of {total} tokens kept]"
+
+
+def compact_schema(schema: Any, required: bool = False) -> Any:
+    """Removes the metadata of a JSON schema that does not help the LLM fill it.
+
+    Titles derived from the field names and null defaults are dropped, `anyOf`
+    unions with null become a nullable type. The descriptions and required
+    fields are kept.
+
+    Args:
+        schema: JSON schema, or a part of it
+        required: Whether `schema` is a property listed in the `required` of its object
+    """
+    if isinstance(schema, list):
+        return [compact_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    compacted = {}
+    for key, value in schema.items():
+        if key == "title" and isinstance(value, str):
+            continue
+        if key == "default" and value is None:
+            continue
+        if key == "anyOf" and isinstance(value, list):
+            options = [option for option in value if option != {"type": "null"}]
+            if len(options) == 1 and len(options) < len(value):
+                option = compact_schema(options[0])
+                if not required:
+                    # Optional field: its type alone, leaving it out stands for null
+                    for option_key, option_value in option.items():
+                        compacted.setdefault(option_key, option_value)
+                    continue
+                if isinstance(option.get("type"), str):
+                    # Required but nullable: null must stay allowed
+                    option["type"] = [option["type"], "null"]
+                    for option_key, option_value in option.items():
+                        compacted.setdefault(option_key, option_value)
+                    continue
+        if key == "properties" and isinstance(value, dict):
+            # The keys of `properties` are field names, not schema keywords
+            names = set(schema.get("required", []))
+            compacted[key] = {name: compact_schema(field, name in names) for name, field in value.items()}
+            continue
+        compacted[key] = compact_schema(value)
+    return compacted
+
+
+def compact_schema_json(schema: Any) -> str:
+    """Returns a schema (a dictionary or its JSON dump) compacted and dumped without whitespace."""
+    if isinstance(schema, str):
+        schema = json.loads(schema)
+    return json.dumps(compact_schema(schema), separators=(",", ":"), ensure_ascii=False)
+
+
+def _normalize(block: str) -> str:
+    return re.sub(r"\s+", " ", block).strip()
+
+
+def dedupe_blocks(text: str, seen: set, min_chars: int = DEDUPE_MIN_CHARS) -> str:
+    """Drops the paragraphs of a text already in `seen`, and adds the others to it.
+
+    Args:
+        text: Text split into paragraphs on blank lines
+        seen: Normalized paragraphs already in the prompt
+        min_chars: Paragraphs shorter than this are always kept
+    """
+    kept = []
+    for block in re.split(r"\n\s*\n", text):
+        normalized = _normalize(block)
+        if len(normalized) >= min_chars:
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+        kept.append(block)
+    return "\n\n".join(kept)
+
+
+def share_budget(sizes: List[int], budget: int) -> List[int]:
+    """Splits a budget between texts: the small ones are kept whole, the others share the rest equally."""
+    shares = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for position, i in enumerate(order):
+        shares[i] = min(sizes[i], remaining // (len(sizes) - position))
+        remaining -= shares[i]
+    return shares
+
+
+class PromptBudget:
+    """Assembles the inputs and contexts of the tasks of one run within the token budgets."""
+
+    def __init__(self, input_tokens: int = PROMPT_INPUT_TOKENS, task_tokens: int = PROMPT_TASK_TOKENS,
+                 model: Optional[str] = None, tracer=None) -> None:
+        """
+        Args:
+            input_tokens: Tokens kept at most of each long text input
+            task_tokens: Tokens kept at most of each task prompt
+            model: Model whose tokenizer counts the tokens, the MODEL environment variable by default
+            tracer: Tracer of the run, where the tokens of each section are recorded
+        """
+        self.input_tokens = input_tokens
+        self.task_tokens = task_tokens
+        self.model = model
+        self.tracer = tracer
+        self.inputs: Dict[str, Any] = {}
+        # task name -> section -> tokens
+        self.sections: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, task: str, section: str, value: int) -> None:
+        with self._lock:
+            self.sections.setdefault(task, {})[section] = value
+
+    def prepare_inputs(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns the inputs with the schemas compacted and the long texts within the input budget."""
+        prepared = dict(inputs)
+        for name in SCHEMA_INPUTS:
+            if prepared.get(name):
+                try:
+                    prepared[name] = compact_schema_json(prepared[name])
+                except ValueError:
+                    pass
+        for name in TEXT_INPUTS:
+            if isinstance(prepared.get(name), str):
+                before = tokens(prepared[name], self.model)
+                prepared[name] = truncate_tokens(prepared[name], self.input_tokens, self.model)
+                if before > self.input_tokens:
+                    print(f"Input {name} truncated from {before} to {self.input_tokens} tokens")
+        self.inputs = prepared
+        return prepared
+
+    def dedupe_task(self, task, name: str) -> None:
+        """Keeps a single copy of each long input interpolated in an (interpolated) task.
+
+        The description comes first in the prompt, later copies are replaced by
+        a reference to it. The tokens of the description and expected output
+        are recorded.
+        """
+        for key, value in self.inputs.items():
+            if not isinstance(value, str) or len(value) < DEDUPE_MIN_CHARS:
+                continue
+            reference = f"(the {key.replace('_', ' ')} given above)"
+            if value in task.description:
+                first = task.description.index(value) + len(value)
+                task.description = task.description[:first] + task.description[first:].replace(value, reference)
+                task.expected_output = task.expected_output.replace(value, reference)
+        self._record(name, "description", tokens(task.description, self.model))
+        self._record(name, "expected_output", tokens(task.expected_output, self.model))
+
+    def context(self, name: str, task, raws: List[str]) -> str:
+        """Assembles the context of a task from the outputs of the tasks it depends on.
+
+        Blocks already in the description or in a previous output are dropped,
+        then the outputs share what the description and expected output left of
+        the task budget.
+
+        Args:
+            name: Name of the task
+            task: crewai Task, already interpolated
+            raws: Raw outputs of the context tasks
+        """
+        seen: set = set()
+        dedupe_blocks(task.description, seen)
+        raws = [dedupe_blocks(raw, seen) for raw in raws]
+        sizes = [tokens(raw, self.model) for raw in raws]
+        self._record(name, "context_full", sum(sizes))
+
+        prompt = tokens(task.description, self.model) + tokens(task.expected_output, self.model)
+        budget = max(0, self.task_tokens - prompt)
+        if sum(sizes) > budget:
+            raws = [truncate_tokens(raw, share, self.model) for raw, share in zip(raws, share_budget(sizes, budget))]
+            print(f"Context of {name} truncated from {sum(sizes)} to {budget} tokens")
+        context = CONTEXT_DIVIDER.join(raws)
+        self._record(name, "context", tokens(context, self.model))
+        if self.tracer is not None:
+            self.tracer.record_prompt(name, dict(self.sections[name]))
+        return context
+
+    def report(self) -> str:
+        """Formats the tokens of each section of the task prompts."""
+        columns = ["description", "expected_output", "context_full", "context"]
+        lines = [f"{'Task':<40}" + "".join(f"{column:>17}" for column in columns)]
+        for name, sections in self.sections.items():
+            lines.append(f"{name:<40}" + "".join(f"{sections.get(column, 0):>17}" for column in columns))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from src.postulator.data_structures.custom_data_structures import MotivationLetter
+
+    parser = argparse.ArgumentParser(description="Tokens of the inputs before and after the prompt assembly")
+    parser.add_argument("--resume", help="File holding the resume")
+    parser.add_argument("--job-posting", help="File holding the job posting")
+    parser.add_argument("--personal-writeup", help="File holding the personal write-up")
+    args = parser.parse_args()
+
+    raw_inputs = {"schema": json.dumps(MotivationLetter.model_json_schema())}
+    for input_name in TEXT_INPUTS:
+        path = getattr(args, input_name)
+        if path:
+            with open(path, encoding="utf-8") as f:
+                raw_inputs[input_name] = f.read()
+    prepared_inputs = PromptBudget().prepare_inputs(raw_inputs)
+    print(f"{'input':<20} {'before':>8} {'after':>8}")
+    for input_name, text in raw_inputs.items():
+        print(f"{input_name:<20} {tokens(text):>8} {tokens(prepared_inputs[input_name]):>8}")
+    print(f"Budgets: {PROMPT_INPUT_TOKENS} tokens per input, {PROMPT_TASK_TOKENS} tokens per task")
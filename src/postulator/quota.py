@@ -0,0 +1,224 @@
+"""
+Usage counters of the letters generated by each user, and the free quota.
+
+The counters live in memory: a quota check or an increment only takes a lock,
+and the storage is only read the first time an identity is seen and then once
+per `QUOTA_COUNT_TTL` seconds, to see the letters counted by other processes.
+Increments are added to the stored counters by a background thread, with the
+atomic `Storage.increment`, so concurrent sessions and processes never lose one.
+
+Benchmark it under concurrent writers with:
+    python -m src.postulator.quota
+"""
+import atexit
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from src.postulator.storage import SQLiteStorage, Storage, user_storage
+
+# Letters a user can generate without their own API key
+FREE_LETTERS = 2
+# Seconds between two flushes of the counters to the storage
+QUOTA_FLUSH_INTERVAL = float(os.environ.get("QUOTA_FLUSH_INTERVAL", 5))
+# Seconds after which a counter is read again from the storage, where other processes add their letters
+QUOTA_COUNT_TTL = float(os.environ.get("QUOTA_COUNT_TTL", QUOTA_FLUSH_INTERVAL))
+
+_quota_services: Dict[int, "QuotaService"] = {}
+_quota_lock = threading.Lock()
+
+
+class QuotaService:
+    """Counters of letters per identity, kept in memory and flushed periodically to the storage."""
+
+    def __init__(self, storage: Storage, flush_interval: float = QUOTA_FLUSH_INTERVAL,
+                 table: str = "usage", column: str = "Usage", count_ttl: float = QUOTA_COUNT_TTL) -> None:
+        """
+        Args:
+            storage: Storage of the counters, written directly (not through a write-behind queue)
+            flush_interval: Seconds between two flushes, 0 to only flush on `flush` and at exit
+            count_ttl: Seconds after which a stored value is read again, to see the increments of other processes
+            table: Table of the counters
+            column: Column of the counters
+        """
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.table = table
+        self.column = column
+        self.count_ttl = count_ttl
+        # identity -> stored value and when it was read, increments being flushed, increments not flushed yet
+        self._counts: Dict[str, int] = {}
+        self._read_at: Dict[str, float] = {}
+        self._flushing: Dict[str, int] = {}
+        self._deltas: Dict[str, int] = {}
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.flushes = 0
+        self.errors = 0
+        self._thread = None
+        if flush_interval > 0:
+            self._thread = threading.Thread(target=self._loop, name="quota-flush", daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _value(self, identity: str) -> int:
+        return self._counts[identity] + self._flushing.get(identity, 0) + self._deltas.get(identity, 0)
+
+    def usage(self, identity: str) -> int:
+        """Returns the number of letters of an identity, reading the storage at most once per `count_ttl`."""
+        with self._lock:
+            read_at = self._read_at.get(identity)
+            if identity in self._counts and (time.time() - read_at < self.count_ttl or identity in self._flushing):
+                return self._value(identity)
+        if read_at is not None:
+            self.storage.invalidate(self.table, identity)
+        row = self.storage.get(self.table, identity)
+        stored = int(row.get(self.column) or 0) if row else 0
+        with self._lock:
+            # A flush that ran meanwhile stored a newer value, which the one read may not include
+            if self._read_at.get(identity) == read_at and identity not in self._flushing:
+                self._counts[identity] = stored
+                self._read_at[identity] = time.time()
+            return self._value(identity)
+
+    def increment(self, identity: str, amount: int = 1, row: Optional[Dict[str, Any]] = None) -> int:
+        """Adds letters to an identity and returns its new usage.
+
+        Args:
+            identity: Key of the user in the usage table
+            amount: Number of letters to add
+            row: Other columns of the usage row, stored if the user has none yet
+        """
+        self.usage(identity)
+        with self._lock:
+            self._deltas[identity] = self._deltas.get(identity, 0) + amount
+            if row:
+                self._rows[identity] = row
+            return self._value(identity)
+
+    def allowed(self, identity: str, limit: int = FREE_LETTERS) -> bool:
+        """Returns whether an identity can still generate a letter within `limit`."""
+        return self.usage(identity) < limit
+
+    def flush(self) -> int:
+        """Adds the pending increments to the storage and returns the number of identities written."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._deltas = self._deltas, {}
+                rows, self._rows = self._rows, {}
+                flushing = dict(self._flushing)
+            written = 0
+            for identity, delta in flushing.items():
+                try:
+                    total = self.storage.increment(self.table, identity, self.column, delta, rows.get(identity))
+                except Exception as e:
+                    print(f"Could not update the usage of {identity}, retrying at the next flush: {e}")
+                    with self._lock:
+                        self.errors += 1
+                        self._deltas[identity] = self._deltas.get(identity, 0) + self._flushing.pop(identity)
+                        if identity in rows:
+                            self._rows.setdefault(identity, rows[identity])
+                    continue
+                # The stored value also holds the increments of the other processes
+                with self._lock:
+                    self._counts[identity] = total
+                    self._read_at[identity] = time.time()
+                    self._flushing.pop(identity)
+                written += 1
+            with self._lock:
+                self.flushes += 1
+            return written
+
+    def _loop(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self) -> None:
+        """Stops the background thread and flushes the pending increments."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "identities": len(self._counts),
+                "pending": sum(self._deltas.values()) + sum(self._flushing.values()),
+                "flushes": self.flushes,
+                "errors": self.errors,
+            }
+
+
+def quota_service(conn=None) -> QuotaService:
+    """Returns the quota service of the storage selected for the user data, shared by all the sessions.
+
+    Args:
+        conn: Google Sheets connection object, used by the `gsheets` backend
+    """
+    storage = user_storage(conn, write_behind=False)
+    with _quota_lock:
+        if id(storage) not in _quota_services:
+            _quota_services[id(storage)] = QuotaService(storage)
+        return _quota_services[id(storage)]
+
+
+def benchmark(writers: int = 8, increments: int = 2000, identities: int = 50) -> Dict[str, float]:
+    """Increments counters from concurrent threads, with the quota service and with a read-modify-write per increment.
+
+    Args:
+        writers: Number of concurrent threads
+        increments: Increments made by each thread
+        identities: Number of distinct identities
+    """
+    import tempfile
+
+    results: Dict[str, float] = {}
+    expected = writers * increments
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ["service", "read_modify_write"]:
+            storage = SQLiteStorage(os.path.join(directory, f"{mode}.sqlite"))
+            service = QuotaService(storage, flush_interval=0.5)
+
+            def write(worker: int) -> None:
+                for i in range(increments):
+                    identity = f"user{(worker * increments + i) % identities}"
+                    if mode == "service":
+                        service.allowed(identity)
+                        service.increment(identity)
+                    else:
+                        # The former update_user_usage: read the counter, add one, write it back
+                        row = storage.get("usage", identity)
+                        storage.put("usage", identity, {"Usage": (int(row["Usage"]) if row else 0) + 1})
+
+            threads = [threading.Thread(target=write, args=(worker,)) for worker in range(writers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - start
+
+            if mode == "service":
+                # Latency of a quota check on a known identity
+                checks = 100000
+                check_start = time.perf_counter()
+                for i in range(checks):
+                    service.allowed(f"user{i % identities}")
+                results["check_us"] = 1e6 * (time.perf_counter() - check_start) / checks
+            service.stop()
+            stored = sum(int(row["Usage"]) for row in storage.rows("usage"))
+            results[f"{mode}_us_per_increment"] = 1e6 * seconds / expected
+            results[f"{mode}_lost_increments"] = expected - stored
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(f"Quota service: {results['service_us_per_increment']:.1f}us per increment, "
+          f"{results['service_lost_increments']:.0f} increments lost, {results['check_us']:.2f}us per quota check")
+    print(f"Read-modify-write: {results['read_modify_write_us_per_increment']:.1f}us per increment, "
+          f"{results['read_modify_write_lost_increments']:.0f} increments lost")
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+# Limits of one API key, shared by every session using it
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", 15))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", 1_000_000))
+
+# When set, the buckets are stored in this directory and shared between processes
+RATE_LIMIT_STATE_DIR = os.environ.get("RATE_LIMIT_STATE_DIR")
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def key_id(api_key: str) -> str:
+    """Returns an identifier of an API key that does not reveal the key."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class _Buckets:
+    """Request and token buckets of every API key, kept in memory."""
+
+    def __init__(self, rpm: int, tpm: Optional[int]) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self._state: Dict[str, Dict[str, float]] = {}
+
+    def _refill(self, state: Dict[str, float], now: float) -> Dict[str, float]:
+        elapsed = now - state["updated_at"]
+        state["requests"] = min(self.rpm, state["requests"] + elapsed * self.rpm / 60)
+        if self.tpm:
+            state["tokens"] = min(self.tpm, state["tokens"] + elapsed * self.tpm / 60)
+        state["updated_at"] = now
+        return state
+
+    def _take(self, state: Dict[str, float], tokens: int, now: float) -> float:
+        """Consumes a request and `tokens` tokens if possible, else returns the time to wait."""
+        self._refill(state, now)
+        # A request larger than the whole bucket is let through once the bucket is full
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        waits = [(1 - state["requests"]) * 60 / self.rpm]
+        if self.tpm:
+            waits.append((tokens - state["tokens"]) * 60 / self.tpm)
+        wait = max(waits)
+        if wait > 0:
+            return wait
+        state["requests"] -= 1
+        state["tokens"] -= tokens
+        return 0.0
+
+    def _new_state(self, now: float) -> Dict[str, float]:
+        return {"requests": float(self.rpm), "tokens": float(self.tpm or 0), "updated_at": now}
+
+    def try_acquire(self, key: str, tokens: int) -> float:
+        now = time.time()
+        state = self._state.setdefault(key, self._new_state(now))
+        return self._take(state, tokens, now)
+
+    def charge(self, key: str, tokens: int) -> None:
+        now = time.time()
+        state = self._refill(self._state.setdefault(key, self._new_state(now)), now)
+        state["tokens"] -= tokens
+
+
+class _FileBuckets(_Buckets):
+    """Request and token buckets stored in files locked with `flock`, shared between processes."""
+
+    def __init__(self, rpm: int, tpm: Optional[int], directory: str) -> None:
+        super().__init__(rpm, tpm)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked_state(self, key: str) -> Iterator[Dict[str, float]]:
+        import fcntl
+
+        path = os.path.join(self.directory, f"{key}.json")
+        with open(path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                state = json.loads(content) if content else self._new_state(time.time())
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def try_acquire(self, key: str, tokens: int) -> float:
+        with self._locked_state(key) as state:
+            return self._take(state, tokens, time.time())
+
+    def charge(self, key: str, tokens: int) -> None:
+        with self._locked_state(key) as state:
+            self._refill(state, time.time())
+            state["tokens"] -= tokens
+
+
+class RateLimiter:
+    """Token bucket rate limiter shared by all the sessions of the process.
+
+    Each API key has a request bucket (RPM) and a token bucket (TPM). The
+    callers waiting on the same key are served round-robin between sessions,
+    so that a session sending many requests cannot starve the others.
+    """
+
+    def __init__(self, rpm: int = GEMINI_RPM, tpm: Optional[int] = GEMINI_TPM, state_dir: Optional[str] = None) -> None:
+        """
+        Args:
+            rpm: Requests per minute allowed per API key
+            tpm: Tokens per minute allowed per API key (None: unlimited)
+            state_dir: Directory where the buckets are shared between processes (None: process only)
+        """
+        self.buckets = _FileBuckets(rpm, tpm, state_dir) if state_dir else _Buckets(rpm, tpm)
+        self._condition = threading.Condition()
+        # For every key, the waiting tickets of every session, sessions in round-robin order
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def _is_next(self, key: str, session: str, ticket: object) -> bool:
+        queues = self._queues[key]
+        first_session = next(iter(queues))
+        return first_session == session and queues[session][0] is ticket
+
+    def acquire(self, api_key: str, tokens: int = 0, session: Optional[str] = None) -> float:
+        """Blocks until a request of `tokens` tokens can be sent with `api_key`.
+
+        Args:
+            api_key: API key used for the request
+            tokens: Estimated number of tokens of the request
+            session: Identifier of the calling session, for fair queuing
+
+        Returns:
+            The time waited, in seconds.
+        """
+        key = key_id(api_key)
+        session = session or "default"
+        ticket = object()
+        start = time.perf_counter()
+        with self._condition:
+            queues = self._queues.setdefault(key, OrderedDict())
+            queues.setdefault(session, deque()).append(ticket)
+            stats = self._stats.setdefault(key, {"granted": 0, "total_wait": 0.0, "max_wait": 0.0})
+            try:
+                while True:
+                    if self._is_next(key, session, ticket):
+                        wait = self.buckets.try_acquire(key, tokens)
+                        if wait <= 0:
+                            break
+                        self._condition.wait(timeout=wait)
+                    else:
+                        self._condition.wait(timeout=1.0)
+            finally:
+                queues[session].remove(ticket)
+                if queues[session]:
+                    # The session goes to the back of the round-robin
+                    queues.move_to_end(session)
+                else:
+                    del queues[session]
+                self._condition.notify_all()
+            waited = time.perf_counter() - start
+            stats["granted"] += 1
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+        return waited
+
+    def charge(self, api_key: str, tokens: int) -> None:
+        """Consumes tokens only known after a request, e.g. the completion tokens."""
+        with self._condition:
+            self.buckets.charge(key_id(api_key), tokens)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns, per API key identifier, the queue depth and the waiting times."""
+        with self._condition:
+            return {
+                key: {
+                    "queue_depth": sum(len(tickets) for tickets in self._queues.get(key, {}).values()),
+                    "waiting_sessions": len(self._queues.get(key, {})),
+                    "granted": stats["granted"],
+                    "mean_wait": stats["total_wait"] / stats["granted"] if stats["granted"] else 0.0,
+                    "max_wait": stats["max_wait"],
+                }
+                for key, stats in self._stats.items()
+            }
+
+
+def rate_limiter() -> RateLimiter:
+    """Returns the rate limiter shared by all the LLMs of the process."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter(state_dir=RATE_LIMIT_STATE_DIR)
+    return _rate_limiter
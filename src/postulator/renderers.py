@@ -0,0 +1,206 @@
+"""
+Renderers turning a `MotivationLetter` into a PDF.
+
+- `latex`: the letter is written in LaTeX and compiled with pdflatex (default)
+- `pymupdf`: the letter is laid out in-process with PyMuPDF, no TeX installation needed
+
+The renderer is chosen with the `LETTER_RENDERER` environment variable. Both
+lay out an A4 page with 25 mm margins (a 453pt wide text block, first baseline
+within 1pt of the LaTeX one), 11pt text on 13.6pt baselines and the same
+vertical spacing. PyMuPDF uses its built-in serif font, Charis SIL, instead of
+Computer Modern, so lines can break at other words and a letter right at a
+page boundary can get one page more or less than with LaTeX.
+
+Compare their speed with:
+    python -m src.postulator.renderers
+"""
+import html
+import os
+import time
+from typing import Dict, List, Optional
+
+from src.postulator.data_structures.custom_data_structures import MotivationLetter
+from src.postulator.latex import CompileResult, latex_compiler
+from src.postulator.layout import (BASELINE_SKIP, FONT_SIZE, LARGE_BASELINE_SKIP, LARGE_FONT_SIZE, PAR_SKIP,
+                                   PT_PER_MM)
+from src.postulator.run_context import RunContext
+
+LETTER_RENDERER = os.environ.get("LETTER_RENDERER", "latex")
+
+# CSS points are PostScript points (1/72 in), TeX points are 1/72.27 in
+BP_PER_PT = 72 / 72.27
+MARGIN_MM = 25
+
+_renderers: Dict[str, "LetterRenderer"] = {}
+
+
+class LetterRenderer:
+    """Renders a letter to `<output_dir>/<job_name>.pdf`."""
+
+    name = ""
+    # Whether the layout model of `src.postulator.layout` predicts the output of this renderer
+    layout_model = False
+
+    def render(self, letter: MotivationLetter, run_context: RunContext, job_name: str) -> CompileResult:
+        """Renders a letter in the output directory of the run.
+
+        Args:
+            letter: Letter to render
+            run_context: Context of the run, giving the sender, recipient, language and output directory
+            job_name: Name of the files, without extension
+        """
+        raise NotImplementedError
+
+
+class LatexRenderer(LetterRenderer):
+    """Writes the letter in LaTeX and compiles it with pdflatex."""
+
+    name = "latex"
+    layout_model = True
+
+    def __init__(self, use_cache: bool = True) -> None:
+        """
+        Args:
+            use_cache: Whether PDFs compiled before from the same source can be reused
+        """
+        self.use_cache = use_cache
+
+    def render(self, letter: MotivationLetter, run_context: RunContext, job_name: str) -> CompileResult:
+        from src.postulator.tools.custom_tool import letter_writer
+
+        source = letter_writer._letter_from_pydantic(letter, run_context)
+        return latex_compiler().compile(source, run_context.output_dir, job_name, use_cache=self.use_cache)
+
+
+class PyMuPDFRenderer(LetterRenderer):
+    """Lays out the letter in-process with the PyMuPDF Story API."""
+
+    name = "pymupdf"
+
+    def css(self) -> str:
+        """Returns the style sheet reproducing the layout of the LaTeX letter."""
+        cm = 10 * PT_PER_MM * BP_PER_PT
+
+        def bp(pt: float) -> str:
+            return f"{pt * BP_PER_PT:.2f}pt"
+
+        # The default style sheet of the Story indents the body, the text block is the whole rectangle given to `place`
+        return f"""
+        body {{ margin: 0; padding: 0; font-family: serif; font-size: {bp(FONT_SIZE)}; line-height: {bp(BASELINE_SKIP)}; }}
+        p {{ margin: 0 0 {bp(PAR_SKIP)} 0; text-align: justify; }}
+        .right {{ text-align: right; }}
+        .left {{ text-align: left; }}
+        .subject {{ font-size: {bp(LARGE_FONT_SIZE)}; line-height: {bp(LARGE_BASELINE_SKIP)}; font-weight: bold; text-align: left;
+                    margin-top: {0.5 * cm:.2f}pt; margin-bottom: {0.15 * cm:.2f}pt; }}
+        .after-vspace {{ margin-top: {0.15 * cm:.2f}pt; }}
+        .signature {{ margin-top: {1 * cm:.2f}pt; }}
+        hr {{ border: none; border-top: {bp(0.4)} solid black; margin: 0 0 {0.5 * cm:.2f}pt 0; }}
+        """
+
+    def html(self, letter: MotivationLetter, run_context: RunContext) -> str:
+        """Returns the letter as HTML, block by block as in the LaTeX template."""
+        from src.postulator.tools.custom_tool import get_formatted_date
+
+        def text(value: Optional[str]) -> str:
+            return html.escape(value or "")
+
+        def lines(values: List[Optional[str]]) -> str:
+            return "<br/>".join(text(value) for value in values if value)
+
+        sender = run_context.sender
+        recipient = run_context.recipient
+        content = letter.content
+        paragraphs = [content.opening_paragraph, *content.core_paragraphs, content.closing_paragraph]
+        return "".join([
+            f'<p class="right">{lines([sender.name, sender.address, sender.email, sender.phone])}</p>',
+            # The recipient block of the LaTeX letter ends with an empty line
+            f'<p class="left after-vspace">{lines([recipient.name, recipient.institution, recipient.department, recipient.address])}<br/>&#160;</p>',
+            f'<p class="right after-vspace">{text(get_formatted_date(run_context.language))}</p>',
+            f'<p class="subject">{text(letter.subject)}</p>',
+            "<hr/>",
+            f'<p class="left">{text(content.formal_opening)}</p>',
+            *[f'<p class="{"after-vspace" if i == 0 else ""}">{text(paragraph.content)}</p>' for i, paragraph in enumerate(paragraphs)],
+            f"<p>{text(content.gratitude)}</p>",
+            f'<p class="left after-vspace">{text(content.final_greeting)}</p>',
+            f'<p class="left signature">{text(letter.sender.name)}</p>',
+        ])
+
+    def render(self, letter: MotivationLetter, run_context: RunContext, job_name: str) -> CompileResult:
+        import io
+
+        import pymupdf
+
+        start = time.time()
+        story = pymupdf.Story(html=self.html(letter, run_context), user_css=self.css())
+        buffer = io.BytesIO()
+        writer = pymupdf.DocumentWriter(buffer)
+        page_rect = pymupdf.paper_rect("a4")
+        margin = MARGIN_MM * 72 / 25.4
+        text_rect = page_rect + (margin, margin, -margin, -margin)
+        more = True
+        while more:
+            device = writer.begin_page(page_rect)
+            more, _ = story.place(text_rect)
+            story.draw(device)
+            writer.end_page()
+        writer.close()
+
+        os.makedirs(run_context.output_dir, exist_ok=True)
+        pdf_path = run_context.output_path(job_name + ".pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(buffer.getvalue())
+        with pymupdf.open("pdf", buffer.getvalue()) as document:
+            page_texts = [page.get_text() for page in document]
+
+        result = CompileResult(pdf_path=pdf_path, success=True, pages=len(page_texts), page_texts=page_texts,
+                               passes=1, seconds=time.time() - start)
+        print(f"Rendered {job_name} with PyMuPDF in {result.seconds:.3f}s")
+        return result
+
+
+RENDERERS = {renderer.name: renderer for renderer in [LatexRenderer, PyMuPDFRenderer]}
+
+
+def letter_renderer(name: Optional[str] = None) -> LetterRenderer:
+    """Returns the renderer called `name`, by default the one selected by `LETTER_RENDERER`."""
+    name = name or LETTER_RENDERER
+    if name not in RENDERERS:
+        raise ValueError(f"Unknown letter renderer '{name}', expected one of {', '.join(RENDERERS)}")
+    if name not in _renderers:
+        _renderers[name] = RENDERERS[name]()
+    return _renderers[name]
+
+
+def benchmark(runs: int = 5, output_dir: str = os.path.join("output", "renderer_benchmark")) -> Dict[str, Dict[str, float]]:
+    """Renders the same letter with every renderer and returns their timings.
+
+    The LaTeX renderer runs without the PDF cache, so that each run is a real compilation.
+    """
+    from src.postulator.layout import sample_letter, sample_run_context
+
+    run_context = sample_run_context(output_dir)
+    letter = sample_letter(4, run_context)
+    results = {}
+    for renderer in [LatexRenderer(use_cache=False), PyMuPDFRenderer()]:
+        timings = []
+        pages = 0
+        for i in range(runs):
+            start = time.time()
+            result = renderer.render(letter, run_context, f"{renderer.name}_{i}")
+            timings.append(time.time() - start)
+            pages = result.pages or 0
+        timings.sort()
+        results[renderer.name] = {
+            "median": timings[len(timings) // 2],
+            "min": timings[0],
+            "max": timings[-1],
+            "pages": pages,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    print(f"{'renderer':<10} {'min':>8} {'median':>8} {'max':>8} {'pages':>6}")
+    for name, result in results.items():
+        print(f"{name:<10} {result['min']:>7.3f}s {result['median']:>7.3f}s {result['max']:>7.3f}s {result['pages']:>6}")
@@ -0,0 +1,97 @@
+import hashlib
+import re
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from src.postulator.cache import DiskCache, cache_path
+
+# Query parameters that identify a visitor or a campaign, not a posting
+TRACKING_PARAMETERS = {"gclid", "fbclid", "msclkid", "ref", "refid", "trk", "trackingid", "src", "source"}
+
+# Maximum Hamming distance between the simhashes of two near-duplicate postings
+SIMHASH_DISTANCE = 3
+
+
+def is_url(job_posting: str) -> bool:
+    """Returns True if the job posting is given as a URL rather than as text."""
+    text = job_posting.strip()
+    return " " not in text and "\n" not in text and re.match(r"^(https?://|www\.)", text, re.IGNORECASE) is not None
+
+
+def normalize_url(url: str) -> str:
+    """Normalizes a job posting URL so that equivalent URLs map to the same key.
+
+    The scheme, "www." prefix, fragment, trailing slash and tracking parameters
+    are dropped and the remaining query parameters are sorted.
+    """
+    url = url.strip()
+    if not re.match(r"^https?://", url, re.IGNORECASE):
+        url = "https://" + url
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.lower().startswith("utm_") and name.lower() not in TRACKING_PARAMETERS
+    )
+    return urlunsplit(("", host, parts.path.rstrip("/"), urlencode(query), "")).lstrip("/")
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """Computes a 64 bits simhash of a text over its word shingles.
+
+    Near-duplicate texts (e.g. the same posting pasted with a different
+    header or spacing) get simhashes with a small Hamming distance.
+    """
+    words = re.findall(r"\w+", text.lower())
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    weights = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class ResearchCache:
+    """Persistent cache of the output of the research task.
+
+    URLs are looked up by their normalized form, pasted texts by their simhash
+    so that near-duplicate postings share the same entry.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 7 * 24 * 3600, max_entries: int = 1000) -> None:
+        """
+        Args:
+            path: Path of the SQLite file (defaults to the cache directory)
+            ttl: Time to live of an entry in seconds
+            max_entries: Maximum number of postings kept, least recently used first evicted
+        """
+        self.cache = DiskCache(path or cache_path("research.sqlite"), ttl=ttl, max_entries=max_entries)
+
+    def key(self, job_posting: str) -> str:
+        """Returns the cache key of a job posting."""
+        if is_url(job_posting):
+            return "url:" + normalize_url(job_posting)
+        return f"text:{simhash(job_posting):016x}"
+
+    def get(self, job_posting: str) -> Optional[str]:
+        """Returns the research output of the posting or of a near-duplicate posting."""
+        if not job_posting or not job_posting.strip():
+            return None
+        key = self.key(job_posting)
+        if key.startswith("text:"):
+            fingerprint = int(key[5:], 16)
+            candidates = [candidate for candidate in self.cache.keys("text:")
+                          if bin(int(candidate[5:], 16) ^ fingerprint).count("1") <= SIMHASH_DISTANCE]
+            if candidates:
+                key = min(candidates, key=lambda candidate: bin(int(candidate[5:], 16) ^ fingerprint).count("1"))
+        value = self.cache.get_json(key)
+        return value["research"] if value else None
+
+    def set(self, job_posting: str, research: str) -> None:
+        """Stores the research output of a job posting."""
+        if not job_posting or not job_posting.strip() or not research:
+            return
+        self.cache.set_json(self.key(job_posting), {"job_posting": job_posting, "research": research})
@@ -0,0 +1,34 @@
+import os
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, Field
+
+from src.postulator.data_structures.custom_data_structures import CV, MotivationLetter, RecipientInfo, SenderInfo
+
+
+class ResultSink(BaseModel):
+    """Results produced by the tools during a run, read by the caller afterwards."""
+    pydantic_letter: Optional[MotivationLetter] = Field(None, description="Last letter accepted by the feedback tool")
+    preview_letter: Optional[str] = Field(None, description="Plain text preview of the accepted letter")
+    latex_letter: Optional[str] = Field(None, description="LaTeX source of the accepted letter")
+    cleaned: Optional[str] = Field(None, description="JSON of the accepted letter, as given by the agent")
+    cv_pydantic: Optional[CV] = Field(None, description="CV parsed by the CV parser")
+    cv_sections: Optional[Dict[str, Any]] = Field(None, description="Sections of the CV parsed by the CV parser, when it only parses some of them")
+    letters_saved: int = Field(0, description="Number of letters accepted during the run")
+
+
+class RunContext(BaseModel):
+    """Everything the tools need to know about the run they are part of.
+
+    It is given explicitly to the tools, so that a crew does not depend on the
+    Streamlit session and can run in any thread or process.
+    """
+    sender: SenderInfo = Field(..., description="Sender's information printed on the letter.")
+    recipient: RecipientInfo = Field(..., description="Recipient's information printed on the letter.")
+    language: str = Field("English", description="Language of the letter.")
+    output_dir: str = Field("output", description="Directory where the files of the run are written.")
+    sink: ResultSink = Field(default_factory=ResultSink, description="Results of the tools.")
+
+    def output_path(self, file_name: str) -> str:
+        """Returns the path of a file of the run."""
+        return os.path.join(self.output_dir, file_name)
@@ -0,0 +1,149 @@
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+
+class TaskTiming(BaseModel):
+    """Wall-clock timing of a single task of a DAG run."""
+    name: str = Field(..., description="Name of the task")
+    dependencies: List[str] = Field(default_factory=list, description="Names of the context tasks it waited for")
+    start: float = Field(0.0, description="Start time in seconds, relative to the beginning of the run")
+    end: float = Field(0.0, description="End time in seconds, relative to the beginning of the run")
+    precomputed: bool = Field(False, description="True if the output was provided instead of executed")
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def task_name(task, index: int) -> str:
+    """Returns a readable name for a crewai task."""
+    return getattr(task, "name", None) or f"task_{index}"
+
+
+def task_dependencies(task, tasks: List) -> List:
+    """Returns the tasks of the crew listed in the context of `task`."""
+    context = task.context if isinstance(task.context, list) else []
+    return [dependency for dependency in context if any(dependency is other for other in tasks)]
+
+
+def aggregate_context(outputs: List) -> str:
+    """Concatenates the raw outputs of the context tasks the same way crewai does."""
+    dividers = "\n\n----------\n\n"
+    return dividers.join(output.raw for output in outputs)
+
+
+def critical_path(timings: Dict[str, TaskTiming]) -> List[str]:
+    """Returns the chain of tasks that determined the end-to-end wall time."""
+    if not timings:
+        return []
+    path = [max(timings.values(), key=lambda timing: timing.end).name]
+    while timings[path[-1]].dependencies:
+        path.append(max(timings[path[-1]].dependencies, key=lambda name: timings[name].end))
+    return list(reversed(path))
+
+
+def format_timings(timings: Dict[str, TaskTiming]) -> str:
+    """Formats a per-task wall time report, critical path included."""
+    lines = [f"{'Task':<40} {'start':>8} {'end':>8} {'wall':>8}"]
+    for timing in sorted(timings.values(), key=lambda timing: timing.start):
+        flag = " (precomputed)" if timing.precomputed else ""
+        lines.append(f"{timing.name:<40} {timing.start:>7.1f}s {timing.end:>7.1f}s {timing.duration:>7.1f}s{flag}")
+    lines.append("Critical path: " + " -> ".join(critical_path(timings)))
+    return "\n".join(lines)
+
+
+def run_dag(crew, inputs: Dict, max_workers: int = 4, precomputed: Optional[Dict] = None,
+            initializer: Optional[Callable] = None, tracer=None, prompt_budget=None) -> Tuple[object, Dict[str, TaskTiming]]:
+    """Runs the tasks of a crew as a DAG instead of a sequence.
+
+    Each task is started as soon as all the tasks listed in its `context` are
+    done, independent branches run concurrently on a worker pool.
+
+    Args:
+        crew: crewai Crew whose tasks should be executed
+        inputs: Inputs interpolated into the agents and tasks (as for `kickoff`)
+        max_workers: Size of the worker pool
+        precomputed: Task outputs (by task name) that should not be executed again
+        initializer: Called by each worker thread before running tasks
+        tracer: Tracer recording the tasks, LLM calls and tool calls of the run
+        prompt_budget: PromptBudget whose inputs were interpolated, deduplicating and truncating the prompts
+
+    Returns:
+        The CrewOutput of the run and the timings of every task.
+    """
+    from crewai.crews.crew_output import CrewOutput
+    from crewai.tasks.task_output import TaskOutput
+
+    crew._interpolate_inputs(inputs)
+    for agent in crew.agents:
+        agent.crew = crew
+
+    tasks = list(crew.tasks)
+    names = {id(task): task_name(task, i) for i, task in enumerate(tasks)}
+    if prompt_budget is not None:
+        for task in tasks:
+            prompt_budget.dedupe_task(task, names[id(task)])
+    dependencies = {id(task): task_dependencies(task, tasks) for task in tasks}
+
+    outputs: Dict[int, object] = {}
+    timings: Dict[str, TaskTiming] = {}
+    origin = time.perf_counter()
+
+    for task in tasks:
+        raw = (precomputed or {}).get(names[id(task)])
+        if raw is None:
+            continue
+        outputs[id(task)] = raw if isinstance(raw, TaskOutput) else TaskOutput(
+            description=task.description,
+            raw=raw,
+            agent=task.agent.role if task.agent else "",
+        )
+        timings[names[id(task)]] = TaskTiming(name=names[id(task)], precomputed=True)
+
+    def execute(task):
+        start = time.perf_counter() - origin
+        context_outputs = [outputs[id(dependency)] for dependency in dependencies[id(task)]]
+        if prompt_budget is not None:
+            context = prompt_budget.context(names[id(task)], task, [output.raw for output in context_outputs])
+        else:
+            context = aggregate_context(context_outputs)
+        agent_role = task.agent.role if task.agent else ""
+        with tracer.span(names[id(task)], agent_role, task) if tracer else nullcontext():
+            output = task.execute_sync(agent=task.agent, context=context, tools=task.tools)
+        timings[names[id(task)]] = TaskTiming(
+            name=names[id(task)],
+            dependencies=[names[id(dependency)] for dependency in dependencies[id(task)]],
+            start=start,
+            end=time.perf_counter() - origin,
+        )
+        return output
+
+    pending = [task for task in tasks if id(task) not in outputs]
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=initializer) as executor:
+        while pending or running:
+            ready = [task for task in pending if all(id(dependency) in outputs for dependency in dependencies[id(task)])]
+            for task in ready:
+                pending.remove(task)
+                running[executor.submit(execute, task)] = task
+            if not running:
+                raise ValueError("The context of the remaining tasks cannot be satisfied: "
+                                 + ", ".join(names[id(task)] for task in pending))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                outputs[id(running.pop(future))] = future.result()
+
+    tasks_output = [outputs[id(task)] for task in tasks]
+    final_output = tasks_output[-1]
+    result = CrewOutput(
+        raw=final_output.raw,
+        pydantic=final_output.pydantic,
+        json_dict=final_output.json_dict,
+        tasks_output=tasks_output,
+        token_usage=crew.calculate_usage_metrics(),
+    )
+    return result, timings
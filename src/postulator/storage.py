@@ -0,0 +1,661 @@
+"""
+Storage of the user data: profiles, CVs and usage.
+
+Each table is one worksheet of the Google Sheets spreadsheet, and rows are
+stored as they are in the sheets (`start` before the phone numbers, `empty`
+for the missing texts), so both backends hold the same data:
+
+- `gsheets`: the Google Sheets spreadsheet of the `gsheets` Streamlit connection (default)
+- `sqlite`: a local SQLite file indexed by key, where a lookup or a write only touches one row
+
+The backend is chosen with the `POSTULATOR_STORAGE` environment variable or
+the `storage` secret. Writes are queued and persisted by a background thread
+(`WriteBehindStorage`), so that a user never waits on the spreadsheet.
+Copy the sheets into the SQLite file with:
+    python -m src.postulator.storage migrate
+"""
+import atexit
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+STORAGE_PATH = os.environ.get("POSTULATOR_STORAGE_PATH", os.path.join("data", "postulator.sqlite"))
+# The key -> row index of a worksheet is reloaded after this many seconds
+GSHEETS_INDEX_TTL = float(os.environ.get("GSHEETS_INDEX_TTL", 300))
+# Writes are persisted by a background thread every STORAGE_FLUSH_INTERVAL seconds, unless disabled
+STORAGE_WRITE_BEHIND = os.environ.get("STORAGE_WRITE_BEHIND", "1") != "0"
+STORAGE_FLUSH_INTERVAL = float(os.environ.get("STORAGE_FLUSH_INTERVAL", 2))
+# A flush starts without waiting for the interval once this many rows are queued
+STORAGE_FLUSH_BATCH = 100
+
+_sqlite_storages: Dict[str, "SQLiteStorage"] = {}
+_gsheets_storages: Dict[int, "GSheetsStorage"] = {}
+_write_behind: Dict[Any, "WriteBehindStorage"] = {}
+_storages_lock = threading.Lock()
+
+
+class Table(NamedTuple):
+    worksheet: str
+    key: str
+    columns: List[str]
+
+
+TABLES = {
+    "profiles": Table("Feuille 1", "Key", ["Key", "Name", "Email", "Address", "Phone", "Write-up"]),
+    "cvs": Table("Feuille 2", "Key", ["Key", "CV text", "CV pydantic"]),
+    "usage": Table("Feuille 3", "Name", ["Name", "Email", "Address", "Phone", "Usage"]),
+}
+
+
+def usage_key(name: str) -> str:
+    """Returns the key of a user in the usage table, made from their name."""
+    return name.lower().replace(" ", ",")
+
+
+def sheet_value(cell: str) -> Any:
+    """Converts a cell read from a worksheet, always a string, to a number when it is one, as pandas does."""
+    if re.fullmatch(r"-?\d+", cell):
+        return int(cell)
+    if re.fullmatch(r"-?\d*\.\d+", cell):
+        return float(cell)
+    return cell
+
+
+def column_letter(number: int) -> str:
+    """Returns the letter of a column of a worksheet, from 1 (A)."""
+    letters = ""
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def appended_first_row(response: Any) -> Optional[int]:
+    """Returns the number of the first row written by an append, from the response of the Sheets API."""
+    try:
+        match = re.search(r"![A-Z]+(\d+)", response["updates"]["updatedRange"])
+    except (KeyError, TypeError):
+        return None
+    return int(match.group(1)) if match else None
+
+
+def plain_value(value: Any) -> Any:
+    """Converts a cell read by pandas to a JSON value (numpy scalars to Python ones, NaN to an empty string)."""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return ""
+    return value
+
+
+class Storage:
+    """Rows of the tables of `TABLES`, looked up by the value of their key column."""
+
+    name = ""
+
+    def get(self, table: str, key: str) -> Optional[Dict[str, Any]]:
+        """Returns the row of `table` with this key, or None if there is none."""
+        raise NotImplementedError
+
+    def put(self, table: str, key: str, row: Dict[str, Any]) -> None:
+        """Inserts or replaces the row of `table` with this key.
+
+        Args:
+            table: Name of the table in `TABLES`
+            key: Value of the key column
+            row: Values of the other columns
+        """
+        raise NotImplementedError
+
+    def put_many(self, table: str, rows: List[Dict[str, Any]], replace: bool = True) -> int:
+        """Writes many rows holding their key column and returns the number written.
+
+        Args:
+            table: Name of the table in `TABLES`
+            rows: Rows holding their key column
+            replace: Whether existing rows are replaced, otherwise they are kept
+        """
+        written = 0
+        for row in rows:
+            key = str(row[TABLES[table].key])
+            if replace or self.get(table, key) is None:
+                self.put(table, key, row)
+                written += 1
+        return written
+
+    def increment(self, table: str, key: str, column: str, amount: int, row: Optional[Dict[str, Any]] = None) -> int:
+        """Adds `amount` to a numeric column of a row and returns its new value.
+
+        Args:
+            table: Name of the table in `TABLES`
+            key: Value of the key column
+            column: Column holding the counter
+            amount: Value added to the counter
+            row: Values of the other columns, used when the row does not exist yet
+        """
+        current = self.get(table, key)
+        value = (int(current.get(column) or 0) if current else 0) + amount
+        self.put(table, key, {**(row or {}), **(current or {}), column: value})
+        return value
+
+    def rows(self, table: str) -> Iterator[Dict[str, Any]]:
+        """Yields all the rows of a table."""
+        raise NotImplementedError
+
+    def invalidate(self, table: str, key: Optional[str] = None) -> None:
+        """Marks a row, or a whole table, as changed by someone else. Storages read on every lookup ignore it."""
+
+
+class GSheetsStorage(Storage):
+    """Worksheets of a Google Sheets spreadsheet.
+
+    With a service account, an index key -> (row number, row) of each
+    worksheet is kept in memory and reloaded every `index_ttl` seconds, or
+    row by row for the keys invalidated with `invalidate`. Changed rows are
+    written with range updates and new ones appended, so a write never
+    rewrites the worksheet. Public spreadsheets, which the connection can only
+    read whole, are read and written whole.
+    """
+
+    name = "gsheets"
+
+    def __init__(self, conn, index_ttl: float = GSHEETS_INDEX_TTL) -> None:
+        """
+        Args:
+            conn: Google Sheets connection object
+            index_ttl: Seconds after which the index of a worksheet is reloaded
+        """
+        self.conn = conn
+        self.index_ttl = index_ttl
+        self._worksheets: Dict[str, Any] = {}
+        # table -> (load time, key -> (row number, row))
+        self._indexes: Dict[str, Tuple[float, Dict[str, Tuple[int, Dict[str, Any]]]]] = {}
+        self._stale: Set[Tuple[str, str]] = set()
+        self._lock = threading.RLock()
+        self.reads = 0
+        self.writes = 0
+
+    def _read(self, table: str):
+        import streamlit as st
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        def read():
+            return self.conn.read(worksheet=TABLES[table].worksheet, usecols=list(range(len(TABLES[table].columns))), ttl=0)
+
+        # The write-behind thread has no page to draw on
+        if get_script_run_ctx() is None:
+            return read()
+        with st.empty():
+            return read()
+
+    def _worksheet(self, table: str):
+        """Returns the gspread worksheet of a table, or None when the connection has no service account."""
+        client = getattr(self.conn, "client", None)
+        if not hasattr(client, "_select_worksheet"):
+            return None
+        with self._lock:
+            if table not in self._worksheets:
+                self._worksheets[table] = client._select_worksheet(worksheet=TABLES[table].worksheet)
+            return self._worksheets[table]
+
+    def _row(self, table: str, cells: List[str]) -> Dict[str, Any]:
+        columns = TABLES[table].columns
+        return {column: sheet_value(cells[i]) if i < len(cells) else "" for i, column in enumerate(columns)}
+
+    def _index(self, table: str, refresh: bool = False) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+        """Returns the index of a worksheet, loading it with a single read when it is missing or expired."""
+        with self._lock:
+            loaded = self._indexes.get(table)
+            if loaded is not None and not refresh and time.time() - loaded[0] < self.index_ttl:
+                return loaded[1]
+            values = self._worksheet(table).get_all_values()
+            self.reads += 1
+            index: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+            # Row 1 holds the headers; as before, the first row of a key is the one used
+            for number, cells in enumerate(values[1:], start=2):
+                row = self._row(table, cells)
+                key = str(row[TABLES[table].key]).strip()
+                if key and key not in index:
+                    index[key] = (number, row)
+            self._indexes[table] = (time.time(), index)
+            self._stale = {(stale_table, key) for stale_table, key in self._stale if stale_table != table}
+            return index
+
+    def invalidate(self, table: str, key: Optional[str] = None) -> None:
+        """Marks a row, or a whole table, as changed by someone else: it is read again at its next lookup."""
+        with self._lock:
+            if key is None:
+                self._indexes.pop(table, None)
+            else:
+                self._stale.add((table, key))
+
+    def get(self, table: str, key: str) -> Optional[Dict[str, Any]]:
+        worksheet = self._worksheet(table)
+        if worksheet is None:
+            df = self._read(table)
+            df = df[df[TABLES[table].key] == key]
+            if df.empty:
+                return None
+            return {column: plain_value(value) for column, value in df.iloc[0].items()}
+
+        with self._lock:
+            index = self._index(table)
+            if (table, key) in self._stale:
+                self._stale.discard((table, key))
+                if key not in index:
+                    index = self._index(table, refresh=True)
+                else:
+                    row = self._row(table, worksheet.row_values(index[key][0]))
+                    self.reads += 1
+                    # Rows were moved: the whole index is outdated
+                    if str(row[TABLES[table].key]).strip() != key:
+                        index = self._index(table, refresh=True)
+                    else:
+                        index[key] = (index[key][0], row)
+            entry = index.get(key)
+        return None if entry is None else dict(entry[1])
+
+    def put(self, table: str, key: str, row: Dict[str, Any]) -> None:
+        self.put_many(table, [{**row, TABLES[table].key: key}])
+
+    def put_many(self, table: str, rows: List[Dict[str, Any]], replace: bool = True) -> int:
+        """Writes many rows, with one range update for the existing rows and one append for the new ones."""
+        columns = TABLES[table].columns
+        key_column = TABLES[table].key
+        worksheet = self._worksheet(table)
+        if worksheet is None:
+            return self._put_whole(table, rows, replace)
+
+        with self._lock:
+            index = self._index(table)
+            # Another process may have added these keys since the index was loaded
+            if any(str(row[key_column]) not in index for row in rows):
+                index = self._index(table, refresh=True)
+            updates, appends = [], []
+            for row in rows:
+                key = str(row[key_column])
+                cells = ["" if row.get(column) is None else row.get(column, "") for column in columns]
+                if key in index:
+                    if not replace:
+                        continue
+                    number = index[key][0]
+                    updates.append({"range": f"A{number}:{column_letter(len(columns))}{number}", "values": [cells]})
+                    index[key] = (number, self._row(table, [str(cell) for cell in cells]))
+                else:
+                    appends.append((key, cells))
+            if updates:
+                worksheet.batch_update(updates, value_input_option="RAW")
+                self.writes += 1
+            if appends:
+                response = worksheet.append_rows([cells for _, cells in appends], value_input_option="RAW")
+                self.writes += 1
+                first = appended_first_row(response)
+                if first is None:
+                    self._indexes.pop(table, None)
+                else:
+                    for offset, (key, cells) in enumerate(appends):
+                        index[key] = (first + offset, self._row(table, [str(cell) for cell in cells]))
+            return len(updates) + len(appends)
+
+    def increment(self, table: str, key: str, column: str, amount: int, row: Optional[Dict[str, Any]] = None) -> int:
+        # Other processes update the counters too, the row is read again first
+        with self._lock:
+            self.invalidate(table, key)
+            return super().increment(table, key, column, amount, row)
+
+    def _put_whole(self, table: str, rows: List[Dict[str, Any]], replace: bool) -> int:
+        """Writes rows by rewriting the whole worksheet, for the connections without service account."""
+        columns = TABLES[table].columns
+        key_column = TABLES[table].key
+        df = self._read(table)
+        written = 0
+        for row in rows:
+            index = df[df[key_column] == row[key_column]].index
+            if index.empty:
+                df.loc[len(df)] = [row.get(column, "") for column in columns]
+            elif replace:
+                for column in columns[1:]:
+                    df.loc[index, column] = row.get(column, "")
+            else:
+                continue
+            written += 1
+        self.conn.update(worksheet=TABLES[table].worksheet, data=df)
+        return written
+
+    def rows(self, table: str) -> Iterator[Dict[str, Any]]:
+        if self._worksheet(table) is not None:
+            for _, row in sorted(self._index(table, refresh=True).values(), key=lambda entry: entry[0]):
+                yield dict(row)
+            return
+        for record in self._read(table).to_dict("records"):
+            yield {column: plain_value(value) for column, value in record.items()}
+
+
+class SQLiteStorage(Storage):
+    """Tables stored in a local SQLite file, with one row per key."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = STORAGE_PATH) -> None:
+        """
+        Args:
+            path: Path of the SQLite file
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " tbl TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (tbl, key))"
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, table: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM rows WHERE tbl = ? AND key = ?", (table, key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, table: str, key: str, row: Dict[str, Any]) -> None:
+        row = {**row, TABLES[table].key: key}
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO rows (tbl, key, data, updated_at) VALUES (?, ?, ?, ?)",
+                       (table, key, json.dumps(row, ensure_ascii=False), time.time()))
+
+    def put_many(self, table: str, rows: List[Dict[str, Any]], replace: bool = True) -> int:
+        """Writes many rows in a single transaction and returns the number written.
+
+        Args:
+            table: Name of the table in `TABLES`
+            rows: Rows holding their key column
+            replace: Whether existing rows are replaced, otherwise they are kept
+        """
+        key_column = TABLES[table].key
+        now = time.time()
+        with self._connect() as db:
+            before = db.total_changes
+            db.executemany(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO rows (tbl, key, data, updated_at) VALUES (?, ?, ?, ?)",
+                [(table, str(row[key_column]), json.dumps(row, ensure_ascii=False), now) for row in rows],
+            )
+            return db.total_changes - before
+
+    def rows(self, table: str) -> Iterator[Dict[str, Any]]:
+        with self._connect() as db:
+            rows = db.execute("SELECT data FROM rows WHERE tbl = ? ORDER BY key", (table,)).fetchall()
+        for row in rows:
+            yield json.loads(row[0])
+
+    def increment(self, table: str, key: str, column: str, amount: int, row: Optional[Dict[str, Any]] = None) -> int:
+        # The write lock is taken before reading, so that concurrent increments never overwrite each other
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            current = db.execute("SELECT data FROM rows WHERE tbl = ? AND key = ?", (table, key)).fetchone()
+            current = json.loads(current[0]) if current else None
+            value = (int(current.get(column) or 0) if current else 0) + amount
+            data = {**(row or {}), **(current or {}), column: value, TABLES[table].key: key}
+            db.execute("INSERT OR REPLACE INTO rows (tbl, key, data, updated_at) VALUES (?, ?, ?, ?)",
+                       (table, key, json.dumps(data, ensure_ascii=False), time.time()))
+        return value
+
+    def count(self, table: str) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM rows WHERE tbl = ?", (table,)).fetchone()[0]
+
+
+class WriteBehindStorage(Storage):
+    """Storage whose writes are queued and persisted in batches by a background thread.
+
+    Writes to the same row are coalesced, only the last one is persisted.
+    Reads see the queued rows first, and the rows being persisted until the
+    backend confirmed them, so a session always reads its own writes. The
+    queue is flushed every `flush_interval` seconds, as soon as it holds
+    `batch_size` rows, and when the process exits. Rows that fail to be
+    written are queued again, unless a newer write replaced them.
+    """
+
+    def __init__(self, backend: Storage, flush_interval: float = STORAGE_FLUSH_INTERVAL,
+                 batch_size: int = STORAGE_FLUSH_BATCH) -> None:
+        """
+        Args:
+            backend: Storage the rows are persisted to
+            flush_interval: Seconds between two flushes
+            batch_size: Number of queued rows starting a flush without waiting for the interval
+        """
+        self.backend = backend
+        self.name = backend.name
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # (table, key) -> (row, time of the first write not yet persisted)
+        self._pending: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+        # Rows taken by the running flush, kept readable until they are written
+        self._flushing: Dict[Tuple[str, str], Tuple[Dict[str, Any], float]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self.writes = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.last_flush_seconds = 0.0
+        self.max_latency = 0.0
+        self._latencies = 0.0
+        self._thread = threading.Thread(target=self._loop, name=f"write-behind-{self.name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def get(self, table: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            pending = self._pending.get((table, key)) or self._flushing.get((table, key))
+        if pending is not None:
+            return dict(pending[0])
+        return self.backend.get(table, key)
+
+    def put(self, table: str, key: str, row: Dict[str, Any]) -> None:
+        row = {**row, TABLES[table].key: key}
+        with self._lock:
+            previous = self._pending.get((table, key))
+            self._pending[(table, key)] = (row, previous[1] if previous else time.time())
+            self.writes += 1
+            self.coalesced += previous is not None
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def rows(self, table: str) -> Iterator[Dict[str, Any]]:
+        self.flush()
+        return self.backend.rows(table)
+
+    def backlog(self) -> int:
+        """Returns the number of rows waiting to be persisted."""
+        with self._lock:
+            return len(self._pending) + len(self._flushing)
+
+    def flush(self) -> int:
+        """Persists the queued rows now and returns the number written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = dict(batch)
+            if not batch:
+                return 0
+            start = time.time()
+            written = 0
+            for table in TABLES:
+                rows = {key: value for (row_table, key), value in batch.items() if row_table == table}
+                if not rows:
+                    continue
+                try:
+                    self.backend.put_many(table, [row for row, _ in rows.values()])
+                except Exception as e:
+                    print(f"Could not write {len(rows)} rows of {table}, retrying at the next flush: {e}")
+                    with self._lock:
+                        self.errors += 1
+                        for key, value in rows.items():
+                            self._pending.setdefault((table, key), value)
+                            self._flushing.pop((table, key), None)
+                    continue
+                now = time.time()
+                with self._lock:
+                    for key in rows:
+                        self._flushing.pop((table, key), None)
+                    for _, enqueued_at in rows.values():
+                        self._latencies += now - enqueued_at
+                        self.max_latency = max(self.max_latency, now - enqueued_at)
+                    self.flushed += len(rows)
+                written += len(rows)
+            with self._lock:
+                self.flushes += 1
+                self.last_flush_seconds = time.time() - start
+            print(f"Persisted {written} rows to {self.name} in {self.last_flush_seconds:.2f}s, backlog: {self.backlog()}")
+            return written
+
+    def _loop(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self) -> None:
+        """Stops the background thread and persists the queued rows."""
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the backlog, the number of writes and the latency between a write and its persistence."""
+        with self._lock:
+            return {
+                "backlog": len(self._pending) + len(self._flushing),
+                "writes": self.writes,
+                "coalesced": self.coalesced,
+                "flushed": self.flushed,
+                "flushes": self.flushes,
+                "errors": self.errors,
+                "last_flush_seconds": self.last_flush_seconds,
+                "mean_latency": self._latencies / self.flushed if self.flushed else 0.0,
+                "max_latency": self.max_latency,
+            }
+
+
+def storage_backend() -> str:
+    """Returns the name of the storage backend, from the environment or the Streamlit secrets."""
+    name = os.environ.get("POSTULATOR_STORAGE")
+    if name:
+        return name
+    try:
+        import streamlit as st
+        return st.secrets.get("storage", "gsheets")
+    except Exception:
+        return "gsheets"
+
+
+def sqlite_storage(path: str = STORAGE_PATH) -> SQLiteStorage:
+    """Returns the SQLite storage of a file, shared by all the sessions of the process."""
+    with _storages_lock:
+        if path not in _sqlite_storages:
+            _sqlite_storages[path] = SQLiteStorage(path)
+        return _sqlite_storages[path]
+
+
+def user_storage(conn=None, write_behind: bool = STORAGE_WRITE_BEHIND) -> Storage:
+    """Returns the storage of the user data selected by `storage_backend`.
+
+    Args:
+        conn: Google Sheets connection object, used by the `gsheets` backend
+        write_behind: Whether the writes are persisted by a background thread
+    """
+    name = storage_backend()
+    if name == "sqlite":
+        backend, backend_id = sqlite_storage(), ("sqlite", STORAGE_PATH)
+    elif name == "gsheets":
+        if conn is None:
+            raise ValueError("The gsheets storage needs a Google Sheets connection")
+        # The index of the worksheets is shared by all the sessions using the connection
+        with _storages_lock:
+            if id(conn) not in _gsheets_storages:
+                _gsheets_storages[id(conn)] = GSheetsStorage(conn)
+        backend, backend_id = _gsheets_storages[id(conn)], ("gsheets", id(conn))
+    else:
+        raise ValueError(f"Unknown storage backend '{name}', expected 'gsheets' or 'sqlite'")
+    if not write_behind:
+        return backend
+    # One queue per backend, shared by all the sessions of the process
+    with _storages_lock:
+        if backend_id not in _write_behind:
+            _write_behind[backend_id] = WriteBehindStorage(backend)
+        return _write_behind[backend_id]
+
+
+def write_behind_stats() -> Dict[str, Dict[str, float]]:
+    """Returns the statistics of the write-behind queues of the process, by backend."""
+    return {f"{name}:{target}": queue.stats() for (name, target), queue in list(_write_behind.items())}
+
+
+def migrate(source: Storage, target: SQLiteStorage, replace: bool = False) -> Dict[str, int]:
+    """Copies every table of `source` into a SQLite storage and returns the number of rows written by table.
+
+    Rows without key are skipped. As in the sheets, where the first row with a
+    key is the one used, the first of the duplicated keys is kept.
+
+    Args:
+        source: Storage to copy, usually the Google Sheets one
+        target: SQLite storage receiving the rows
+        replace: Whether the rows already in the target are overwritten
+    """
+    written = {}
+    for table, spec in TABLES.items():
+        rows, seen = [], set()
+        for row in source.rows(table):
+            key = str(row.get(spec.key, "")).strip()
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            rows.append({**row, spec.key: key})
+        written[table] = target.put_many(table, rows, replace=replace)
+        print(f"{table} ({spec.worksheet}): {len(rows)} rows read, {written[table]} written")
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Storage of the user data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Copy the Google Sheets into the SQLite storage")
+    migrate_parser.add_argument("--target", default=STORAGE_PATH, help="Path of the SQLite file")
+    migrate_parser.add_argument("--replace", action="store_true", help="Overwrite the rows already in the SQLite file")
+    count_parser = subparsers.add_parser("count", help="Count the rows of the SQLite storage")
+    count_parser.add_argument("--target", default=STORAGE_PATH, help="Path of the SQLite file")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        import streamlit as st
+        from streamlit_gsheets import GSheetsConnection
+
+        migrate(GSheetsStorage(st.connection("gsheets", type=GSheetsConnection)), SQLiteStorage(args.target), replace=args.replace)
+    else:
+        target = SQLiteStorage(args.target)
+        for table in TABLES:
+            print(f"{table}: {target.count(table)} rows")
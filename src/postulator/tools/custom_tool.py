@@ -1,14 +1,16 @@
 from crewai.tools import BaseTool
 from typing import Type, List
 from pydantic import BaseModel, Field, PrivateAttr
-import streamlit as st
 
 from src.postulator.data_structures.custom_data_structures import CV
 
 from datetime import datetime
-from babel.dates import format_date
 import locale
 
+from src.postulator.run_context import RunContext, ResultSink
+from src.postulator.renderers import letter_renderer
+from src.postulator.layout import REJECT_MARGIN_LINES, predict_layout, too_long_message
+
 def get_formatted_date(language: str) -> str:
     """
     Returns the current date formatted according to the specified language.
@@ -27,7 +29,9 @@ def get_formatted_date(language: str) -> str:
     }
     
     lang_code = language_codes.get(language, 'en')
-    
+
+    from babel.dates import format_date
+
     try:
         return format_date(datetime.now(), format='long', locale=lang_code)
     except Exception:
@@ -55,6 +59,17 @@ class human_feedback(BaseTool):
     )
     args_schema: Type[BaseModel] = human_feedback_input
 
+    # Private attributes (not part of the schema)
+    _run_context: RunContext = PrivateAttr()
+
+    def __init__(self, run_context: RunContext):
+        """
+        Args:
+            run_context: Context of the run, the accepted letter is written to its sink.
+        """
+        super().__init__()
+        self._run_context = run_context
+
     def _run(self,argument:str) -> str:
         try:
             #print(argument)
@@ -93,7 +108,7 @@ Details about what you need the user to give a feedback about.
         pydantic_letter = MotivationLetter.model_validate_json( json_str_propre )
 
         letter_for_feedback = letter_writer._letter_for_feedback(pydantic_letter)
-        latex_letter = letter_writer._letter_from_pydantic(pydantic_letter)
+        latex_letter = letter_writer._letter_from_pydantic(pydantic_letter, self._run_context)
 
         #
         content = pydantic_letter.content
@@ -101,53 +116,37 @@ Details about what you need the user to give a feedback about.
         if tmp < 3:
             return(f"Your letter contains only {tmp} core paragraphs, whereas at least 3 core paragraphs are expected.")
 
-        try:
-            with open("output/motivation_letter_tmp.tex", 'w', encoding='utf-8') as file:
-                file.write(latex_letter)
-
-            import subprocess
-
-            # Run pdflatex to compile the document (twice for references)
-            try:
-                subprocess.run(
-                    ["pdflatex", "-interaction=nonstopmode", "-output-directory", "output", "output/motivation_letter_tmp.tex"],
-                    check=True,
-                    capture_output=True,
-                    text=True
-                )
-                # Run again to resolve references (e.g., table of contents)
-                subprocess.run(
-                    ["pdflatex", "-interaction=nonstopmode", "-output-directory", "output", "output/motivation_letter_tmp.tex"],
-                    check=True,
-                    capture_output=True,
-                    text=True
-                )
-            except subprocess.CalledProcessError as e:
-                print(f"Compilation failed: {e.stderr}")
+        renderer = letter_renderer()
+        layout = None
+        if renderer.layout_model:
+            # Most overlong drafts are caught by the layout model, without running pdflatex
+            layout = predict_layout(pydantic_letter, self._run_context)
+            if layout.overflow_lines > REJECT_MARGIN_LINES:
+                return too_long_message(layout)
 
-        except Exception as e:
-            return(f"Error writing to file: {str(e)}")
+        compiled = renderer.render(pydantic_letter, self._run_context, "motivation_letter_tmp")
+        if compiled.pdf_path is None:
+            return(f"The letter could not be compiled to PDF:\n{compiled.error}")
 
         # check if the number of pages of the letter is acceptable
-        import PyPDF2#.PdfReader
-        with open("output/motivation_letter_tmp.pdf", "rb") as pdf_file:
-            reader = PyPDF2.PdfReader(pdf_file)
-            num_pages = len(reader.pages)
-
-            if num_pages > 2:
-                return(f"Your letter is too long. It is {num_pages} pages long instead of 1 page.")
-            
-            if num_pages == 2:
-                page = reader.pages[1]  # First page
-                text = page.extract_text()
-
-                # Split text into "lines" (approximate)
-                lines = text.split("\n")
-                num_lines = len(lines) #return(f"Your letter is too long. It is {num_pages} pages long instead of 1 page with {num_lines} lines on the second page.")
-                #return(f"Your letter is too long. There is {num_lines} extra lines in the letter. Make make small changes (circa {15*num_lines} words to remove) to fill a single page completely")
-                #return(f"Your letter is too long. Make make small changes to remove circa {8*num_lines} words (only from paragraphs, not from other parts) while keeping it pleasant to read.")
-                return(f"Your letter is too long. Make it approximatively {2*num_lines} words shorter (only rework opening, core and closing paragraphs, not other parts) while keeping it pleasant to read."
-                       f"Remember that the core paragraphs are expected to be larger than the opening and closing paragraphs.")
+        num_pages = compiled.pages
+
+        if num_pages > 2:
+            return(f"Your letter is too long. It is {num_pages} pages long instead of 1 page.")
+
+        if num_pages == 2 and layout is not None and layout.overflow_lines > 0:
+            return too_long_message(layout)
+
+        if num_pages == 2:
+            text = compiled.page_texts[1]  # Second page
+
+            # Split text into "lines" (approximate)
+            lines = text.split("\n")
+            num_lines = len(lines) #return(f"Your letter is too long. It is {num_pages} pages long instead of 1 page with {num_lines} lines on the second page.")
+            #return(f"Your letter is too long. There is {num_lines} extra lines in the letter. Make make small changes (circa {15*num_lines} words to remove) to fill a single page completely")
+            #return(f"Your letter is too long. Make make small changes to remove circa {8*num_lines} words (only from paragraphs, not from other parts) while keeping it pleasant to read.")
+            return(f"Your letter is too long. Make it approximatively {2*num_lines} words shorter (only rework opening, core and closing paragraphs, not other parts) while keeping it pleasant to read."
+                   f"Remember that the core paragraphs are expected to be larger than the opening and closing paragraphs.")
 
         print(80*"_")
         print(letter_for_feedback)
@@ -159,29 +158,16 @@ Details about what you need the user to give a feedback about.
         #response = input()
         print(80*"_")
 
-        st.session_state.pydantic_letter = pydantic_letter
-        st.session_state.feedback_asked = True
-        st.session_state.preview_letter = letter_for_feedback
-        st.session_state.latex_letter = latex_letter
-        st.session_state.cleaned = cleaned
-
-        #st.rerun()
-
-        st.session_state.user_usage += 1
-
-        from src.postulator.utils import update_user_usage
-        update_user_usage(st.session_state.conn, st.session_state.sender_name)
+        # The caller reads the accepted letter from the sink once the crew is done
+        sink = self._run_context.sink
+        sink.pydantic_letter = pydantic_letter
+        sink.preview_letter = letter_for_feedback
+        sink.latex_letter = latex_letter
+        sink.cleaned = cleaned
+        sink.letters_saved += 1
 
         return("Your great letter was accepted by the human and successfully saved \n\n" + cleaned)
 
-        #import time
-
-        if st.session_state.feedback:
-            feedback = st.session_state.feedback
-            return feedback
-        else:
-            st.stop()
-
 
 class cleaner_input(BaseModel):
     """Input schema for MyCustomTool."""
@@ -237,9 +223,11 @@ class letter_writer(BaseTool):
 
     # Private attributes (not part of the schema)
     _strings_to_remove: List[str] = PrivateAttr()
+    _run_context: RunContext = PrivateAttr()
 
-    def __init__(self, strings_to_remove: List[str] = ['```json\n', '```', '```json'], result_as_answer=True):
+    def __init__(self, run_context: RunContext, strings_to_remove: List[str] = ['```json\n', '```', '```json'], result_as_answer=True):
         super().__init__(result_as_answer=result_as_answer)#result_as_answer=result_as_answer)
+        self._run_context = run_context
         self._strings_to_remove = strings_to_remove
 
     def _run(self, text: str) -> str:
@@ -261,7 +249,7 @@ class letter_writer(BaseTool):
 
         pydantic_letter = MotivationLetter.model_validate_json( json_str_propre )
 
-        latex_letter = self._letter_from_pydantic(pydantic_letter)
+        latex_letter = self._letter_from_pydantic(pydantic_letter, self._run_context)
 
         return latex_letter
 
@@ -322,8 +310,12 @@ class letter_writer(BaseTool):
         return letter
 
     @staticmethod
-    def _letter_from_pydantic(pydantic_letter: MotivationLetter) -> str:
-        """Generates a motivation letter from a Pydantic model."""
+    def _letter_from_pydantic(pydantic_letter: MotivationLetter, run_context: RunContext) -> str:
+        """Generates a motivation letter from a Pydantic model.
+
+        The sender, recipient and language are taken from the run context
+        (as provided by the user) rather than from the model.
+        """
         sender = pydantic_letter.sender
         recipient = pydantic_letter.recipient
         content = pydantic_letter.content
@@ -338,19 +330,19 @@ class letter_writer(BaseTool):
 
     % ========== SENDER INFO ==========
     % Strategic purpose: Professional presentation of contact details
-    \\hfill {st.session_state.sender_name}\\\\
-    \\strut\\hfill {st.session_state.sender_address}\\\\
-    \\strut\\hfill {st.session_state.sender_email}\\\\
-    \\strut\\hfill {st.session_state.sender_phone}
+    \\hfill {run_context.sender.name}\\\\
+    \\strut\\hfill {run_context.sender.address}\\\\
+    \\strut\\hfill {run_context.sender.email}\\\\
+    \\strut\\hfill {run_context.sender.phone}
 
     % ========== RECIPIENT INFO ==========
     % Strategic purpose: Demonstrate targeted application
     \\vspace{{0.15cm}}
-    {st.session_state.recipient_name or ''} { "\\\\" if st.session_state.recipient_name else ''} {st.session_state.recipient_institution} \\\\ {st.session_state.recipient_department or ''} { "\\\\" if st.session_state.recipient_department else '' }{st.session_state.recipient_address or ''} { "\\\\" if st.session_state.recipient_address else '' }
+    {run_context.recipient.name or ''} { "\\\\" if run_context.recipient.name else ''} {run_context.recipient.institution} \\\\ {run_context.recipient.department or ''} { "\\\\" if run_context.recipient.department else '' }{run_context.recipient.address or ''} { "\\\\" if run_context.recipient.address else '' }
 
     % ========== DATE ==========
     \\vspace{{0.15cm}}
-    \\hfill {get_formatted_date(st.session_state.language)}
+    \\hfill {get_formatted_date(run_context.language)}
 
     % ========== SUBJECT LINE ==========
     % Strategic purpose: Immediate context setting
@@ -394,7 +386,7 @@ class letter_writer(BaseTool):
         return letter
 
 
-import PyPDF2
+from src.postulator.pdf_text import pdf_extractor
 
 class PdfReaderToolInput(BaseModel):
     """Input schema for PDF to Text conversion tool."""
@@ -409,28 +401,26 @@ class PdfReaderTool(BaseTool):
 
     def _run(self, pdf_path: str) -> str:
         """Convert PDF to text with comprehensive error handling."""
+        import pymupdf
+
         try:
-            # Read PDF file
-            with open(pdf_path, 'rb') as pdf_file:
-                reader = PyPDF2.PdfReader(pdf_file)
-                
-                # Extract text from all pages
-                text = []
-                for page in reader.pages:
-                    page_text = page.extract_text()
-                    if page_text:  # Handle empty pages
-                        text.append(page_text)
-                
-                if not text:  # Handle PDFs with no extractable text
-                    return("PDF contains no extractable text (might be scanned/image-based)")
-                
-                return '\n'.join(text)
-                
+            extracted = pdf_extractor().extract(pdf_path)
+            print(f"Read {extracted.pages_read}/{extracted.pages} pages of {pdf_path} in {extracted.seconds:.3f}s"
+                  + (" (cached)" if extracted.cached else ""))
+
+            if not extracted.text:  # Handle PDFs with no extractable text
+                return("PDF contains no extractable text (might be scanned/image-based)")
+
+            if extracted.truncated:
+                return (extracted.text + f"\n\n[Truncated: only the beginning of the document is shown, "
+                        f"{extracted.pages_read} of {extracted.pages} pages]")
+            return extracted.text
+
         except FileNotFoundError:
             return(f"File not found: {pdf_path}")
         except PermissionError:
             return(f"Permission denied for file: {pdf_path}")
-        except PyPDF2.errors.PdfReadError:
+        except pymupdf.FileDataError:
             return("Invalid or corrupted PDF file")
         except Exception as e:
             return(f"Conversion failed: {str(e)}")
@@ -448,15 +438,21 @@ class cv_final_response_cleaner(BaseTool):
 
     # Private attributes (not part of the schema)
     _strings_to_remove: List[str] = PrivateAttr()
+    _sink: ResultSink = PrivateAttr()
+    _model: Type[BaseModel] = PrivateAttr()
 
-    def __init__(self, strings_to_remove: List[str] = ["```json", "```"], result_as_answer=False):
+    def __init__(self, sink: ResultSink, model: Type[BaseModel] = CV, strings_to_remove: List[str] = ["```json", "```"], result_as_answer=False):
         """
         Initializes the CleanAgentOutputTool.
 
         Args:
+            sink: Where the parsed CV is written.
+            model: Model the output must match, `CV` or a model holding some sections of it.
             strings_to_remove: A list of strings to remove from the agent's output.
         """
         super().__init__(result_as_answer=result_as_answer)#result_as_answer=result_as_answer)
+        self._sink = sink
+        self._model = model
         self._strings_to_remove = strings_to_remove
 
     def _run(self, text: str) -> str:
@@ -473,12 +469,12 @@ class cv_final_response_cleaner(BaseTool):
             text = text.replace(string_to_remove, "")
         
         try:
-            st.session_state.cv_pydantic = CV.model_validate_json( text )
-            st.session_state.indic = False
-
-            #st.session_state.personal_info = True
-            st.rerun()
-            return("Great job, the CV was successfully parsed! \n \n" + st.session_state.cv_pydantic.model_dump_json(indent=4))
+            parsed = self._model.model_validate_json( text )
+            if self._model is CV:
+                self._sink.cv_pydantic = parsed
+            else:
+                self._sink.cv_sections = parsed.model_dump()
+            return("Great job, the CV was successfully parsed! \n \n" + parsed.model_dump_json(indent=4))
         except Exception as e:
             return( str(e) )
 
@@ -1,18 +1,36 @@
 # Standard library imports
+import hashlib
+import hmac
 import json
 import os
+import threading
+import time
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from random import randint
 from typing import Dict, Any, Tuple, Optional
 
 # Third-party imports
-import google.generativeai as genai
+import requests
 import streamlit as st
 from pydantic import ValidationError
 
 # Local imports
 from src.postulator.data_structures.custom_data_structures import CV
+from src.postulator.quota import quota_service
+from src.postulator.storage import user_storage, usage_key
+
+GEMINI_MODELS_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+# Seconds a validation is reused for
+API_KEY_VALID_TTL = float(os.environ.get("API_KEY_VALID_TTL", 3600))
+API_KEY_INVALID_TTL = 60
+
+# Random for each process: the hashes of the keys are meaningless outside of it
+_API_KEY_SALT = os.urandom(32)
+_api_key_validations: Dict[str, Tuple[float, bool, str]] = {}
+_api_key_lock = threading.Lock()
+_api_key_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-key")
 
 def contains_special_characters(text: str) -> bool:
     """
@@ -22,8 +40,36 @@ def contains_special_characters(text: str) -> bool:
     import unicodedata
     return any(not c.isascii() for c in text)
 
+def _api_key_digest(api_key):
+    """Salted hash identifying an API key, so that the keys themselves are never kept."""
+    return hmac.new(_API_KEY_SALT, api_key.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def _check_api_key(api_key):
+    """Check an API key by listing one model, which costs no generation nor quota."""
+    try:
+        response = requests.get(GEMINI_MODELS_URL, params={"pageSize": 1}, headers={"x-goog-api-key": api_key}, timeout=10)
+    except requests.RequestException as e:
+        return None, f"API key validation failed: {str(e)}"
+
+    if response.status_code == 200:
+        return True, "API key is valid"
+    # The key is known but out of quota
+    if response.status_code == 429:
+        return True, "API key is valid"
+    error_message = response.text.lower()
+    if response.status_code == 400 and ("api_key_invalid" in error_message or "api key not valid" in error_message):
+        return False, "Invalid API key format"
+    if response.status_code in (401, 403):
+        return False, "Invalid API key: unauthorized access"
+    if response.status_code >= 500:
+        return None, f"API key validation failed: {response.status_code} {response.reason}"
+    return False, f"API key validation failed: {response.status_code} {response.reason}"
+
 def validate_api_key(api_key):
     """Check if the provided Google Gemini API key is valid.
+
+    Results are cached by a salted hash of the key, for API_KEY_VALID_TTL
+    seconds when the key is valid and API_KEY_INVALID_TTL seconds otherwise.
     
     Args:
         api_key: User's API key for authentication
@@ -33,23 +79,32 @@ def validate_api_key(api_key):
     
     if contains_special_characters(api_key):
         return False, "API key cannot contain special characters"
-    
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        # Test the API key with a simple generation request
-        response = model.generate_content("Test")
-        if response:
-            return True, "API key is valid"
-        return False, "Unable to generate content with the provided API key"
-    except Exception as e:
-        error_message = str(e).lower()
-        if "invalid api key" in error_message:
-            return False, "Invalid API key format"
-        elif "unauthorized" in error_message:
-            return False, "Invalid API key: unauthorized access"
-        else:
-            return False, f"API key validation failed: {str(e)}"
+
+    digest = _api_key_digest(api_key)
+    now = time.time()
+    with _api_key_lock:
+        cached = _api_key_validations.get(digest)
+    if cached is not None and cached[0] > now:
+        return cached[1], cached[2]
+
+    is_valid, message = _check_api_key(api_key)
+    # Network errors are not cached, the next attempt checks again
+    if is_valid is None:
+        return False, message
+    with _api_key_lock:
+        _api_key_validations[digest] = (now + (API_KEY_VALID_TTL if is_valid else API_KEY_INVALID_TTL), is_valid, message)
+    return is_valid, message
+
+def validate_api_key_async(api_key):
+    """Start `validate_api_key` in the background, so that it runs while the profile loads.
+
+    Args:
+        api_key: User's API key for authentication
+
+    Returns:
+        A future of the (is_valid, message) tuple
+    """
+    return _api_key_executor.submit(validate_api_key, api_key)
 
 def save_json_to_file(json_data, file_path):
     """
@@ -112,29 +167,39 @@ def load_json_into_pydantic(file_path, model):
     except Exception as e:
         print(f"An error occurred while reading the JSON file: {e}")
 
-def load_from_gsheet(conn, api_key):
-    """Load user data from Google Sheets.
+def read_profile(conn, api_key) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Reads the profile and CV rows of a user, without touching the session.
+
+    Args:
+        conn: Google Sheets connection object
+        api_key: User's API key for authentication
+    """
+    storage = user_storage(conn)
+    return storage.get("profiles", api_key), storage.get("cvs", api_key)
+
+
+def load_from_gsheet(conn, api_key, rows=None):
+    """Load user data from the storage (Google Sheets or SQLite).
     
     Args:
         conn: Google Sheets connection object
         api_key: User's API key for authentication
+        rows: Profile and CV rows returned by `read_profile`, read from the storage if not given
     """
     if not st.session_state.api_key_provided:
         return
 
-    # try to load data from the sheet
-    with st.empty():
-        df = conn.read(worksheet="Feuille 1", usecols=list(range(8)), ttl=0)
-    df = df[df["Key"] == api_key]
+    # try to load data from the storage
+    row, cv_row = rows if rows is not None else read_profile(conn, api_key)
 
-    if not df.empty:
-        st.session_state.sender_name = df["Name"].iloc[0]
-        st.session_state.sender_email = df["Email"].iloc[0]
-        st.session_state.sender_address = df["Address"].iloc[0]
-        st.session_state.sender_phone = ( df["Phone"].iloc[0] ).replace("start","")
-        st.session_state.personal_writeup = ( df["Write-up"].iloc[0] ).replace("empty", "")
+    if row is not None:
+        st.session_state.sender_name = row["Name"]
+        st.session_state.sender_email = row["Email"]
+        st.session_state.sender_address = row["Address"]
+        st.session_state.sender_phone = str( row["Phone"] ).replace("start","")
+        st.session_state.personal_writeup = str( row["Write-up"] ).replace("empty", "")
 
-        print(df)
+        print(row)
     
     else:
         st.session_state.sender_name = ""
@@ -143,12 +208,10 @@ def load_from_gsheet(conn, api_key):
         st.session_state.sender_phone = ""
         st.session_state.personal_writeup = ""
 
-    with st.empty():
-        df = conn.read(worksheet="Feuille 2", usecols=list(range(3)), ttl=0)
-    df = df[df["Key"] == api_key]
+    row = cv_row
 
-    if not df.empty:
-        st.session_state.cv_text = df["CV text"].iloc[0].replace("empty", "")
+    if row is not None:
+        st.session_state.cv_text = str( row["CV text"] ).replace("empty", "")
 
         if st.session_state.cv_text:
             print(st.session_state.cv_text)
@@ -160,12 +223,12 @@ def load_from_gsheet(conn, api_key):
             st.session_state.cv_path = file_path
 
         try:
-            st.session_state.cv_pydantic = CV.model_validate_json( df["CV pydantic"].iloc[0] )
+            st.session_state.cv_pydantic = CV.model_validate_json( row["CV pydantic"] )
         except Exception as e:
             print(e)
             st.session_state.cv_pydantic = ""
 
-        print(df)
+        print(row)
     
     else:
         st.session_state.cv_text = ""
@@ -173,7 +236,7 @@ def load_from_gsheet(conn, api_key):
 
 
 def update_gsheet(conn, api_key, spreadsheet="Feuille 1"):
-    """Update Google Sheets with user data.
+    """Update the storage (Google Sheets or SQLite) with user data.
     
     Args:
         conn: Google Sheets connection object
@@ -183,70 +246,45 @@ def update_gsheet(conn, api_key, spreadsheet="Feuille 1"):
     if not st.session_state.api_key_provided:
         return
 
+    storage = user_storage(conn)
+
     if spreadsheet=="Feuille 1":
         print(f"Update Feuille 1 for {api_key}")
-        with st.empty():
-            df = conn.read(worksheet="Feuille 1", usecols=list(range(6)), ttl=0)
-
-        if df[df["Key"] == api_key].empty:
-            df.loc[len(df)] = [api_key, 
-                            st.session_state.sender_name, 
-                            st.session_state.sender_email, 
-                            st.session_state.sender_address, 
-                            "start" + str( st.session_state.sender_phone ), 
-                            st.session_state.personal_writeup if st.session_state.personal_writeup != "" else "empty",
-                            ]
-        else:
-            df.loc[df[df["Key"] == api_key].index, "Name"] = st.session_state.sender_name
-            df.loc[df[df["Key"] == api_key].index, "Email"] = st.session_state.sender_email
-            df.loc[df[df["Key"] == api_key].index, "Address"] = st.session_state.sender_address
-            df.loc[df[df["Key"] == api_key].index, "Phone"] = "start" + str( st.session_state.sender_phone )
-            df.loc[df[df["Key"] == api_key].index, "Write-up"] = st.session_state.personal_writeup if st.session_state.personal_writeup != "" else "empty"
-            
-        conn.update(worksheet="Feuille 1", data=df)
+        storage.put("profiles", api_key, {
+            "Name": st.session_state.sender_name,
+            "Email": st.session_state.sender_email,
+            "Address": st.session_state.sender_address,
+            "Phone": "start" + str( st.session_state.sender_phone ),
+            "Write-up": st.session_state.personal_writeup if st.session_state.personal_writeup != "" else "empty",
+        })
     
     if spreadsheet=="Feuille 2":
         print(f"Update Feuille 2 for {api_key}")
-        with st.empty():
-            df = conn.read(worksheet="Feuille 2", usecols=list(range(3)), ttl=0)
-
-        if df[df["Key"] == api_key].empty:
-            df.loc[len(df)] = [api_key,
-                            st.session_state.cv_text if st.session_state.cv_text != "" else "empty",
-                            st.session_state.cv_pydantic.model_dump_json() if st.session_state.cv_pydantic else "empty",
-                            ]
-        else:
-            df.loc[df[df["Key"] == api_key].index, "CV text"] = st.session_state.cv_text if st.session_state.cv_text != "" else "empty"
-            df.loc[df[df["Key"] == api_key].index, "CV pydantic"] = st.session_state.cv_pydantic.model_dump_json() if st.session_state.cv_pydantic else "empty"
-        
-        conn.update(worksheet="Feuille 2", data=df)
+        storage.put("cvs", api_key, {
+            "CV text": st.session_state.cv_text if st.session_state.cv_text != "" else "empty",
+            "CV pydantic": st.session_state.cv_pydantic.model_dump_json() if st.session_state.cv_pydantic else "empty",
+        })
 
 def load_user_usage(conn, name):
-    with st.empty():
-        df = conn.read(worksheet="Feuille 3", usecols=list(range(5)), ttl=0)
-    df = df[df["Name"] == name.lower().replace(" ", ",")]
+    """Load the number of letters generated by the user from the quota service.
 
-    if not df.empty:
-        st.session_state.user_usage = df["Usage"].iloc[0]
-        print(df)
-    
-    else:
-        st.session_state.user_usage = 0
+    Args:
+        conn: Google Sheets connection object
+        name: Name of the user
+    """
+    st.session_state.user_usage = quota_service(conn).usage(usage_key(name))
 
-def update_user_usage(conn, name):
+def update_user_usage(conn, name, letters):
+    """Add letters to the usage of the user and return the new usage.
+
+    Args:
+        conn: Google Sheets connection object
+        name: Name of the user
+        letters: Number of letters generated
+    """
     print(f"Update Feuille 3 for {name}")
-    with st.empty():
-        df = conn.read(worksheet="Feuille 3", usecols=list(range(5)), ttl=0)
-
-    if df[df["Name"] == name.lower().replace(" ", ",")].empty:
-        df.loc[len(df)] = [
-                        st.session_state.sender_name.lower().replace(" ", ","), 
-                        st.session_state.sender_email, 
-                        st.session_state.sender_address, 
-                        "start" + str( st.session_state.sender_phone ), 
-                        st.session_state.user_usage,
-                        ]
-    else:
-        df.loc[ df[df["Name"] == name.lower().replace(" ", ",")].index, "Usage"] = st.session_state.user_usage
-    
-    conn.update(worksheet="Feuille 3", data=df)
\ No newline at end of file
+    return quota_service(conn).increment(usage_key(name), letters, {
+        "Email": st.session_state.sender_email,
+        "Address": st.session_state.sender_address,
+        "Phone": "start" + str( st.session_state.sender_phone ),
+    })
@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+# Every generation writes its files (LaTeX sources, PDF, tailored resume...) to its own directory here
+RUNS_DIR = os.path.join("output", "runs")
+
+# Workspaces older than this are considered abandoned (e.g. the browser tab was closed)
+WORKSPACE_MAX_AGE = 6 * 3600
+
+
+def create_workspace(runs_dir: str = RUNS_DIR) -> str:
+    """Creates an empty directory for the files of a new run and returns its path."""
+    os.makedirs(runs_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=time.strftime("%Y%m%d-%H%M%S-"), dir=runs_dir)
+
+
+def remove_workspace(path: Optional[str]) -> None:
+    """Removes the directory of a run, if it still exists."""
+    if path and os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def cleanup_workspaces(runs_dir: str = RUNS_DIR, max_age: float = WORKSPACE_MAX_AGE) -> int:
+    """Removes the workspaces not modified for `max_age` seconds and returns how many were removed."""
+    if not os.path.isdir(runs_dir):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(runs_dir):
+        path = os.path.join(runs_dir, name)
+        if os.path.isdir(path) and now - os.path.getmtime(path) > max_age:
+            remove_workspace(path)
+            removed += 1
+    return removed
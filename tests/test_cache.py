@@ -0,0 +1,51 @@
+"""
+Checks of the expiry and eviction of the disk caches.
+"""
+import os
+import time
+
+from src.postulator.cache import DiskCache, prune_directory
+
+
+def test_entries_expire(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), ttl=0.2)
+    cache.set_json("key", {"value": 1})
+    assert cache.get_json("key") == {"value": 1}
+    time.sleep(0.3)
+    assert cache.get_json("key") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.set("a", b"1")
+    time.sleep(0.01)
+    cache.set("b", b"2")
+    time.sleep(0.01)
+    cache.get("a")
+    time.sleep(0.01)
+    cache.set("c", b"3")
+    assert sorted(cache.keys()) == ["a", "c"]
+
+
+def test_cache_size_is_bounded(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_bytes=250)
+    for key in "abc":
+        cache.set(key, b"x" * 100)
+        time.sleep(0.01)
+    assert sorted(cache.keys()) == ["b", "c"]
+    assert cache.stats()["bytes"] == 200
+
+
+def test_prune_directory_removes_oldest_entries(tmp_path):
+    now = time.time()
+    for i, name in enumerate(["old", "kept", "new"]):
+        entry = tmp_path / name
+        entry.mkdir()
+        (entry / "data").write_bytes(b"x" * 100)
+        os.utime(entry, (now - 100 + i, now - 100 + i))
+    (tmp_path / "trace.json").write_bytes(b"x" * 100)
+
+    prune_directory(str(tmp_path), 200, keep="kept")
+    assert sorted(os.listdir(tmp_path)) == ["kept", "trace.json"]
@@ -0,0 +1,60 @@
+"""
+Checks of the layout model against the layouts pdflatex gives to the sample letters.
+
+The layouts are recorded in `tests/data/layout_golden.json` by
+`python -m src.postulator.layout --golden tests/data/layout_golden.json`, so
+that the model is checked without pdflatex. Run with:
+    python -m pytest tests
+"""
+import json
+import os
+
+import pytest
+
+pytest.importorskip("crewai")
+
+from src.postulator.layout import REJECT_MARGIN_LINES, TOP_SKIP, predict_layout, sample_letter, sample_run_context
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "data", "layout_golden.json")
+
+
+def golden_layouts():
+    if not os.path.exists(GOLDEN_PATH):
+        return []
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.skipif(not golden_layouts(), reason="tests/data/layout_golden.json has not been generated with pdflatex")
+@pytest.mark.parametrize("golden", golden_layouts(), ids=lambda golden: f"{golden['sentences']}_sentences")
+def test_prediction_matches_pdflatex(tmp_path, golden):
+    run_context = sample_run_context(str(tmp_path))
+    prediction = predict_layout(sample_letter(golden["sentences"], run_context), run_context)
+    # The golden file belongs to the current sample letters
+    assert prediction.words == golden["words"]
+    assert prediction.pages == golden["pages"]
+    assert abs(prediction.overflow_lines - golden["overflow"]) <= REJECT_MARGIN_LINES
+    # A letter that fits on one page must never be sent back to the agent
+    if golden["pages"] == 1:
+        assert prediction.overflow_lines <= REJECT_MARGIN_LINES
+
+
+def test_pymupdf_text_block_matches_latex_geometry(tmp_path):
+    pymupdf = pytest.importorskip("pymupdf")
+    from src.postulator.renderers import BP_PER_PT, MARGIN_MM, PyMuPDFRenderer
+
+    run_context = sample_run_context(str(tmp_path))
+    result = PyMuPDFRenderer().render(sample_letter(4, run_context), run_context, "geometry")
+    with pymupdf.open(result.pdf_path) as document:
+        page = document[0]
+        lines = [line for block in page.get_text("dict")["blocks"] for line in block.get("lines", [])]
+        width = page.rect.width
+
+    margin = MARGIN_MM * 72 / 25.4
+    left = min(line["bbox"][0] for line in lines)
+    right = max(line["bbox"][2] for line in lines)
+    first_baseline = min(span["origin"][1] for line in lines for span in line["spans"])
+    assert left == pytest.approx(margin, abs=1)
+    # Justified lines reach the right margin
+    assert right == pytest.approx(width - margin, abs=2)
+    assert first_baseline == pytest.approx(margin + TOP_SKIP * BP_PER_PT, abs=1.5)
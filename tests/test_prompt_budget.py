@@ -0,0 +1,60 @@
+"""
+Checks of the schema compaction and of the budget shared by the context outputs.
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from src.postulator.prompt_budget import compact_schema, dedupe_blocks, share_budget
+
+
+class Item(BaseModel):
+    title: str = Field(..., description="Title of the item")
+    year: Optional[int] = Field(..., description="Year, null when unknown")
+    note: Optional[str] = None
+
+
+class Items(BaseModel):
+    items: List[Item]
+
+
+def walk(schema):
+    if isinstance(schema, dict):
+        yield schema
+        for value in schema.values():
+            yield from walk(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            yield from walk(value)
+
+
+def test_compact_schema_keeps_required_nullable_fields():
+    schema = compact_schema(Items.model_json_schema())
+    item = schema["$defs"]["Item"]
+
+    assert item["properties"]["year"]["type"] == ["integer", "null"]
+    assert item["properties"]["year"]["description"] == "Year, null when unknown"
+    # Optional fields may be left out instead of being null
+    assert item["properties"]["note"] == {"type": "string"}
+    assert sorted(item["required"]) == ["title", "year"]
+
+
+def test_compact_schema_drops_titles_only():
+    schema = compact_schema(Items.model_json_schema())
+
+    assert not any(isinstance(part.get("title"), str) for part in walk(schema))
+    # A field named title is not a title
+    assert schema["$defs"]["Item"]["properties"]["title"] == {"type": "string", "description": "Title of the item"}
+    assert schema["properties"]["items"]["items"] == {"$ref": "#/$defs/Item"}
+
+
+def test_dedupe_blocks_drops_repeated_long_paragraphs():
+    paragraph = "A long paragraph repeated in two outputs. " * 10
+    seen = set()
+    assert dedupe_blocks(f"{paragraph}\n\nshort", seen) == f"{paragraph}\n\nshort"
+    assert dedupe_blocks(f"short\n\n{paragraph}", seen) == "short"
+
+
+def test_share_budget_keeps_small_texts_whole():
+    assert share_budget([100, 5000, 3000], 2100) == [100, 1000, 1000]
+    assert share_budget([100, 200], 1000) == [100, 200]
@@ -0,0 +1,47 @@
+"""
+Checks of the usage counters kept in memory and flushed to the storage.
+"""
+import threading
+
+from src.postulator.quota import QuotaService
+from src.postulator.storage import SQLiteStorage
+
+
+def test_concurrent_increments_are_all_stored(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "storage.sqlite"))
+    service = QuotaService(storage, flush_interval=0)
+    threads, increments = 8, 25
+
+    def work():
+        for _ in range(increments):
+            service.increment("jane,doe", row={"Email": "jane@example.com"})
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert service.usage("jane,doe") == threads * increments
+    assert storage.get("usage", "jane,doe") is None
+    assert service.flush() == 1
+    row = storage.get("usage", "jane,doe")
+    assert row["Usage"] == threads * increments
+    assert row["Email"] == "jane@example.com"
+
+
+def test_services_sharing_a_storage_add_up(tmp_path):
+    # Two processes counting letters of the same user
+    storage = SQLiteStorage(str(tmp_path / "storage.sqlite"))
+    first = QuotaService(storage, flush_interval=0, count_ttl=0)
+    second = QuotaService(storage, flush_interval=0, count_ttl=0)
+
+    first.increment("jane,doe")
+    second.increment("jane,doe", 2)
+    first.flush()
+    second.flush()
+
+    assert storage.get("usage", "jane,doe")["Usage"] == 3
+    assert first.usage("jane,doe") == 3
+    assert not first.allowed("jane,doe", limit=3)
+    assert second.allowed("jane,doe", limit=4)
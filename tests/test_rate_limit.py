@@ -0,0 +1,70 @@
+"""
+Checks of the token buckets and of the round-robin between sessions.
+"""
+import threading
+import time
+
+import pytest
+
+from src.postulator.rate_limit import RateLimiter, _Buckets, key_id
+
+
+def test_buckets_refill_with_time():
+    buckets = _Buckets(rpm=60, tpm=6000)
+    state = buckets._new_state(0.0)
+    for _ in range(60):
+        assert buckets._take(state, 10, 0.0) == 0.0
+    # One request per second comes back
+    assert buckets._take(state, 10, 0.0) == pytest.approx(1.0)
+    assert buckets._take(state, 10, 1.0) == 0.0
+    assert buckets._take(state, 10, 1.0) == pytest.approx(1.0)
+
+
+def test_buckets_wait_for_tokens():
+    buckets = _Buckets(rpm=60, tpm=6000)
+    state = buckets._new_state(0.0)
+    assert buckets._take(state, 5000, 0.0) == 0.0
+    # 1000 tokens left, 100 tokens come back per second
+    assert buckets._take(state, 2000, 0.0) == pytest.approx(10.0)
+    assert buckets._take(state, 2000, 10.0) == 0.0
+    # A request larger than the bucket waits for the full bucket only
+    assert buckets._take(state, 10_000, 10.0) == pytest.approx(60.0)
+
+
+def test_refill_is_capped():
+    buckets = _Buckets(rpm=60, tpm=6000)
+    state = buckets._new_state(0.0)
+    buckets._take(state, 6000, 0.0)
+    buckets._refill(state, 3600.0)
+    assert state["requests"] == 60
+    assert state["tokens"] == 6000
+
+
+def test_sessions_are_served_round_robin():
+    # One request every 0.05s
+    limiter = RateLimiter(rpm=1200, tpm=None)
+    api_key = "key"
+    limiter.buckets._state[key_id(api_key)] = {"requests": 0.0, "tokens": 0.0, "updated_at": time.time()}
+    granted = []
+    lock = threading.Lock()
+
+    def request(session):
+        limiter.acquire(api_key, session=session)
+        with lock:
+            granted.append(session)
+
+    def start(session, depth):
+        thread = threading.Thread(target=request, args=(session,))
+        thread.start()
+        deadline = time.time() + 5
+        while limiter.stats().get(key_id(api_key), {}).get("queue_depth", 0) < depth and time.time() < deadline:
+            time.sleep(0.001)
+        return thread
+
+    # A busy session queues three requests before another one queues its first
+    threads = [start("busy", depth) for depth in range(1, 4)] + [start("other", 4)]
+    for thread in threads:
+        thread.join(10)
+
+    assert granted == ["busy", "other", "busy", "busy"]
+    assert limiter.stats()[key_id(api_key)]["granted"] == 4
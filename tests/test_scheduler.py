@@ -0,0 +1,105 @@
+"""
+Checks of the order in which `run_dag` runs the tasks of a crew.
+"""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("crewai")
+
+from crewai.tasks.task_output import TaskOutput
+from crewai.types.usage_metrics import UsageMetrics
+
+from src.postulator.scheduler import critical_path, run_dag
+
+
+class FakeTask:
+    """Task recording when it ran and the context it was given."""
+
+    def __init__(self, name, context=None, seconds=0.05):
+        self.name = name
+        self.context = context
+        self.seconds = seconds
+        self.description = f"Task {name}"
+        self.expected_output = ""
+        self.agent = None
+        self.tools = []
+        self.received_context = None
+        self.running = threading.Event()
+
+    def execute_sync(self, agent=None, context=None, tools=None):
+        self.received_context = context
+        self.running.set()
+        time.sleep(self.seconds)
+        return TaskOutput(description=self.description, raw=f"output of {self.name}", agent="")
+
+
+class FakeCrew:
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.agents = []
+        self.inputs = None
+
+    def _interpolate_inputs(self, inputs):
+        self.inputs = inputs
+
+    def calculate_usage_metrics(self):
+        return UsageMetrics()
+
+
+def test_tasks_run_after_their_context():
+    research = FakeTask("research")
+    resume = FakeTask("resume")
+    letter = FakeTask("letter", context=[research, resume])
+    review = FakeTask("review", context=[letter])
+    crew = FakeCrew([research, resume, letter, review])
+
+    result, timings = run_dag(crew, {"language": "English"})
+
+    assert crew.inputs == {"language": "English"}
+    assert [output.raw for output in result.tasks_output] == [f"output of {name}" for name in ["research", "resume", "letter", "review"]]
+    assert result.raw == "output of review"
+    assert timings["letter"].start >= max(timings["research"].end, timings["resume"].end)
+    assert timings["review"].start >= timings["letter"].end
+    assert timings["letter"].dependencies == ["research", "resume"]
+    assert letter.received_context == "output of research\n\n----------\n\noutput of resume"
+    assert critical_path(timings)[-2:] == ["letter", "review"]
+
+
+def test_independent_tasks_run_concurrently():
+    first = FakeTask("first", seconds=0.5)
+    second = FakeTask("second", seconds=0.5)
+    crew = FakeCrew([first, second, FakeTask("last", context=[first, second])])
+
+    _, timings = run_dag(crew, {}, max_workers=2)
+
+    assert timings["second"].start < timings["first"].end
+    assert timings["first"].start < timings["second"].end
+
+
+def test_precomputed_outputs_are_not_run_again():
+    research = FakeTask("research")
+    letter = FakeTask("letter", context=[research])
+    crew = FakeCrew([research, letter])
+
+    result, timings = run_dag(crew, {}, precomputed={"research": "cached research"})
+
+    assert not research.running.is_set()
+    assert timings["research"].precomputed
+    assert letter.received_context == "cached research"
+    assert result.tasks_output[0].raw == "cached research"
+
+
+def test_unsatisfiable_context_is_reported():
+    outside = FakeTask("outside")
+    orphan = FakeTask("orphan", context=[outside])
+    crew = FakeCrew([orphan])
+    # Tasks outside the crew are not dependencies; a cycle is
+    first = FakeTask("first")
+    second = FakeTask("second", context=[first])
+    first.context = [second]
+
+    assert run_dag(crew, {})[0].raw == "output of orphan"
+    with pytest.raises(ValueError, match="first, second"):
+        run_dag(FakeCrew([first, second]), {})
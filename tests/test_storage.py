@@ -0,0 +1,138 @@
+"""
+Checks of the SQLite storage and of the write-behind queue.
+"""
+import threading
+
+from src.postulator.storage import SQLiteStorage, WriteBehindStorage
+
+
+class FailingStorage(SQLiteStorage):
+    """SQLite storage whose next `put_many` fails, after running `during`."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.failures = 0
+        self.during = None
+
+    def put_many(self, table, rows, replace=True):
+        if self.during is not None:
+            self.during()
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("backend unavailable")
+        return super().put_many(table, rows, replace)
+
+
+class BlockingStorage(SQLiteStorage):
+    """SQLite storage whose `put_many` waits until `release` is set."""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def put_many(self, table, rows, replace=True):
+        self.started.set()
+        self.release.wait(10)
+        return super().put_many(table, rows, replace)
+
+
+def write_behind(backend):
+    # The background thread never flushes by itself during a test
+    return WriteBehindStorage(backend, flush_interval=3600, batch_size=1000)
+
+
+def test_sqlite_increment_under_threads(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "storage.sqlite"))
+    threads, increments = 8, 25
+
+    def work():
+        for _ in range(increments):
+            storage.increment("usage", "jane,doe", "Usage", 1, {"Name": "jane,doe", "Email": "jane@example.com"})
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    row = storage.get("usage", "jane,doe")
+    assert row["Usage"] == threads * increments
+    assert row["Email"] == "jane@example.com"
+    assert storage.count("usage") == 1
+
+
+def test_write_behind_flush_coalesces_writes(tmp_path):
+    backend = SQLiteStorage(str(tmp_path / "storage.sqlite"))
+    storage = write_behind(backend)
+    try:
+        storage.put("profiles", "key", {"Name": "Jane"})
+        storage.put("profiles", "key", {"Name": "Jane Doe"})
+        storage.put("cvs", "key", {"CV text": "resume"})
+        # Read your writes before they are persisted
+        assert storage.get("profiles", "key")["Name"] == "Jane Doe"
+        assert backend.get("profiles", "key") is None
+
+        assert storage.flush() == 2
+        assert backend.get("profiles", "key")["Name"] == "Jane Doe"
+        assert backend.get("cvs", "key")["CV text"] == "resume"
+        stats = storage.stats()
+        assert (stats["backlog"], stats["writes"], stats["coalesced"], stats["flushed"]) == (0, 3, 1, 2)
+    finally:
+        storage.stop()
+
+
+def test_write_behind_retries_failed_rows(tmp_path):
+    backend = FailingStorage(str(tmp_path / "storage.sqlite"))
+    storage = write_behind(backend)
+    try:
+        storage.put("profiles", "key", {"Name": "Jane"})
+        backend.failures = 1
+        assert storage.flush() == 0
+        assert storage.stats()["errors"] == 1
+        assert storage.backlog() == 1
+        assert storage.get("profiles", "key")["Name"] == "Jane"
+
+        assert storage.flush() == 1
+        assert storage.backlog() == 0
+        assert backend.get("profiles", "key")["Name"] == "Jane"
+    finally:
+        storage.stop()
+
+
+def test_write_behind_failed_flush_keeps_newer_write(tmp_path):
+    backend = FailingStorage(str(tmp_path / "storage.sqlite"))
+    storage = write_behind(backend)
+    try:
+        storage.put("profiles", "key", {"Name": "Jane"})
+        backend.failures = 1
+        backend.during = lambda: storage.put("profiles", "key", {"Name": "Jane Doe"})
+        storage.flush()
+        backend.during = None
+
+        assert storage.get("profiles", "key")["Name"] == "Jane Doe"
+        storage.flush()
+        assert backend.get("profiles", "key")["Name"] == "Jane Doe"
+    finally:
+        storage.stop()
+
+
+def test_write_behind_rows_readable_while_flushing(tmp_path):
+    backend = BlockingStorage(str(tmp_path / "storage.sqlite"))
+    storage = write_behind(backend)
+    try:
+        storage.put("profiles", "key", {"Name": "Jane"})
+        flush = threading.Thread(target=storage.flush)
+        flush.start()
+        assert backend.started.wait(10)
+        # Taken off the queue but not confirmed by the backend yet
+        assert storage.get("profiles", "key")["Name"] == "Jane"
+        assert storage.backlog() == 1
+
+        backend.release.set()
+        flush.join(10)
+        assert storage.backlog() == 0
+        assert backend.get("profiles", "key")["Name"] == "Jane"
+    finally:
+        backend.release.set()
+        storage.stop()